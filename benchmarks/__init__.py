@@ -0,0 +1 @@
+"""Benchmarks, load-testing and simulation tools."""
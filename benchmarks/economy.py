@@ -0,0 +1,354 @@
+"""Offline economy and balance simulator.
+
+Millions of player-days are simulated with NumPy arrays, one element per player,
+using the constants of deltaland.consts and the formulas and reward tables of
+deltaland.formulas, the same ones used by the game. The report shows the gold
+supply and where it comes from, the level distribution and the time players
+take to reach each level.
+
+The players behavior is modeled by the rates given as options, HP and items are
+not simulated.
+
+Usage: python -m benchmarks.economy --players 100000 --days 30
+"""
+import argparse
+import json
+from typing import Dict, List
+
+import numpy as np
+
+from deltaland.consts import (
+    BATTLE_INTERVAL,
+    CAULDRON_GIFT,
+    DICE_FEE,
+    MAX_LEVEL,
+    MAX_STAMINA,
+    STAMINA_COOLDOWN,
+    STARTING_GOLD,
+    STARTING_LEVEL,
+)
+from deltaland.experience import required_exp
+from deltaland.formulas import (
+    BATTLE_OUTCOMES,
+    INTERFERE_EXP,
+    INTERFERE_GOLD,
+    THIEVE_EXP,
+    battle_reward_range,
+    interfere_gold_range,
+    thieve_gold_range,
+)
+from deltaland.quests import OutcomeQuest, ThieveQuest, quests
+
+DAY = 60 * 60 * 24
+SOURCES = ("quests", "thieving", "interfere", "battle", "cauldron")
+SINKS = ("cauldron_coins", "stopped_thieves")
+
+
+def _by_level(func) -> np.ndarray:
+    """Table of the (min, max) ranges returned by func for each level."""
+    return np.array([func(level) for level in range(MAX_LEVEL + 1)])
+
+
+class Economy:
+    """State of the simulated players."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.rng = np.random.default_rng(args.seed)
+        players = args.players
+        self.level = np.full(players, STARTING_LEVEL, dtype=np.int64)
+        self.exp = np.zeros(players, dtype=np.int64)
+        self.gold = np.full(players, STARTING_GOLD, dtype=np.int64)
+        self.stamina = np.full(players, float(MAX_STAMINA))
+        # time in seconds each player reached each level, -1 if not reached yet
+        self.reached_at = np.full((players, MAX_LEVEL + 1), -1.0)
+        self.reached_at[:, : STARTING_LEVEL + 1] = 0
+        # experience needed to go from each level to the next one
+        self.required = np.array(
+            [required_exp(level + 1) if level > 0 else 0 for level in range(MAX_LEVEL)]
+            + [0]
+        )
+        self.thieve_gold = _by_level(thieve_gold_range)
+        self.interfere_gold = _by_level(interfere_gold_range)
+        self.battle_reward = _by_level(battle_reward_range)
+        commands = {quest.command_name: quest for quest in quests.values()}
+        self.quest = commands[args.quest]
+        if not isinstance(self.quest, OutcomeQuest):
+            raise ValueError(f"{args.quest} is not a quest with an outcome table")
+        self.thieve = next(
+            quest for quest in quests.values() if isinstance(quest, ThieveQuest)
+        )
+        outcomes = self.quest.get_outcomes()
+        self.quest_chances = np.array([chance for chance, _ in outcomes])
+        self.quest_gold = np.array([reward.gold for _, reward in outcomes])
+        self.quest_exp = np.array([reward.exp for _, reward in outcomes])
+        # players choose any tactic, the goblin any of GOBLIN_TACTICS
+        tactics = list(BATTLE_OUTCOMES)
+        self.battle_victory = np.array([BATTLE_OUTCOMES[t].victory for t in tactics])
+        self.battle_exp_divisor = np.array(
+            [BATTLE_OUTCOMES[t].exp_divisor for t in tactics]
+        )
+        self.minted = {key: 0 for key in SOURCES}
+        self.burned = {key: 0 for key in SINKS}
+        self.days: List[dict] = []
+
+    def _randint(self, ranges: np.ndarray) -> np.ndarray:
+        """Random integers within an array of inclusive (min, max) ranges."""
+        return self.rng.integers(ranges[:, 0], ranges[:, 1] + 1)
+
+    def _add_exp(self, players: np.ndarray, exp: np.ndarray, now: float) -> None:
+        exp = np.where(self.level[players] < MAX_LEVEL, exp, 0)
+        np.add.at(self.exp, players, exp)
+        while True:
+            level = self.level
+            leveled = (level < MAX_LEVEL) & (self.exp >= self.required[level])
+            if not leveled.any():
+                break
+            self.exp[leveled] -= self.required[level[leveled]]
+            self.level[leveled] += 1
+            self.stamina[leveled] = np.maximum(self.stamina[leveled], MAX_STAMINA)
+            indexes = np.nonzero(leveled)[0]
+            self.reached_at[indexes, self.level[indexes]] = now
+
+    def _mint(self, source: str, players: np.ndarray, gold: np.ndarray) -> None:
+        np.add.at(self.gold, players, gold)
+        self.minted[source] += int(gold.sum())
+
+    def _burn(self, sink: str, players: np.ndarray, gold: np.ndarray) -> None:
+        np.subtract.at(self.gold, players, gold)
+        self.burned[sink] += int(gold.sum())
+
+    def play_session(self, now: float, regen: float) -> None:
+        """Players spend all their stamina in quests."""
+        self.stamina = np.minimum(self.stamina + regen, MAX_STAMINA)
+        thieve = self.thieve
+        for _ in range(MAX_STAMINA):
+            active = np.nonzero(self.stamina >= 1)[0]
+            if not active.size:
+                break
+            thieving = (
+                (self.level[active] >= thieve.required_level)
+                & (self.stamina[active] >= thieve.stamina_cost)
+                & (self.rng.random(active.size) < self.args.thieve_rate)
+            )
+            self._wander(active[~thieving], now)
+            self._thieve(active[thieving], now)
+
+    def _wander(self, players: np.ndarray, now: float) -> None:
+        self.stamina[players] -= self.quest.stamina_cost
+        outcome = self.rng.choice(
+            len(self.quest_chances), size=players.size, p=self.quest_chances
+        )
+        self._mint("quests", players, self._randint(self.quest_gold[outcome]))
+        self._add_exp(players, self._randint(self.quest_exp[outcome]), now)
+
+    def _thieve(self, players: np.ndarray, now: float) -> None:
+        self.stamina[players] -= self.thieve.stamina_cost
+        stopped = self.rng.random(players.size) < self.args.interfere_rate
+        thieves = players[~stopped]
+        gold = self._randint(self.thieve_gold[self.level[thieves]])
+        self._mint("thieving", thieves, gold)
+        exp = self.rng.integers(THIEVE_EXP[0], THIEVE_EXP[1] + 1, thieves.size)
+        self._add_exp(thieves, exp, now)
+
+        thieves = players[stopped]
+        if not thieves.size:
+            return
+        lost = self._randint(self.interfere_gold[self.level[thieves]])
+        self._burn("stopped_thieves", thieves, np.minimum(lost, self.gold[thieves]))
+        # a random player noticed and stopped each thief
+        sentinels = self.rng.integers(0, self.args.players, thieves.size)
+        gold = self.rng.integers(INTERFERE_GOLD[0], INTERFERE_GOLD[1] + 1, thieves.size)
+        self._mint("interfere", sentinels, gold)
+        exp = self.rng.integers(INTERFERE_EXP[0], INTERFERE_EXP[1] + 1, thieves.size)
+        self._add_exp(sentinels, exp, now)
+
+    def battle(self, now: float) -> None:
+        players = np.nonzero(
+            self.rng.random(self.args.players) < self.args.battle_rate
+        )[0]
+        outcome = self.rng.integers(0, len(self.battle_victory), players.size)
+        reward = self.battle_reward[self.level[players]]
+        gold = self._randint(reward)
+        base_exp = self._randint(reward)
+        victory = self.battle_victory[outcome]
+        self._mint("battle", players[victory], gold[victory])
+        exp = np.maximum(base_exp // self.battle_exp_divisor[outcome], 1)
+        self._add_exp(players, exp, now)
+
+    def end_day(self, day: int) -> None:
+        rng = self.rng
+        players = np.nonzero(
+            (self.gold >= 1) & (rng.random(self.args.players) < self.args.cauldron_rate)
+        )[0]
+        if players.size:
+            self._burn("cauldron_coins", players, np.ones(players.size, dtype=np.int64))
+            winner = rng.choice(players, 1)
+            self._mint("cauldron", winner, np.array([CAULDRON_GIFT]))
+
+        # dice games move gold between players without changing the supply
+        players = np.nonzero(
+            (self.gold >= DICE_FEE)
+            & (rng.random(self.args.players) < self.args.dice_rate)
+        )[0]
+        players = rng.permutation(players)[: players.size // 2 * 2].reshape(-1, 2)
+        self.gold[players[:, 0]] += DICE_FEE
+        self.gold[players[:, 1]] -= DICE_FEE
+
+        self.days.append(
+            {
+                "day": day + 1,
+                "gold_supply": int(self.gold.sum()),
+                "minted": dict(self.minted),
+                "burned": dict(self.burned),
+                "mean_level": float(self.level.mean()),
+            }
+        )
+        self.minted = {key: 0 for key in SOURCES}
+        self.burned = {key: 0 for key in SINKS}
+
+    def run(self) -> None:
+        sessions = self.args.sessions
+        step = DAY / sessions
+        regen = step / STAMINA_COOLDOWN
+        next_battle = BATTLE_INTERVAL
+        for day in range(self.args.days):
+            for session in range(sessions):
+                now = day * DAY + (session + 1) * step
+                self.play_session(now, regen)
+                while next_battle <= now:
+                    self.battle(next_battle)
+                    next_battle += BATTLE_INTERVAL
+            self.end_day(day)
+
+    def get_report(self) -> dict:
+        levels = np.bincount(self.level, minlength=MAX_LEVEL + 1)
+        time_to_level: Dict[int, dict] = {}
+        for level in range(STARTING_LEVEL + 1, MAX_LEVEL + 1):
+            times = self.reached_at[:, level]
+            times = times[times >= 0]
+            time_to_level[level] = {
+                "reached": int(times.size),
+                "p10_seconds": float(np.percentile(times, 10)) if times.size else None,
+                "p50_seconds": float(np.percentile(times, 50)) if times.size else None,
+                "p90_seconds": float(np.percentile(times, 90)) if times.size else None,
+            }
+        gold = np.percentile(self.gold, [10, 50, 90])
+        return {
+            "players": self.args.players,
+            "days": self.args.days,
+            "player_days": self.args.players * self.args.days,
+            "gold_supply": int(self.gold.sum()),
+            "gold_p10_p50_p90": [float(value) for value in gold],
+            "levels": {
+                level: int(count)
+                for level, count in enumerate(levels)
+                if level >= STARTING_LEVEL
+            },
+            "time_to_level": time_to_level,
+            "per_day": self.days,
+        }
+
+
+def _duration(seconds) -> str:
+    if seconds is None:
+        return "-"
+    return f"{seconds / DAY:.1f}d"
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{report['players']} players, {report['days']} days"
+        f" ({report['player_days']} player-days)"
+    )
+    print()
+    header = f"{'day':>5}{'supply':>14}" + "".join(f"{key:>12}" for key in SOURCES)
+    header += "".join(f"{key:>16}" for key in SINKS)
+    print(header)
+    print("-" * len(header))
+    for day in report["per_day"]:
+        line = f"{day['day']:>5}{day['gold_supply']:>14}"
+        line += "".join(f"{day['minted'][key]:>12}" for key in SOURCES)
+        line += "".join(f"{day['burned'][key]:>16}" for key in SINKS)
+        print(line)
+    print("-" * len(header))
+    p10, p50, p90 = report["gold_p10_p50_p90"]
+    print(f"gold per player: p10 {p10:.0f}  p50 {p50:.0f}  p90 {p90:.0f}")
+    print()
+    header = f"{'level':>5}{'players':>10}{'reached':>10}{'p10':>8}{'p50':>8}{'p90':>8}"
+    print(header)
+    print("-" * len(header))
+    for level, count in report["levels"].items():
+        times = report["time_to_level"].get(level, {})
+        print(
+            f"{level:>5}{count:>10}{times.get('reached', report['players']):>10}"
+            f"{_duration(times.get('p10_seconds', 0)):>8}"
+            f"{_duration(times.get('p50_seconds', 0)):>8}"
+            f"{_duration(times.get('p90_seconds', 0)):>8}"
+        )
+    print("-" * len(header))
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=100000, help="number of players")
+    parser.add_argument("--days", type=int, default=30, help="number of days")
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=4,
+        help="play sessions per day, players spend all their stamina in each (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--quest",
+        default="/wander",
+        help="quest done when not thieving (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--thieve-rate",
+        type=float,
+        default=0.3,
+        help="chance of thieving instead of wandering when possible (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--interfere-rate",
+        type=float,
+        default=0.5,
+        help="chance of a thief being stopped (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--battle-rate",
+        type=float,
+        default=0.5,
+        help="chance of joining each battle (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cauldron-rate",
+        type=float,
+        default=0.5,
+        help="chance of tossing a coin in the cauldron each day (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--dice-rate",
+        type=float,
+        default=0.2,
+        help="chance of playing dice each day (default: %(default)s)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--json", action="store_true", help="output results as JSON")
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+    economy = Economy(args)
+    economy.run()
+    report = economy.get_report()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""In-process stand-in for the Delta Chat bot.
+
+The fake objects mimic the small subset of the Bot/Account/Contact/Chat API used by
+the game and record every outgoing message instead of calling the JSON-RPC server.
+"""
+import os
+from argparse import Namespace
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+from deltabot_cli import AttrDict, const, events
+
+from deltaland.consts import STARTING_LEVEL
+from deltaland.hooks import cli
+from deltaland.orm import Player, async_session
+
+_replies: ContextVar[Optional[list]] = ContextVar("replies", default=None)
+
+
+class SentMessage:
+    def __init__(self, contact_id: int, kwargs: dict) -> None:
+        self.contact_id = contact_id
+        self.text = kwargs.get("text")
+        self.file = kwargs.get("file")
+        self.kwargs = kwargs
+
+
+class FakeChat:
+    def __init__(self, account: "FakeAccount", contact_id: int) -> None:
+        self.account = account
+        self.id = contact_id
+
+    async def send_message(self, **kwargs) -> None:
+        msg = SentMessage(self.id, kwargs)
+        self.account.outbox.append(msg)
+        replies = _replies.get()
+        if replies is not None:
+            replies.append(msg)
+
+    async def send_text(self, text: str) -> None:
+        await self.send_message(text=text)
+
+    async def get_basic_snapshot(self) -> AttrDict:
+        return AttrDict(id=self.id, chat_type=const.ChatType.SINGLE)
+
+
+class FakeContact:
+    def __init__(self, account: "FakeAccount", contact_id: int) -> None:
+        self.account = account
+        self.id = contact_id
+
+    async def create_chat(self) -> FakeChat:
+        return FakeChat(self.account, self.id)
+
+    async def get_snapshot(self) -> AttrDict:
+        return AttrDict(
+            id=self.id,
+            address=self.account.get_address(self.id),
+            display_name=f"Player {self.id}",
+        )
+
+
+class FakeAccount:
+    def __init__(self, addr: str = "bot@example.org") -> None:
+        self.outbox: List[SentMessage] = []
+        self._config: Dict[str, Optional[str]] = {"addr": addr}
+
+    @staticmethod
+    def get_address(contact_id: int) -> str:
+        return f"player{contact_id}@example.org"
+
+    def get_contact_by_id(self, contact_id: int) -> FakeContact:
+        return FakeContact(self, contact_id)
+
+    async def get_config(self, key: str) -> Optional[str]:
+        return self._config.get(key)
+
+    async def set_config(self, key: str, value: Optional[str] = None) -> None:
+        self._config[key] = value
+
+
+class FakeBot:
+    """Bot that dispatches simulated incoming messages to the registered hooks."""
+
+    def __init__(self) -> None:
+        self.account = FakeAccount()
+        self._hooks: Set[Tuple[Callable, events.EventFilter]] = set()
+        self._msg_id = 0
+
+    def add_hook(
+        self, hook: Callable, event: Union[type, events.EventFilter] = events.RawEvent
+    ) -> None:
+        if isinstance(event, type):
+            event = event()
+        self._hooks.add((hook, event))
+
+    def add_hooks(self, hooks) -> None:
+        for hook, event in hooks:
+            self.add_hook(hook, event)
+
+    def remove_hook(self, hook: Callable, event: events.EventFilter) -> None:
+        self._hooks.discard((hook, event))
+
+    def get_commands(self) -> Dict[str, Callable]:
+        return {
+            event.command: hook
+            for hook, event in self._hooks
+            if isinstance(event, events.NewMessage) and event.command
+        }
+
+    def _get_fallback_hooks(self) -> List[Callable]:
+        return [
+            hook
+            for hook, event in self._hooks
+            if isinstance(event, events.NewMessage)
+            and not event.command
+            and not event.pattern
+        ]
+
+    def _parse_command(
+        self, text: str, commands: Dict[str, Callable]
+    ) -> Tuple[str, str]:
+        parts = text.split(maxsplit=1)
+        cmd = parts[0] if parts else ""
+        payload = parts[1] if len(parts) > 1 else ""
+        cmd_parts = cmd.split("_")
+        while cmd_parts:
+            _cmd = "_".join(cmd_parts)
+            if _cmd in commands:
+                return _cmd, payload
+            payload = (cmd_parts.pop() + " " + payload).rstrip()
+        return "", text
+
+    async def send_text(self, contact_id: int, text: str) -> List[SentMessage]:
+        """Simulate an incoming text message from the given contact.
+
+        Return the messages sent by the bot while handling the message.
+        """
+        replies: List[SentMessage] = []
+        token = _replies.set(replies)
+        try:
+            await self._dispatch(contact_id, text)
+        finally:
+            _replies.reset(token)
+        return replies
+
+    async def _dispatch(self, contact_id: int, text: str) -> None:
+        self._msg_id += 1
+        contact = self.account.get_contact_by_id(contact_id)
+        snapshot = AttrDict(
+            id=self._msg_id,
+            text=text,
+            is_info=False,
+            sender=contact,
+            chat=FakeChat(self.account, contact_id),
+        )
+        commands = self.get_commands()
+        command, payload = self._parse_command(text, commands)
+        event = AttrDict(command=command, payload=payload, message_snapshot=snapshot)
+        if command:
+            await commands[command](event)
+        else:
+            for hook in self._get_fallback_hooks():
+                await hook(event)
+
+
+def get_args(config_dir: str, **kwargs) -> Namespace:
+    """Get bot CLI arguments, options not given in kwargs get their default value."""
+    args = Namespace(
+        config_dir=config_dir,
+        admin=[],
+        stats=False,
+        stats_interval=0,
+        trace_lock=False,
+        write_batch_window=0,
+        write_batch_size=50,
+        background_migrations=False,
+        backup_interval=0,
+        metrics_port=0,
+        metrics_host="127.0.0.1",
+    )
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return args
+
+
+async def start_game(config_dir: str, **kwargs) -> FakeBot:
+    """Initialize the game with a fake bot using the real hooks and startup code.
+
+    Extra keyword arguments are passed as CLI options, see get_args()
+    """
+    bot = FakeBot()
+    args = get_args(config_dir, **kwargs)
+    os.makedirs(config_dir, exist_ok=True)
+    bot.add_hooks(cli._hooks)  # noqa
+    await cli._on_init(bot, args)  # noqa
+    await cli._on_start(bot, args)  # noqa
+    return bot
+
+
+async def join_players(bot: FakeBot, count: int, level: int = 0) -> List[int]:
+    """Add the given number of players to the game in bulk, return their ids."""
+    first_id = 100  # ids below are reserved for special contacts
+    player_ids = list(range(first_id, first_id + count))
+    level = level or STARTING_LEVEL
+    async with async_session() as session:
+        async with session.begin():
+            session.add_all(
+                Player(id=player_id, level=level, skill_points=level - 1)
+                for player_id in player_ids
+            )
+    bot.account.outbox.clear()
+    return player_ids
@@ -0,0 +1,217 @@
+"""Load generator driving the real game hooks with simulated players.
+
+Usage: python -m benchmarks.loadtest --players 10000 --commands 20000
+"""
+import argparse
+import asyncio
+import json
+import random
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from deltaland import stats
+from deltaland.orm import enable_strict_loading
+
+from .fakebot import FakeBot, join_players, start_game
+
+DEFAULT_MIX = "/me=40,/wander=15,/dice=10,/hit=10,/top2=5,/inv=10,/battle=5,/quests=5"
+
+
+def parse_mix(mix: str) -> List[Tuple[str, int]]:
+    """Parse a command mix like "/me=3,/wander=1" into (command, weight) pairs."""
+    commands = []
+    for entry in mix.split(","):
+        cmd, _, weight = entry.strip().partition("=")
+        if not cmd.startswith("/"):
+            cmd = "/" + cmd
+        commands.append((cmd, int(weight or 1)))
+    return commands
+
+
+def percentile(sorted_values: Sequence[float], percent: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence."""
+    if not sorted_values:
+        return 0.0
+    index = max(
+        0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values)) - 1)
+    )
+    return sorted_values[index]
+
+
+def summarize(latencies: Dict[str, List[float]], messages: Dict[str, int]) -> dict:
+    results = {}
+    for cmd, values in sorted(latencies.items()):
+        values.sort()
+        results[cmd] = {
+            "count": len(values),
+            "messages": messages.get(cmd, 0),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": values[-1] * 1000,
+        }
+    return results
+
+
+async def _worker(
+    bot: FakeBot,
+    queue: asyncio.Queue,
+    latencies: Dict[str, List[float]],
+    messages: Dict[str, int],
+) -> None:
+    while True:
+        try:
+            player_id, text = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        start = time.perf_counter()
+        replies = await bot.send_text(player_id, text)
+        latencies.setdefault(text, []).append(time.perf_counter() - start)
+        messages[text] = messages.get(text, 0) + len(replies)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    rand = random.Random(args.seed)
+    tmp_dir = tempfile.mkdtemp()
+    if args.strict_loading:
+        enable_strict_loading()
+    try:
+        bot = await start_game(
+            args.config_dir or tmp_dir,
+            stats=args.stats,
+            write_batch_window=args.write_batch_window,
+            write_batch_size=args.write_batch_size,
+        )
+        start = time.perf_counter()
+        player_ids = await join_players(bot, args.players, args.level)
+        setup_time = time.perf_counter() - start
+
+        mix = parse_mix(args.mix)
+        cmds = [cmd for cmd, _ in mix]
+        weights = [weight for _, weight in mix]
+        queue: asyncio.Queue = asyncio.Queue()
+        for _ in range(args.commands):
+            queue.put_nowait(
+                (rand.choice(player_ids), rand.choices(cmds, weights=weights)[0])
+            )
+
+        latencies: Dict[str, List[float]] = {}
+        messages: Dict[str, int] = {}
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[_worker(bot, queue, latencies, messages) for _ in range(args.concurrency)]
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        # the cooldown loop keeps running in background, ignore its leftovers
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    total_msgs = sum(messages.values())
+    return {
+        "players": args.players,
+        "commands": args.commands,
+        "concurrency": args.concurrency,
+        "write_batch_window": args.write_batch_window,
+        "setup_seconds": setup_time,
+        "elapsed_seconds": elapsed,
+        "commands_per_second": args.commands / elapsed if elapsed else 0,
+        "messages": total_msgs,
+        "messages_per_second": total_msgs / elapsed if elapsed else 0,
+        "per_command": summarize(latencies, messages),
+    }
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{report['players']} players, {report['commands']} commands,"
+        f" concurrency {report['concurrency']}"
+        f", write batch window {report['write_batch_window']}ms"
+        f" (setup: {report['setup_seconds']:.2f}s)"
+    )
+    header = f"{'command':<12}{'count':>8}{'msgs':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for cmd, cmd_stats in report["per_command"].items():
+        print(
+            f"{cmd:<12}{cmd_stats['count']:>8}{cmd_stats['messages']:>8}"
+            f"{cmd_stats['p50_ms']:>10.2f}{cmd_stats['p95_ms']:>10.2f}"
+            f"{cmd_stats['p99_ms']:>10.2f}{cmd_stats['max_ms']:>10.2f}"
+        )
+    print("-" * len(header))
+    print(
+        f"elapsed: {report['elapsed_seconds']:.2f}s"
+        f"  commands/s: {report['commands_per_second']:.1f}"
+        f"  messages/s: {report['messages_per_second']:.1f}"
+    )
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=1000, help="number of players")
+    parser.add_argument(
+        "--commands", type=int, default=5000, help="total number of commands to send"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=100,
+        help="number of players sending commands at the same time",
+    )
+    parser.add_argument(
+        "--mix",
+        default=DEFAULT_MIX,
+        help=f"weighted command mix (default: {DEFAULT_MIX})",
+    )
+    parser.add_argument(
+        "--level", type=int, default=3, help="initial level of the simulated players"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--config-dir",
+        help="directory for the game database (default: temporary directory)",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="enable the bot statistics and print the /stats report at the end",
+    )
+    parser.add_argument(
+        "--write-batch-window",
+        type=float,
+        default=0,
+        metavar="MS",
+        help="commit together the writes of the commands received within MS milliseconds (default: disabled)",
+    )
+    parser.add_argument(
+        "--write-batch-size",
+        type=int,
+        default=50,
+        metavar="N",
+        help="maximum number of commands committed together (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--strict-loading",
+        action="store_true",
+        help="fail on lazy loads, to check that commands use the right loading profile",
+    )
+    parser.add_argument("--json", action="store_true", help="output results as JSON")
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    if args.stats:
+        print()
+        print(stats.get_report())
+
+
+if __name__ == "__main__":
+    main()
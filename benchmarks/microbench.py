@@ -0,0 +1,193 @@
+"""Microbenchmarks of the pure game logic run per player per tick.
+
+Each benchmark is warmed up and calibrated to run for at least --min-time seconds,
+then timed --repeat times, the minimum and median time per call are reported.
+
+Usage: python -m benchmarks.microbench --json > before.json
+Compare with a previous run: python -m benchmarks.microbench --compare before.json
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+import timeit
+from typing import Callable, Dict
+
+from deltaland.consts import CombatTactic
+from deltaland.cooldown import resolve_battle
+from deltaland.dice import dices2str
+from deltaland.experience import required_exp
+from deltaland.game import (
+    get_next_battle_timestamp,
+    get_next_day_timestamp,
+    get_next_month_timestamp,
+    get_next_year_timestamp,
+)
+from deltaland.orm import BattleReport, Player
+from deltaland.quests import get_quest
+from deltaland.util import calculate_thieve_gold, human_time_duration, render_stats
+
+
+def _new_player() -> Player:
+    return Player(
+        id=100,
+        name="Tester",
+        level=5,
+        exp=0,
+        hp=50,
+        max_hp=50,
+        stamina=5,
+        max_stamina=5,
+        skill_points=0,
+    )
+
+
+def _increase_exp() -> Callable[[], None]:
+    player = _new_player()
+
+    def func() -> None:
+        player.level = 5
+        player.exp = 0
+        player.increase_exp(100)  # levels up once
+
+    return func
+
+
+def _get_battle_report() -> Callable[[], None]:
+    player = _new_player()
+    player.battle_report = BattleReport(
+        tactic=CombatTactic.HIT, monster_tactic=CombatTactic.FEINT, exp=3, gold=2, hp=0
+    )
+    return player.get_battle_report
+
+
+def _resolve_battle() -> Callable[[], None]:
+    player = _new_player()
+    tactics = (CombatTactic.HIT, CombatTactic.FEINT, CombatTactic.PARRY)
+
+    def func() -> None:
+        player.hp = player.max_hp
+        for tactic in tactics:
+            resolve_battle(player, tactic)
+
+    return func
+
+
+def _quest_result() -> Callable[[], None]:
+    quest = get_quest(1)
+    player = _new_player()
+    return lambda: quest.get_result(player)
+
+
+def get_benchmarks() -> Dict[str, Callable[[], Callable[[], None]]]:
+    """Get the benchmark factories, each returns the function to time."""
+    now = int(time.time())
+    return {
+        "required_exp": lambda: lambda: required_exp(9),
+        "Player.increase_exp": _increase_exp,
+        "Player.get_battle_report": _get_battle_report,
+        "resolve_battle (3 tactics)": _resolve_battle,
+        "Quest.get_result (/wander)": _quest_result,
+        "calculate_thieve_gold": lambda: lambda: calculate_thieve_gold(15),
+        "human_time_duration": lambda: lambda: human_time_duration(93784),
+        "render_stats": lambda: lambda: render_stats(1, 5, 2, 3),
+        "dices2str": lambda: lambda: dices2str((3, 6)),
+        "get_next_battle_timestamp": lambda: lambda: get_next_battle_timestamp(now),
+        "get_next_day_timestamp": lambda: get_next_day_timestamp,
+        "get_next_month_timestamp": lambda: get_next_month_timestamp,
+        "get_next_year_timestamp": lambda: get_next_year_timestamp,
+    }
+
+
+def run_benchmark(func: Callable[[], None], repeat: int, min_time: float) -> dict:
+    timer = timeit.Timer(func)
+    # warmup and calibration: find a number of calls that takes at least min_time
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed * 10 >= min_time else 10
+    timings = [elapsed / number for elapsed in timer.repeat(repeat, number)]
+    return {
+        "calls": number,
+        "repeat": repeat,
+        "min_ns": min(timings) * 1e9,
+        "median_ns": statistics.median(timings) * 1e9,
+        "stdev_ns": statistics.stdev(timings) * 1e9 if repeat > 1 else 0.0,
+    }
+
+
+def run(args: argparse.Namespace) -> dict:
+    random.seed(args.seed)
+    results = {}
+    for name, factory in get_benchmarks().items():
+        if args.filter and not any(word in name for word in args.filter):
+            continue
+        results[name] = run_benchmark(factory(), args.repeat, args.min_time)
+    return {"repeat": args.repeat, "min_time": args.min_time, "results": results}
+
+
+def print_report(report: dict, previous: dict) -> None:
+    header = f"{'benchmark':<30}{'calls':>10}{'min ns':>12}{'median ns':>12}{'stdev':>10}{'change':>10}"
+    print(header)
+    print("-" * len(header))
+    old_results = previous.get("results", {})
+    for name, result in report["results"].items():
+        old = old_results.get(name)
+        change = f"{result['min_ns'] / old['min_ns'] - 1:+.1%}" if old else "-"
+        print(
+            f"{name:<30}{result['calls']:>10}{result['min_ns']:>12.1f}"
+            f"{result['median_ns']:>12.1f}{result['stdev_ns']:>10.1f}{change:>10}"
+        )
+    print("-" * len(header))
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=7,
+        help="number of timed runs of each benchmark (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.1,
+        metavar="SECONDS",
+        help="minimum duration of each timed run (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--filter",
+        nargs="*",
+        default=[],
+        metavar="NAME",
+        help="only run the benchmarks whose name contains one of the given words",
+    )
+    parser.add_argument(
+        "--compare",
+        metavar="FILE",
+        help="JSON results of a previous run to compare the minimum times against",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--json", action="store_true", help="output results as JSON")
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        previous = {}
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as file:
+                previous = json.load(file)
+        print_report(report, previous)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Query-count regression suite running every command against a seeded database.
+
+Each command registered by the game hooks is sent by a sample of players of a
+database seeded with thousands of players, counting the SQL statements executed,
+the ORM rows loaded and the time taken. The results are compared against the
+checked-in baseline and any command issuing more queries or loading more rows
+than before makes the run fail.
+
+Usage: python -m benchmarks.querycount --check
+Update the baseline after an intended change: python -m benchmarks.querycount --update
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from contextvars import ContextVar
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from deltaland.consts import MAX_LEVEL, RANKS_REQ_LEVEL, EquipmentSlot
+from deltaland.orm import (
+    Base,
+    BattleRank,
+    BattleReport,
+    CauldronCoin,
+    CauldronRank,
+    DiceRank,
+    Item,
+    Player,
+    SentinelRank,
+    Skill,
+    async_session,
+)
+
+from .fakebot import FakeBot, start_game
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "querycount_baseline.json")
+FIRST_PLAYER_ID = 100
+ITEMS_PER_PLAYER = 3  # two in the bag and one equipped
+# message sent to trigger each command, {bag_item} and {equipped_item} are replaced
+# with an item of the player, commands not listed here are sent without arguments
+COMMAND_TEXTS = {
+    "/buy": "/buy_001",
+    "/learn": "/learn_001",
+    "/name": "/name Tester",
+    "/off": "/off_{equipped_item}",
+    "/on": "/on_{bag_item}",
+    "/sell": "/sell_{bag_item}",
+}
+
+_counter: ContextVar[Optional["Counter"]] = ContextVar("counter", default=None)
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.queries = 0
+        self.rows = 0
+
+
+def _on_query(*_args) -> None:
+    counter = _counter.get()
+    if counter:
+        counter.queries += 1
+
+
+def _on_load(*_args) -> None:
+    counter = _counter.get()
+    if counter:
+        counter.rows += 1
+
+
+async def seed_database(players: int, seed: int) -> List[int]:
+    """Add players with items, skills, ranks and battle reports, return their ids."""
+    rand = random.Random(seed)
+    player_ids = list(range(FIRST_PLAYER_ID, FIRST_PLAYER_ID + players))
+    objects: list = []
+    for player_id in player_ids:
+        level = rand.randint(RANKS_REQ_LEVEL, MAX_LEVEL)
+        objects.append(
+            Player(
+                id=player_id,
+                name=f"Player{player_id}",
+                level=level,
+                skill_points=1,
+                gold=rand.randint(50, 500),
+            )
+        )
+        first_item = (player_id - FIRST_PLAYER_ID) * ITEMS_PER_PLAYER + 1
+        objects.append(Item(id=first_item, player_id=player_id, base_id=1))
+        objects.append(Item(id=first_item + 1, player_id=player_id, base_id=2))
+        objects.append(
+            Item(
+                id=first_item + 2,
+                player_id=player_id,
+                base_id=1,
+                slot=EquipmentSlot.HANDS,
+            )
+        )
+        objects.append(Skill(id=2, player_id=player_id, level=rand.randint(1, 3)))
+        if rand.random() < 0.5:
+            objects.append(BattleRank(id=player_id, victories=rand.randint(1, 30)))
+            objects.append(
+                BattleReport(
+                    id=player_id, tactic=0, monster_tactic=1, hp=-5, exp=3, gold=2
+                )
+            )
+        if rand.random() < 0.3:
+            objects.append(CauldronRank(id=player_id, gold=rand.randint(1, 100)))
+            objects.append(DiceRank(id=player_id, gold=rand.randint(1, 100)))
+            objects.append(SentinelRank(id=player_id, stopped=rand.randint(1, 10)))
+        if rand.random() < 0.2:
+            objects.append(CauldronCoin(id=player_id))
+    async with async_session() as session:
+        async with session.begin():
+            session.add_all(objects)
+    return player_ids
+
+
+def get_text(command: str, player_id: int) -> str:
+    first_item = (player_id - FIRST_PLAYER_ID) * ITEMS_PER_PLAYER + 1
+    text = COMMAND_TEXTS.get(command, command)
+    return text.format(
+        bag_item=f"{first_item:03}", equipped_item=f"{first_item + 2:03}"
+    )
+
+
+async def measure(bot: FakeBot, command: str, player_ids: List[int]) -> dict:
+    """Send the command from each of the given players, return the mean counts."""
+    queries = rows = 0
+    elapsed = 0.0
+    for player_id in player_ids:
+        counter = Counter()
+        token = _counter.set(counter)
+        try:
+            start = time.perf_counter()
+            await bot.send_text(player_id, get_text(command, player_id))
+            elapsed += time.perf_counter() - start
+        finally:
+            _counter.reset(token)
+        queries += counter.queries
+        rows += counter.rows
+    count = len(player_ids)
+    return {
+        "queries": round(queries / count, 2),
+        "rows": round(rows / count, 2),
+        "ms": round(elapsed / count * 1000, 3),
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    tmp_dir = tempfile.mkdtemp()
+    event.listen(Engine, "before_cursor_execute", _on_query)
+    event.listen(Base, "load", _on_load, propagate=True)
+    try:
+        bot = await start_game(tmp_dir)
+        player_ids = await seed_database(args.players, args.seed)
+        commands = sorted(bot.get_commands())
+        if len(commands) * args.samples > len(player_ids):
+            raise ValueError(
+                f"Not enough players for {len(commands)} commands, use more --players"
+            )
+        results = {}
+        # every command is sent by different players, all of them resting
+        for index, command in enumerate(commands):
+            sample = player_ids[index * args.samples : (index + 1) * args.samples]
+            results[command] = await measure(bot, command, sample)
+    finally:
+        event.remove(Base, "load", _on_load)
+        event.remove(Engine, "before_cursor_execute", _on_query)
+        # the cooldown loop keeps running in background, ignore its leftovers
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return {
+        "players": args.players,
+        "samples": args.samples,
+        "seed": args.seed,
+        "commands": results,
+    }
+
+
+def compare(report: dict, baseline: dict, time_tolerance: float) -> List[str]:
+    """Return the list of regressions of the report compared to the baseline."""
+    errors = []
+    for key in ("players", "samples", "seed"):
+        if report[key] != baseline.get(key):
+            errors.append(
+                f"{key}={report[key]} differs from the baseline ({baseline.get(key)})"
+            )
+    expected = baseline.get("commands", {})
+    for command, result in report["commands"].items():
+        base = expected.get(command)
+        if not base:
+            errors.append(f"{command}: missing from the baseline, run with --update")
+            continue
+        for key in ("queries", "rows"):
+            if result[key] > base[key]:
+                errors.append(f"{command}: {result[key]} {key}, baseline {base[key]}")
+        if time_tolerance and result["ms"] > base["ms"] * time_tolerance:
+            errors.append(f"{command}: {result['ms']}ms, baseline {base['ms']}ms")
+    return errors
+
+
+def print_report(report: dict, baseline: dict) -> None:
+    print(
+        f"{report['players']} players, {report['samples']} samples per command"
+        f", seed {report['seed']}"
+    )
+    header = f"{'command':<12}{'queries':>10}{'base':>8}{'rows':>10}{'base':>8}{'ms':>10}{'base':>8}"
+    print(header)
+    print("-" * len(header))
+    expected = baseline.get("commands", {})
+    for cmd, result in report["commands"].items():
+        base = expected.get(cmd, {})
+        print(
+            f"{cmd:<12}{result['queries']:>10.2f}{base.get('queries', '-'):>8}"
+            f"{result['rows']:>10.2f}{base.get('rows', '-'):>8}"
+            f"{result['ms']:>10.2f}{base.get('ms', '-'):>8}"
+        )
+    print("-" * len(header))
+
+
+def load_baseline(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--players", type=int, default=2000, help="number of players in the database"
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=20,
+        help="number of players sending each command (default: %(default)s)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--baseline", default=BASELINE_PATH, help="path of the baseline JSON file"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="exit with an error if a command regressed compared to the baseline",
+    )
+    parser.add_argument(
+        "--time-tolerance",
+        type=float,
+        default=0,
+        metavar="FACTOR",
+        help="with --check, also fail if a command is FACTOR times slower than the baseline (default: disabled)",
+    )
+    parser.add_argument(
+        "--update", action="store_true", help="save the results as the new baseline"
+    )
+    parser.add_argument("--json", action="store_true", help="output results as JSON")
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    baseline = load_baseline(args.baseline)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, baseline)
+    if args.update:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+    elif args.check:
+        errors = compare(report, baseline, args.time_tolerance)
+        if errors:
+            print("Query-count regressions:", file=sys.stderr)
+            for error in errors:
+                print(f"  {error}", file=sys.stderr)
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Startup-time benchmark of the bot.
+
+Each phase is measured in a new Python process, so the results include the
+work done on a real restart:
+
+- import: importing the game modules.
+- cold: starting the game with an empty configuration folder.
+- warm: restarting the game with an existing database of --players players.
+
+The start phases run the real on_init/on_start hooks with the fake bot and
+count the SQL statements executed by the game, the migrations use their own
+connection and are only included in the time.
+
+Usage: python -m benchmarks.startup --players 10000
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+PHASES = ("import", "cold", "warm")
+
+
+def _run_child(*args: str) -> dict:
+    cmd = [sys.executable, "-m", "benchmarks.startup", "--child", *args]
+    output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+async def _start(config_dir: str, players: int) -> dict:
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    from .fakebot import start_game
+    from .querycount import seed_database
+
+    queries = 0
+
+    def on_query(*_args) -> None:
+        nonlocal queries
+        queries += 1
+
+    event.listen(Engine, "before_cursor_execute", on_query)
+    start = time.perf_counter()
+    await start_game(config_dir)
+    elapsed = time.perf_counter() - start
+    event.remove(Engine, "before_cursor_execute", on_query)
+    if players:
+        await seed_database(players, seed=0)
+    return {"seconds": elapsed, "queries": queries}
+
+
+def child(args: argparse.Namespace) -> None:
+    if args.child == "import":
+        start = time.perf_counter()
+        importlib.import_module("deltaland.hooks")
+        result = {"seconds": time.perf_counter() - start, "queries": 0}
+    else:
+        result = asyncio.run(_start(args.config_dir, args.players))
+    print(json.dumps(result), flush=True)
+    # don't wait for the background tasks of the game, like the cooldown loop
+    os._exit(0)
+
+
+def measure(phase: str, args: argparse.Namespace, tmp_dir: str) -> List[dict]:
+    seeded_dir = os.path.join(tmp_dir, "seeded")
+    if phase == "warm" and not os.path.exists(seeded_dir):
+        _run_child("cold", "--config-dir", seeded_dir, "--players", str(args.players))
+    results = []
+    for index in range(args.repeat):
+        if phase == "import":
+            results.append(_run_child("import"))
+        elif phase == "cold":
+            config_dir = os.path.join(tmp_dir, f"cold{index}")
+            results.append(
+                _run_child("cold", "--config-dir", config_dir, "--players", "0")
+            )
+        else:
+            results.append(
+                _run_child("warm", "--config-dir", seeded_dir, "--players", "0")
+            )
+    return results
+
+
+def run(args: argparse.Namespace) -> dict:
+    tmp_dir = tempfile.mkdtemp()
+    report = {"players": args.players, "repeat": args.repeat, "phases": {}}
+    try:
+        for phase in args.phases:
+            results = measure(phase, args, tmp_dir)
+            timings = [result["seconds"] for result in results]
+            report["phases"][phase] = {
+                "min_ms": round(min(timings) * 1000, 2),
+                "median_ms": round(statistics.median(timings) * 1000, 2),
+                "queries": results[-1]["queries"],
+            }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return report
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['players']} players, {report['repeat']} runs per phase")
+    header = f"{'phase':<10}{'min ms':>10}{'median ms':>12}{'queries':>10}"
+    print(header)
+    print("-" * len(header))
+    for phase, result in report["phases"].items():
+        print(
+            f"{phase:<10}{result['min_ms']:>10.1f}{result['median_ms']:>12.1f}"
+            f"{result['queries']:>10}"
+        )
+    print("-" * len(header))
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--players",
+        type=int,
+        default=10000,
+        help="number of players of the database of the warm phase (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="number of runs of each phase (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--phases",
+        nargs="*",
+        choices=PHASES,
+        default=list(PHASES),
+        help="phases to measure (default: all)",
+    )
+    parser.add_argument("--json", action="store_true", help="output results as JSON")
+    parser.add_argument("--child", choices=PHASES, help=argparse.SUPPRESS)
+    parser.add_argument("--config-dir", help=argparse.SUPPRESS)
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+    if args.child:
+        child(args)
+        return
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,11 @@
 """DeltaLand bot."""
 import asyncio
 
-from .hooks import cli
-
 
 def main() -> None:
     """Run the application."""
+    from .hooks import cli  # noqa
+
     try:
         asyncio.run(cli.start())
     except KeyboardInterrupt:
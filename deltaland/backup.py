@@ -0,0 +1,148 @@
+"""Online backups of the game database.
+
+Backups are made by a scheduled world event (see cooldown.py) with SQLite's online
+backup API, copying BACKUP_STEP_PAGES pages at a time in a worker thread and
+pausing between steps, so the game keeps serving while the backup runs without
+taking the game lock. SQLite restarts the copy if the game writes to the database
+in the middle, after BACKUP_MAX_RESTARTS restarts the database is copied in a
+single step holding the game lock. Each backup is verified with
+PRAGMA integrity_check before it is added to the backups folder, where only the
+BACKUP_KEEP most recent backups are kept.
+"""
+import asyncio
+import glob
+import logging
+import os
+import sqlite3
+import time
+from typing import Optional
+
+from .consts import (
+    BACKUP_KEEP,
+    BACKUP_MAX_RESTARTS,
+    BACKUP_STEP_PAGES,
+    BACKUP_STEP_PAUSE,
+)
+from .orm import game_lock
+from .util import run_in_background
+
+_db_path = ""
+_backup_dir = ""
+_interval = 0
+_running = False
+
+
+class _TooManyRestarts(Exception):
+    """The backup was restarted too many times by concurrent writes."""
+
+
+def init(db_path: str, backup_dir: str, interval: int) -> None:
+    """Set the database to back up, the folder to save the backups in and the
+    seconds between backups, 0 disables the backups.
+    """
+    global _db_path, _backup_dir, _interval  # noqa
+    _db_path = db_path
+    _backup_dir = backup_dir
+    _interval = interval
+
+
+def get_next_backup_timestamp() -> int:
+    # if backups are disabled the event is checked again in a day
+    return int(time.time()) + (_interval or 60 * 60 * 24)
+
+
+def start_backup() -> None:
+    """Back up the database in background if backups are enabled."""
+    if _interval:
+        run_in_background(make_backup())
+
+
+async def make_backup() -> Optional[str]:
+    """Back up the database, return the path of the backup or None if it failed."""
+    global _running  # noqa
+    if _running:
+        logging.warning("Backup skipped, the previous backup is still running")
+        return None
+    _running = True
+    try:
+        return await _make_backup()
+    except Exception as ex:
+        logging.exception(ex)
+        return None
+    finally:
+        _running = False
+
+
+async def _make_backup() -> str:
+    os.makedirs(_backup_dir, exist_ok=True)
+    name = time.strftime("game-%Y%m%d-%H%M%S.db", time.gmtime())
+    path = os.path.join(_backup_dir, name)
+    tmp_path = path + ".tmp"
+    loop = asyncio.get_event_loop()
+    start = time.perf_counter()
+    try:
+        try:
+            await loop.run_in_executor(
+                None, _copy, tmp_path, BACKUP_STEP_PAGES, BACKUP_MAX_RESTARTS
+            )
+        except _TooManyRestarts:
+            logging.info(
+                "Backup restarted %s times by concurrent writes,"
+                " copying the database holding the game lock",
+                BACKUP_MAX_RESTARTS,
+            )
+            async with game_lock():
+                await loop.run_in_executor(None, _copy, tmp_path, -1, 0)
+        result = await loop.run_in_executor(None, _check_integrity, tmp_path)
+        if result != "ok":
+            raise ValueError(f"Backup {path} failed the integrity check: {result}")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _rotate()
+    logging.info(
+        "Database backup saved to %s in %.1fs", path, time.perf_counter() - start
+    )
+    return path
+
+
+def _copy(path: str, pages: int, max_restarts: int) -> None:
+    """Copy the database to the given path, the given number of pages per step."""
+    restarts = 0
+    last_remaining = -1
+
+    def on_progress(status: int, remaining: int, _total: int) -> None:
+        nonlocal restarts, last_remaining
+        # a step copied nothing: the source changed and SQLite started over
+        if status == sqlite3.SQLITE_OK and remaining >= last_remaining >= 0:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+        if remaining:
+            time.sleep(BACKUP_STEP_PAUSE)
+
+    source = sqlite3.connect(_db_path)
+    target = sqlite3.connect(path)
+    try:
+        source.backup(target, pages=pages, progress=on_progress)
+    finally:
+        target.close()
+        source.close()
+
+
+def _check_integrity(path: str) -> str:
+    database = sqlite3.connect(path)
+    try:
+        rows = database.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        database.close()
+    return "\n".join(row[0] for row in rows)
+
+
+def _rotate() -> None:
+    """Delete the oldest backups, keeping the BACKUP_KEEP most recent ones."""
+    backups = sorted(glob.glob(os.path.join(_backup_dir, "game-*.db")))
+    for path in backups[:-BACKUP_KEEP]:
+        os.remove(path)
@@ -1,7 +1,7 @@
 """Constants"""
 from enum import IntEnum
 
-DATABASE_VERSION = 7
+DATABASE_VERSION = 11
 WORLD_ID = 0
 
 MAX_LEVEL = 9
@@ -23,9 +23,62 @@ STAMINA_COOLDOWN = 60 * 60
 MAX_HP = 40
 LIFEREGEN_COOLDOWN = 30
 
+BATTLE_INTERVAL = 60 * 60 * 8
+
 DICE_FEE = 10
 DICE_COOLDOWN = 60 * 5
 
+# players not seen for this many seconds are moved to the archive tables
+ARCHIVE_AFTER = 60 * 60 * 24 * 90
+# maximum number of players archived in a single pass of the archiver
+ARCHIVE_BATCH_SIZE = 500
+
+# times a transaction is re-run if a concurrent change to the same rows is detected
+TRANSACTION_RETRIES = 5
+# base delay in seconds before re-running a transaction, doubled after each conflict
+TRANSACTION_RETRY_DELAY = 0.01
+
+# log a warning if cooldowns are processed this many seconds after they expired
+SCHEDULER_LAG_ALERT = 60
+# log a warning if a single scheduler pass takes longer than this many seconds
+SCHEDULER_PASS_ALERT = 10
+# minimum seconds between repeated scheduler warnings of the same kind
+SCHEDULER_ALERT_INTERVAL = 60 * 5
+
+# rows updated per transaction by the data migrations, see migrations.py
+MIGRATION_CHUNK_SIZE = 1000
+# seconds between progress logs of a data migration
+MIGRATION_LOG_INTERVAL = 10
+# seconds to wait between the chunks of data migrations run in background
+MIGRATION_CHUNK_PAUSE = 0.05
+
+# IDs of the most recent incoming messages kept in memory to ignore duplicates
+INBOUND_CACHE_SIZE = 10000
+# seconds the IDs of the handled messages are kept in the database
+INBOUND_TTL = 60 * 60 * 24 * 7
+
+# database backups kept in the backups folder, older ones are deleted, see backup.py
+BACKUP_KEEP = 7
+# database pages copied per step of an online backup
+BACKUP_STEP_PAGES = 256
+# seconds to wait between the steps of an online backup
+BACKUP_STEP_PAUSE = 0.01
+# times an online backup is restarted by game writes before it is copied holding the game lock
+BACKUP_MAX_RESTARTS = 3
+
+# pages returned to the file system per step of the database maintenance, see maintenance.py
+MAINTENANCE_VACUUM_PAGES = 500
+# rows sampled per index by ANALYZE in the database maintenance
+MAINTENANCE_ANALYSIS_LIMIT = 1000
+# seconds to wait between the steps of the database maintenance
+MAINTENANCE_STEP_PAUSE = 0.05
+
+# rows read per query by the export and written per transaction by the import, see dump.py
+DUMP_PAGE_SIZE = 1000
+
+# maximum number of outgoing messages being sent at the same time, see delivery.py
+SEND_CONCURRENCY = 16
+
 
 class StateEnum(IntEnum):
     # Player state
@@ -40,6 +93,31 @@ class StateEnum(IntEnum):
     MONTH = -101
     YEAR = -102
     BATTLE = -103
+    ARCHIVE = -104
+    BACKUP = -105
+    MAINTENANCE = -106
+
+
+class MessageLane(IntEnum):
+    """Priority lanes of the outgoing messages."""
+
+    INTERACTIVE = 0  # replies to the commands of the players
+    PERSONAL = 1  # results of the player's own quests and timers
+    BROADCAST = 2  # world events sent to many players at once
+
+
+# share of the sending slots a lane gets while the lanes compete for them
+LANE_WEIGHTS = {
+    MessageLane.INTERACTIVE: 8,
+    MessageLane.PERSONAL: 3,
+    MessageLane.BROADCAST: 1,
+}
+# maximum number of messages of a lane being sent at the same time
+LANE_CONCURRENCY = {
+    MessageLane.INTERACTIVE: SEND_CONCURRENCY,
+    MessageLane.PERSONAL: 8,
+    MessageLane.BROADCAST: 4,
+}
 
 
 class CombatTactic(IntEnum):
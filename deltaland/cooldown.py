@@ -3,27 +3,40 @@ import asyncio
 import logging
 import random
 import time
+from typing import Dict, List, Optional, Tuple
 
-from sqlalchemy import func
+from sqlalchemy import func, or_
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 from sqlalchemy.sql.expression import delete
 
+from . import backup, inbound, locktrace, maintenance, stats
 from .consts import (
+    ARCHIVE_AFTER,
+    ARCHIVE_BATCH_SIZE,
     CAULDRON_GIFT,
     DICE_FEE,
     LIFEREGEN_COOLDOWN,
     STAMINA_COOLDOWN,
     WORLD_ID,
-    CombatTactic,
+    MessageLane,
     StateEnum,
 )
+from .delivery import current_lane
+from .formulas import (
+    BATTLE_OUTCOMES,
+    GOBLIN_TACTICS,
+    THIEVE_EXP,
+    battle_hit_points,
+    battle_reward_range,
+)
 from .game import (
     get_next_battle_timestamp,
     get_next_day_timestamp,
     get_next_month_timestamp,
     get_next_year_timestamp,
 )
+from .ledger import add, add_gold
 from .orm import (
     BattleRank,
     BattleReport,
@@ -33,14 +46,16 @@ from .orm import (
     Cooldown,
     DiceRank,
     Player,
-    async_session,
-    fetchone,
+    archive_players,
+    transaction,
 )
 from .quests import get_quest
 from .util import calculate_thieve_gold, get_image
 
 
 async def cooldown_loop() -> None:
+    # notifications of the player timers, world events use the broadcast lane
+    current_lane.set(MessageLane.PERSONAL)
     while True:
         try:
             await _check_cooldowns()
@@ -50,26 +65,77 @@ async def cooldown_loop() -> None:
 
 
 async def _check_cooldowns() -> None:
-    async with async_session() as session:
-        async with session.begin():
+    start = time.perf_counter()
+    batches: Dict[str, stats.SchedulerBatch] = {}
+    async for attempt in transaction():
+        async with attempt as session:
+            batches.clear()  # start over if the pass is re-run
+            now = time.time()
             stmt = (
                 select(Cooldown)
-                .filter(Cooldown.ends_at <= time.time())
+                .filter(Cooldown.player_id == WORLD_ID, Cooldown.ends_at <= now)
                 .order_by(Cooldown.ends_at)
             )
-            for cooldown in (await session.execute(stmt)).scalars():
-                if cooldown.player_id == WORLD_ID:
+            token = current_lane.set(MessageLane.BROADCAST)
+            try:
+                for cooldown in (await session.execute(stmt)).scalars():
+                    kind = _get_kind(cooldown.id, "unknown")
+                    lag = now - cooldown.ends_at
+                    item_start = time.perf_counter()
                     await _process_world_cooldown(cooldown, session)
-                else:
-                    await _process_player_cooldown(cooldown, session)
+                    _add_to_batch(batches, kind, lag, item_start)
+            finally:
+                current_lane.reset(token)
+
+            stmt = (
+                select(Player)
+                .filter(
+                    or_(
+                        Player.state_ends_at <= now,
+                        Player.stamina_regen_at <= now,
+                        Player.hp_regen_at <= now,
+                    )
+                )
+                .options(selectinload(Player.thief))
+            )
+            quests_due: Dict[int, List[Tuple[Player, float]]] = {}
+            for player in (await session.execute(stmt)).scalars():
+                await _process_player_timers(player, now, session, batches, quests_due)
+            for quest_id, completions in quests_due.items():
+                await _end_quests(quest_id, completions, session, batches)
+            if batches:
+                locktrace.set_site("cooldown_loop:" + ",".join(batches))
+    if batches:
+        stats.record_scheduler_pass(batches, time.perf_counter() - start)
+
+
+def _add_to_batch(
+    batches: Dict[str, stats.SchedulerBatch], kind: str, lag: float, start: float
+) -> None:
+    batch = batches.get(kind)
+    if not batch:
+        batch = batches[kind] = stats.SchedulerBatch()
+    batch.add(lag, time.perf_counter() - start)
+
+
+def _get_kind(state: int, default: str = "quest") -> str:
+    """Get the name of the kind of timer, used for statistics."""
+    try:
+        return StateEnum(state).name.lower()
+    except ValueError:
+        return default
 
 
 async def _process_world_cooldown(cooldown: Cooldown, session) -> None:
+    start = time.perf_counter()
+    scheduled_at = cooldown.ends_at
+    players = 0
     if cooldown.id == StateEnum.BATTLE:
-        await _process_world_battle(session)
+        players = await _process_world_battle(session)
         cooldown.ends_at = get_next_battle_timestamp(cooldown.ends_at)
     elif cooldown.id == StateEnum.DAY:
-        await _process_world_cauldron(session)
+        players = await _process_world_cauldron(session)
+        await inbound.delete_expired(session)
         cooldown.ends_at = get_next_day_timestamp()
     elif cooldown.id == StateEnum.MONTH:
         await session.execute(delete(DiceRank))
@@ -78,19 +144,38 @@ async def _process_world_cooldown(cooldown: Cooldown, session) -> None:
     elif cooldown.id == StateEnum.YEAR:
         await session.execute(delete(CauldronRank))
         cooldown.ends_at = get_next_year_timestamp()
+    elif cooldown.id == StateEnum.ARCHIVE:
+        inactive_since = int(time.time()) - ARCHIVE_AFTER
+        players = await archive_players(session, inactive_since, ARCHIVE_BATCH_SIZE)
+        if players == ARCHIVE_BATCH_SIZE:  # there may be more, continue soon
+            cooldown.ends_at = int(time.time()) + 60
+        else:
+            cooldown.ends_at = get_next_day_timestamp()
+    elif cooldown.id == StateEnum.BACKUP:
+        backup.start_backup()  # runs in background, not holding the game lock
+        cooldown.ends_at = backup.get_next_backup_timestamp()
+    elif cooldown.id == StateEnum.MAINTENANCE:
+        maintenance.start_maintenance()  # runs in background, in short steps
+        cooldown.ends_at = get_next_day_timestamp()
     else:
         logging.warning("Unknown world state: %s", cooldown.id)
         await session.delete(cooldown)
+        return
+    elapsed = time.perf_counter() - start
+    stats.record_world_event(_get_kind(cooldown.id), scheduled_at, elapsed, players)
 
 
-async def _process_world_cauldron(session) -> None:
+async def _process_world_cauldron(session) -> int:
+    """Give the cauldron gift, return the number of participants."""
     winner = ""
+    count = 0
     stmt = (
         select(CauldronCoin)
         .order_by(func.random())
         .options(selectinload(CauldronCoin.player))
     )
     for coin in (await session.execute(stmt)).scalars():
+        count += 1
         player = coin.player
         await session.delete(coin)
         await player.send_message(
@@ -99,115 +184,134 @@ async def _process_world_cauldron(session) -> None:
         )
         if not winner:
             winner = player.get_name()
-            player.gold += CAULDRON_GIFT
-            cauldron_rank = await fetchone(
-                session, select(CauldronRank).filter_by(id=player.id)
-            )
-            if cauldron_rank:
-                cauldron_rank.gold += CAULDRON_GIFT
-            else:
-                player.cauldron_rank = CauldronRank(gold=CAULDRON_GIFT)
+            await add_gold(session, player.id, CAULDRON_GIFT)
+            await add(session, CauldronRank.gold, player.id, CAULDRON_GIFT)
+    return count
 
 
-async def _process_world_battle(session) -> None:
+async def _process_world_battle(session) -> int:
+    """Resolve the goblin battle, return the number of players that participated."""
+    count = 0
     await session.execute(delete(BattleReport))  # clear old reports
-    stmt = select(BattleTactic).options(
-        selectinload(BattleTactic.player)
-        .options(selectinload(Player.battle_rank))
-        .options(selectinload(Player.cooldowns))
-    )
+    stmt = select(BattleTactic).options(selectinload(BattleTactic.player))
     for battle_tactic in (await session.execute(stmt)).scalars():
+        count += 1
         player = battle_tactic.player
         tactic = battle_tactic.tactic
         await session.delete(battle_tactic)
-        victory = False
-        monster_tactic = random.choice(list(CombatTactic))
-        gold = random.randint((player.level + 1) // 2, player.level + 1)
-        base_exp = random.randint((player.level + 1) // 2, player.level + 1)
-        hit_points = player.max_hp // 3
-        battle = BattleReport(
-            tactic=tactic, monster_tactic=monster_tactic, exp=0, gold=0, hp=0
-        )
-        if tactic == CombatTactic.HIT:
-            if monster_tactic == CombatTactic.HIT:
-                battle.exp = max(base_exp // 2, 1)  # +50% Exp
-                battle.hp = -player.reduce_hp(hit_points // 2)  # -50% hit_points
-            elif monster_tactic == CombatTactic.FEINT:
-                victory = True
-                battle.exp = base_exp  # +100% Exp
-                battle.gold = gold
-                player.gold += battle.gold
-            else:  # monster_tactic == CombatTactic.PARRY
-                battle.exp = max(base_exp // 4, 1)  # +25% Exp
-                battle.hp = -player.reduce_hp(hit_points)  # -100% hit_points
-        elif tactic == CombatTactic.FEINT:
-            if monster_tactic == CombatTactic.HIT:
-                battle.exp = max(base_exp // 4, 1)  # +25% Exp
-                battle.hp = -player.reduce_hp(hit_points)  # -100% hit_points
-            elif monster_tactic == CombatTactic.FEINT:
-                battle.exp = max(base_exp // 2, 1)  # +50% Exp
-                battle.hp = -player.reduce_hp(hit_points // 2)  # -50% hit_points
-            else:  # monster_tactic == CombatTactic.PARRY
-                victory = True
-                battle.exp = base_exp  # +100% Exp
-                battle.gold = gold
-                player.gold += battle.gold
-        elif tactic == CombatTactic.PARRY:
-            if monster_tactic == CombatTactic.HIT:
-                victory = True
-                battle.exp = base_exp  # +100% Exp
-                battle.gold = gold
-                player.gold += battle.gold
-            elif monster_tactic == CombatTactic.FEINT:
-                battle.exp = max(base_exp // 4, 1)  # +25% Exp
-                battle.hp = -player.reduce_hp(hit_points)  # -100% hit_points
-            else:  # monster_tactic == CombatTactic.PARRY
-                battle.exp = max(base_exp // 4, 1)  # +25% Exp
-
+        battle, victory = resolve_battle(player, tactic)
         if battle.exp and player.increase_exp(battle.exp):  # level up
             await player.notify_level_up()
 
         player.battle_report = battle
+        if battle.gold:
+            await add_gold(session, player.id, battle.gold)
         if victory:
-            if not player.battle_rank:
-                player.battle_rank = BattleRank(victories=0)
-            player.battle_rank.victories += 1
+            await add(session, BattleRank.victories, player.id, 1)
 
         await player.send_message(
             text=player.get_battle_report(), file=get_image("goblin")
         )
+    return count
 
 
-async def _process_player_cooldown(cooldown: Cooldown, session) -> None:
-    stmt = (
-        select(Player)
-        .filter_by(id=cooldown.player_id)
-        .options(selectinload(Player.thief).selectinload(Player.cooldowns))
-        .options(selectinload(Player.cooldowns))
+def resolve_battle(
+    player: Player, tactic: int, monster_tactic: Optional[int] = None
+) -> Tuple[BattleReport, bool]:
+    """Fight a goblin, return the battle report and whether the player won.
+
+    The player's HP is reduced, experience and gold are left to the caller.
+    """
+    if monster_tactic is None:
+        monster_tactic = random.choice(GOBLIN_TACTICS)
+    gold = random.randint(*battle_reward_range(player.level))
+    base_exp = random.randint(*battle_reward_range(player.level))
+    outcome = BATTLE_OUTCOMES[(tactic, monster_tactic)]
+    battle = BattleReport(
+        tactic=tactic,
+        monster_tactic=monster_tactic,
+        exp=max(base_exp // outcome.exp_divisor, 1),
+        gold=gold if outcome.victory else 0,
+        hp=0,
     )
-    player = await fetchone(session, stmt)
-    if cooldown.id == StateEnum.REST:
+    if outcome.hp_divisor:
+        hit_points = battle_hit_points(player.max_hp) // outcome.hp_divisor
+        battle.hp = -player.reduce_hp(hit_points)
+    return battle, outcome.victory
+
+
+async def _process_player_timers(
+    player: Player,
+    now: float,
+    session,
+    batches: Dict[str, stats.SchedulerBatch],
+    quests_due: Dict[int, List[Tuple[Player, float]]],
+) -> None:
+    """Process the due timers of the player.
+
+    Finished quests are added to quests_due, grouped by quest ID, to be ended
+    together by _end_quests() after all the players are processed.
+    """
+    if player.state_ends_at is not None and player.state_ends_at <= now:
+        lag = now - player.state_ends_at
+        player.state_ends_at = None
+        if get_quest(player.state):
+            quests_due.setdefault(player.state, []).append((player, lag))
+        else:
+            kind = _get_kind(player.state)
+            item_start = time.perf_counter()
+            await _end_player_state(player, session)
+            _add_to_batch(batches, kind, lag, item_start)
+
+    if player.stamina_regen_at is not None and player.stamina_regen_at <= now:
+        lag = now - player.stamina_regen_at
+        item_start = time.perf_counter()
         if player.stamina < player.max_stamina:
             player.stamina += 1
         if player.stamina >= player.max_stamina:
-            await session.delete(cooldown)
+            player.stamina_regen_at = None
             await player.send_message(
                 text="Stamina restored. You are ready for more adventures!"
             )
         else:
-            cooldown.ends_at = cooldown.ends_at + STAMINA_COOLDOWN
-    elif cooldown.id == StateEnum.HEALING:
+            player.stamina_regen_at += STAMINA_COOLDOWN
+        _add_to_batch(batches, "rest", lag, item_start)
+
+    if player.hp_regen_at is not None and player.hp_regen_at <= now:
+        lag = now - player.hp_regen_at
+        item_start = time.perf_counter()
         if player.hp < player.max_hp:
             player.hp += 1
         if player.hp >= player.max_hp:
-            await session.delete(cooldown)
+            player.hp_regen_at = None
         else:
-            cooldown.ends_at = cooldown.ends_at + LIFEREGEN_COOLDOWN
-    elif cooldown.id == StateEnum.NOTICED_THIEF:
+            player.hp_regen_at += LIFEREGEN_COOLDOWN
+        _add_to_batch(batches, "healing", lag, item_start)
+
+
+async def _end_quests(
+    quest_id: int,
+    completions: List[Tuple[Player, float]],
+    session,
+    batches: Dict[str, stats.SchedulerBatch],
+) -> None:
+    """End the quest of the given players, each with the lag of its completion."""
+    start = time.perf_counter()
+    await get_quest(quest_id).end_all([player for player, _ in completions], session)
+    elapsed = (time.perf_counter() - start) / len(completions)
+    batch = batches.get("quest")
+    if not batch:
+        batch = batches["quest"] = stats.SchedulerBatch()
+    for _, lag in completions:
+        batch.add(lag, elapsed)
+
+
+async def _end_player_state(player: Player, session) -> None:
+    if player.state == StateEnum.NOTICED_THIEF:
         thief = player.thief
         gold = calculate_thieve_gold(thief.level)
-        thief.gold += gold
-        exp = random.randint(1, 3)
+        await add_gold(session, thief.id, gold)
+        exp = random.randint(*THIEVE_EXP)
         if thief.increase_exp(exp):  # level up
             await thief.notify_level_up()
 
@@ -221,16 +325,11 @@ async def _process_player_cooldown(cooldown: Cooldown, session) -> None:
             f"🔥Exp: {exp:+}\n"
         )
         await thief.send_message(text=text)
-        player.stop_noticing()  # removes cooldown from session
-    elif cooldown.id == StateEnum.PLAYING_DICE:
-        await session.delete(cooldown)
+        player.stop_noticing()
+    elif player.state == StateEnum.PLAYING_DICE:
         player.state = StateEnum.REST
-        player.gold += DICE_FEE
+        await add_gold(session, player.id, DICE_FEE)
         await player.send_message(text="No one sat down next to you =/")
     else:
-        quest = get_quest(cooldown.id)
-        if quest:
-            await quest.end(player, session)
-        else:
-            logging.warning("Unknown quest: %s", cooldown.id)
-        await session.delete(cooldown)
+        logging.warning("Unknown quest: %s", player.state)
+        player.state = StateEnum.REST
@@ -0,0 +1,116 @@
+"""Prioritized delivery of outgoing messages.
+
+Each message is sent through a lane, see MessageLane. A limited number of messages
+are sent at the same time and each lane has its own limit, when the lanes compete
+for the free sending slots the waiting messages are admitted with smooth weighted
+round-robin, so a wave of battle reports can't delay the replies to /me.
+"""
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict
+
+from . import stats
+from .consts import LANE_CONCURRENCY, LANE_WEIGHTS, SEND_CONCURRENCY, MessageLane
+
+# lane of the messages sent by the current task, see util.send_message()
+current_lane: ContextVar[MessageLane] = ContextVar(
+    "current_lane", default=MessageLane.INTERACTIVE
+)
+
+
+class _Lane:
+    def __init__(self, weight: int, limit: int) -> None:
+        self.weight = weight
+        self.limit = limit
+        self.waiting: Deque[asyncio.Future] = deque()
+        self.sending = 0
+        self.credit = 0  # current weight of the weighted round-robin
+
+
+class DeliveryScheduler:
+    """Limit the messages being sent at the same time, admitting them by lane priority."""
+
+    def __init__(
+        self,
+        concurrency: int,
+        weights: Dict[MessageLane, int],
+        limits: Dict[MessageLane, int],
+    ) -> None:
+        self.concurrency = concurrency
+        self.sending = 0
+        self.lanes = {lane: _Lane(weights[lane], limits[lane]) for lane in MessageLane}
+
+    def queued(self, lane: MessageLane) -> int:
+        """Number of messages of the lane waiting for a sending slot."""
+        return len(self.lanes[lane].waiting)
+
+    @asynccontextmanager
+    async def slot(self, lane: MessageLane):
+        """Wait for a free sending slot of the given lane."""
+        state = self.lanes[lane]
+        if (
+            not state.waiting
+            and self.sending < self.concurrency
+            and state.sending < state.limit
+        ):
+            self._acquire(state)
+        else:
+            future = asyncio.get_event_loop().create_future()
+            state.waiting.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    if future in state.waiting:  # not skipped by _dispatch() yet
+                        state.waiting.remove(future)
+                else:  # the slot was already given to us
+                    self._release(state)
+                raise
+        try:
+            yield
+        finally:
+            self._release(state)
+
+    def _acquire(self, state: _Lane) -> None:
+        state.sending += 1
+        self.sending += 1
+
+    def _release(self, state: _Lane) -> None:
+        state.sending -= 1
+        self.sending -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self.sending < self.concurrency:
+            for state in self.lanes.values():
+                # skip the waiters cancelled before their task could leave the queue
+                while state.waiting and state.waiting[0].done():
+                    state.waiting.popleft()
+            ready = [
+                state
+                for state in self.lanes.values()
+                if state.waiting and state.sending < state.limit
+            ]
+            if not ready:
+                return
+            total = 0
+            for state in ready:
+                state.credit += state.weight
+                total += state.weight
+            chosen = max(ready, key=lambda state: state.credit)
+            chosen.credit -= total
+            future = chosen.waiting.popleft()
+            self._acquire(chosen)
+            future.set_result(None)
+
+
+scheduler = DeliveryScheduler(SEND_CONCURRENCY, LANE_WEIGHTS, LANE_CONCURRENCY)
+
+for _lane in MessageLane:
+    stats.register_gauge(
+        f"outbox_queued_{_lane.name.lower()}",
+        f"Messages of the {_lane.name.lower()} lane waiting to be sent.",
+        lambda lane=_lane: scheduler.queued(lane),
+    )
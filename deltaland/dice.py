@@ -5,10 +5,10 @@ import time
 from typing import Tuple
 
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
 
 from .consts import DICE_COOLDOWN, DICE_FEE, StateEnum
-from .orm import Cooldown, DiceRank, Player, fetchone
+from .ledger import add, add_gold, spend_gold
+from .orm import DiceRank, Player, fetchone
 from .util import human_time_duration
 
 _DICES = {
@@ -30,19 +30,17 @@ def dices2str(dices: Tuple[int, ...]) -> str:
 
 
 async def play_dice(player: Player, session) -> None:
-    player.gold -= DICE_FEE
+    if not await spend_gold(session, player.id, DICE_FEE):
+        await player.notify_not_enough_gold()
+        return
     player.state = StateEnum.PLAYING_DICE
-    if not player.dice_rank:
-        player.dice_rank = DiceRank(gold=0)
-    stmt = (
-        select(Cooldown)
-        .options(selectinload(Cooldown.player).selectinload(Player.dice_rank))
-        .filter_by(id=StateEnum.PLAYING_DICE)
+    stmt = select(Player).filter(
+        Player.state == StateEnum.PLAYING_DICE, Player.id != player.id
     )
-    cooldown = await fetchone(session, stmt)
-    if cooldown:
-        await _play_dice(player, cooldown.player)
-        await session.delete(cooldown)
+    player2 = await fetchone(session, stmt)
+    if player2:
+        player2.state_ends_at = None
+        await _play_dice(player, player2, session)
     else:
         await player.send_message(
             text=(
@@ -50,12 +48,10 @@ async def play_dice(player: Player, session) -> None:
                 f"If you won't find anyone, you'll leave in {human_time_duration(DICE_COOLDOWN)}"
             )
         )
-        player.cooldowns.append(
-            Cooldown(id=StateEnum.PLAYING_DICE, ends_at=time.time() + DICE_COOLDOWN)
-        )
+        player.state_ends_at = time.time() + DICE_COOLDOWN
 
 
-async def _play_dice(player1: Player, player2: Player) -> None:
+async def _play_dice(player1: Player, player2: Player, session) -> None:
     roll1 = roll_dice()
     roll2 = roll_dice()
     while sum(roll1) == sum(roll2):
@@ -65,11 +61,11 @@ async def _play_dice(player1: Player, player2: Player) -> None:
         player1, player2 = player2, player1
         roll1, roll2 = roll2, roll1
 
-    player1.dice_rank.gold += DICE_FEE
-    player2.dice_rank.gold -= DICE_FEE
+    await add(session, DiceRank.gold, player1.id, DICE_FEE)
+    await add(session, DiceRank.gold, player2.id, -DICE_FEE)
 
     earned_gold = 2 * DICE_FEE
-    player1.gold += earned_gold
+    await add_gold(session, player1.id, earned_gold)
     player1.state = player2.state = StateEnum.REST
 
     name1, name2 = player1.get_name(), player2.get_name()
@@ -0,0 +1,230 @@
+"""Export and import of the game state.
+
+The players with their items, skills and ranks, and the cooldowns, are streamed
+table by table to a folder with one newline-delimited JSON or CSV file per table,
+so the state of production can be inspected, or loaded in a staging bot, without
+copying the whole database file. The export reads DUMP_PAGE_SIZE rows per query,
+each query in its own short read transaction so a running bot is not blocked, and
+the import writes DUMP_PAGE_SIZE rows per transaction, the memory used doesn't
+grow with the size of the database.
+
+In CSV files empty values are imported as NULL.
+"""
+import csv
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Column, Table
+
+from .consts import DATABASE_VERSION, DUMP_PAGE_SIZE
+from .orm import (
+    BattleRank,
+    CauldronRank,
+    Cooldown,
+    DiceRank,
+    Item,
+    Player,
+    SentinelRank,
+    Skill,
+)
+
+FORMATS = ("jsonl", "csv")
+MANIFEST = "manifest.json"
+
+# exported tables in import order, with their column of the player ID
+_TABLES: List[Tuple[Table, Column]] = [
+    (Player.__table__, Player.__table__.c.id),
+    (Item.__table__, Item.__table__.c.player_id),
+    (Skill.__table__, Skill.__table__.c.player_id),
+    (Cooldown.__table__, Cooldown.__table__.c.player_id),
+    (BattleRank.__table__, BattleRank.__table__.c.id),
+    (DiceRank.__table__, DiceRank.__table__.c.id),
+    (CauldronRank.__table__, CauldronRank.__table__.c.id),
+    (SentinelRank.__table__, SentinelRank.__table__.c.id),
+]
+
+
+def export_state(
+    dbpath: str,
+    folder: str,
+    fmt: str = "jsonl",
+    min_id: Optional[int] = None,
+    max_id: Optional[int] = None,
+    active_since: Optional[int] = None,
+) -> Dict[str, int]:
+    """Export the rows of the players matching the filters, return the rows per table.
+
+    active_since is the timestamp since the players must have been seen.
+    """
+    player_filter, params = _get_player_filter(min_id, max_id, active_since)
+    counts = {}
+    os.makedirs(folder, exist_ok=True)
+    database = sqlite3.connect(f"file:{dbpath}?mode=ro", uri=True)
+    try:
+        version = database.execute("SELECT version FROM game").fetchone()[0]
+        for table, column in _TABLES:
+            if column.table is Player.__table__:
+                where = player_filter
+            else:
+                where = (
+                    f"{column.name} IN (SELECT id FROM player WHERE {player_filter})"
+                )
+            columns = _get_columns(database, table.name)
+            rows = _iter_rows(database, table.name, columns, where, params)
+            path = os.path.join(folder, f"{table.name}.{fmt}")
+            if fmt == "csv":
+                counts[table.name] = _write_csv(path, columns, rows)
+            else:
+                counts[table.name] = _write_jsonl(path, columns, rows)
+            logging.info("Exported %s rows of %s", counts[table.name], table.name)
+    finally:
+        database.close()
+    manifest = {
+        "version": version,
+        "format": fmt,
+        "exported_at": int(time.time()),
+        "tables": counts,
+    }
+    with open(os.path.join(folder, MANIFEST), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    return counts
+
+
+def import_state(
+    dbpath: str, folder: str, batch_size: int = DUMP_PAGE_SIZE
+) -> Dict[str, int]:
+    """Import the rows exported to the given folder, return the rows per table.
+
+    Existing rows with the same primary key are replaced. The database must exist
+    and be of the same version as the export.
+    """
+    with open(os.path.join(folder, MANIFEST), encoding="utf-8") as file:
+        manifest = json.load(file)
+    if manifest["version"] != DATABASE_VERSION:
+        raise ValueError(
+            f"The export is from database version {manifest['version']},"
+            f" expected version {DATABASE_VERSION}"
+        )
+    fmt = manifest["format"]
+    counts = {}
+    database = sqlite3.connect(dbpath)
+    try:
+        for table, _ in _TABLES:
+            path = os.path.join(folder, f"{table.name}.{fmt}")
+            if not os.path.exists(path):
+                continue
+            rows = _read_csv(path) if fmt == "csv" else _read_jsonl(path)
+            counts[table.name] = _import_rows(database, table.name, rows, batch_size)
+            logging.info("Imported %s rows of %s", counts[table.name], table.name)
+    finally:
+        database.close()
+    return counts
+
+
+def _get_player_filter(
+    min_id: Optional[int], max_id: Optional[int], active_since: Optional[int]
+) -> Tuple[str, list]:
+    """Get the WHERE clause of the player table and its parameters."""
+    conditions = []
+    params = []
+    if min_id is not None:
+        conditions.append("id >= ?")
+        params.append(min_id)
+    if max_id is not None:
+        conditions.append("id <= ?")
+        params.append(max_id)
+    if active_since is not None:
+        conditions.append("last_seen >= ?")
+        params.append(active_since)
+    return " AND ".join(conditions) or "1", params
+
+
+def _get_columns(database: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in database.execute(f'PRAGMA table_info("{table}")')]
+
+
+def _iter_rows(
+    database: sqlite3.Connection,
+    table: str,
+    columns: List[str],
+    where: str,
+    params: list,
+) -> Iterator[tuple]:
+    """Yield the rows of the table matching the WHERE clause, a page at a time."""
+    names = ", ".join(f'"{name}"' for name in columns)
+    query = (
+        f'SELECT rowid AS dump_rowid, {names} FROM "{table}"'
+        f" WHERE rowid > ? AND ({where}) ORDER BY rowid LIMIT {DUMP_PAGE_SIZE}"
+    )
+    last_rowid = -(2**63)
+    while True:
+        page = database.execute(query, [last_rowid, *params]).fetchall()
+        for row in page:
+            yield row[1:]
+        if len(page) < DUMP_PAGE_SIZE:
+            break
+        last_rowid = page[-1][0]
+
+
+def _write_jsonl(path: str, columns: List[str], rows: Iterable[tuple]) -> int:
+    count = 0
+    with open(path, "w", encoding="utf-8") as file:
+        for row in rows:
+            file.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def _write_csv(path: str, columns: List[str], rows: Iterable[tuple]) -> int:
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def _read_jsonl(path: str) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _read_csv(path: str) -> Iterator[dict]:
+    with open(path, encoding="utf-8", newline="") as file:
+        for row in csv.DictReader(file):
+            yield {key: value if value != "" else None for key, value in row.items()}
+
+
+def _import_rows(
+    database: sqlite3.Connection, table: str, rows: Iterable[dict], batch_size: int
+) -> int:
+    """Insert the rows in transactions of batch_size rows, return the rows inserted."""
+    count = 0
+    batch: List[dict] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            count += _insert_batch(database, table, batch)
+            batch = []
+    if batch:
+        count += _insert_batch(database, table, batch)
+    return count
+
+
+def _insert_batch(database: sqlite3.Connection, table: str, batch: List[dict]) -> int:
+    columns = list(batch[0])
+    query = (
+        f'INSERT OR REPLACE INTO "{table}" ({", ".join(columns)})'
+        f" VALUES ({', '.join('?' * len(columns))})"
+    )
+    with database:
+        database.executemany(query, [[row[key] for key in columns] for row in batch])
+    return len(batch)
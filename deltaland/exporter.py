@@ -0,0 +1,233 @@
+"""Prometheus text-format metrics exporter.
+
+Metrics are rendered from the in-memory statistics, scraping never takes the game lock.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from . import stats
+from .orm import Player, fetchone_unlocked
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None  # type: ignore
+
+ACTIVE_PLAYERS_TTL = 60
+_active_players: Tuple[float, int] = (0.0, 0)
+
+
+async def serve_metrics(host: str, port: int) -> None:
+    server = await asyncio.start_server(_handle_request, host, port)
+    logging.info("Serving metrics at: http://%s:%s/metrics", host, port)
+    async with server:
+        await server.serve_forever()
+
+
+async def _handle_request(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (
+            b"\r\n",
+            b"\n",
+            b"",
+        ):
+            pass  # ignore headers
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1] in ("/metrics", "/"):
+            status = "200 OK"
+            body = (await get_metrics()).encode()
+        else:
+            status = "404 Not Found"
+            body = b"Not Found\n"
+        writer.write(
+            f"HTTP/1.0 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    except Exception as ex:
+        logging.exception(ex)
+    finally:
+        writer.close()
+
+
+async def get_metrics() -> str:
+    """Render all the metrics in Prometheus text format."""
+    lines: List[str] = []
+    _add_metric(lines, "hook_calls_total", "counter", "Hooks executed.")
+    _add_metric(lines, "hook_errors_total", "counter", "Hooks that raised an error.")
+    _add_metric(
+        lines, "hook_queries_total", "counter", "SQL statements executed by hooks."
+    )
+    _add_metric(lines, "hook_messages_total", "counter", "Messages sent by hooks.")
+    for name, hook_stats in stats.hooks.items():
+        labels = {"hook": name}
+        lines.append(_sample("hook_calls_total", hook_stats.wall_time.count, labels))
+        lines.append(_sample("hook_errors_total", hook_stats.errors, labels))
+        lines.append(_sample("hook_queries_total", hook_stats.queries.total, labels))
+        lines.append(_sample("hook_messages_total", hook_stats.messages.total, labels))
+    _add_metric(
+        lines, "hook_duration_seconds", "histogram", "Hooks wall time in seconds."
+    )
+    for name, hook_stats in stats.hooks.items():
+        _add_histogram(
+            lines, "hook_duration_seconds", hook_stats.wall_time, {"hook": name}
+        )
+
+    _add_metric(lines, "db_queries_total", "counter", "SQL statements executed.")
+    lines.append(_sample("db_queries_total", stats.totals.queries))
+    _add_metric(lines, "db_sessions_total", "counter", "Database sessions opened.")
+    lines.append(_sample("db_sessions_total", stats.totals.sessions))
+    _add_metric(lines, "transactions_total", "counter", "Transactions committed.")
+    lines.append(_sample("transactions_total", stats.totals.transactions))
+    _add_metric(
+        lines,
+        "transaction_conflicts_total",
+        "counter",
+        "Transaction attempts rolled back due to concurrent changes.",
+    )
+    lines.append(_sample("transaction_conflicts_total", stats.totals.conflicts))
+    _add_metric(
+        lines,
+        "duplicate_messages_total",
+        "counter",
+        "Incoming messages ignored because they were already handled.",
+    )
+    lines.append(_sample("duplicate_messages_total", stats.totals.duplicates))
+    _add_metric(
+        lines, "lock_wait_seconds", "histogram", "Time waiting for the game lock."
+    )
+    _add_histogram(lines, "lock_wait_seconds", stats.lock_wait)
+    _add_metric(lines, "lock_hold_seconds", "histogram", "Time holding the game lock.")
+    _add_histogram(lines, "lock_hold_seconds", stats.lock_hold)
+
+    _add_metric(
+        lines,
+        "write_batch_sessions",
+        "histogram",
+        "Sessions committed together by write batching.",
+    )
+    _add_histogram(lines, "write_batch_sessions", stats.write_batch)
+    _add_metric(
+        lines,
+        "write_batch_commit_seconds",
+        "histogram",
+        "Time committing write batches.",
+    )
+    _add_histogram(lines, "write_batch_commit_seconds", stats.write_batch_commit)
+
+    _add_metric(lines, "messages_sent_total", "counter", "Messages sent.")
+    lines.append(_sample("messages_sent_total", stats.totals.messages))
+    _add_metric(lines, "outbox_depth", "gauge", "Messages being sent right now.")
+    lines.append(_sample("outbox_depth", stats.totals.outbox))
+
+    _add_metric(
+        lines,
+        "scheduler_lag_seconds",
+        "gauge",
+        "Delay of the oldest cooldown processed in the last pass.",
+    )
+    for kind, kind_stats in stats.scheduler.items():
+        lines.append(
+            _sample("scheduler_lag_seconds", kind_stats.last_lag, {"kind": kind})
+        )
+    _add_metric(lines, "scheduler_processed_total", "counter", "Cooldowns processed.")
+    for kind, kind_stats in stats.scheduler.items():
+        lines.append(
+            _sample("scheduler_processed_total", kind_stats.processed, {"kind": kind})
+        )
+    _add_metric(
+        lines, "scheduler_pass_seconds", "histogram", "Duration of scheduler passes."
+    )
+    _add_histogram(lines, "scheduler_pass_seconds", stats.scheduler_pass)
+
+    for name, (description, func) in stats.gauges.items():
+        _add_metric(lines, name, "gauge", description)
+        lines.append(_sample(name, func()))
+
+    active_players = await get_active_players()
+    if active_players is not None:
+        _add_metric(
+            lines, "active_players", "gauge", "Players seen in the last 30 days."
+        )
+        lines.append(_sample("active_players", active_players))
+    memory = get_memory_usage()
+    if memory:
+        _add_metric(
+            lines, "process_resident_memory_bytes", "gauge", "Resident memory size."
+        )
+        lines.append(_sample("process_resident_memory_bytes", memory))
+    return "\n".join(lines) + "\n"
+
+
+async def get_active_players() -> Optional[int]:
+    """Get the number of active players, cached for ACTIVE_PLAYERS_TTL seconds."""
+    global _active_players  # noqa
+    updated_at, count = _active_players
+    if time.monotonic() - updated_at > ACTIVE_PLAYERS_TTL:
+        try:
+            count = await fetchone_unlocked(Player.count_active())
+        except Exception as ex:  # the database may be locked by a writer
+            logging.debug("Failed to count active players: %s", ex)
+            return count if updated_at else None
+        _active_players = (time.monotonic(), count)
+    return count
+
+
+def get_memory_usage() -> int:
+    """Get the resident memory of the process in bytes, 0 if unknown."""
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if resource:
+        # peak usage, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return 0
+
+
+def _add_metric(lines: List[str], name: str, kind: str, description: str) -> None:
+    lines.append(f"# HELP deltaland_{name} {description}")
+    lines.append(f"# TYPE deltaland_{name} {kind}")
+
+
+def _sample(name: str, value: float, labels: Optional[Dict[str, str]] = None) -> str:
+    return f"deltaland_{name}{_labels(labels)} {value}"
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ""
+    text = ",".join(
+        '{}="{}"'.format(
+            key, str(val).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for key, val in labels.items()
+    )
+    return "{" + text + "}"
+
+
+def _add_histogram(
+    lines: List[str],
+    name: str,
+    histogram: stats.Histogram,
+    labels: Optional[Dict[str, str]] = None,
+) -> None:
+    labels = labels or {}
+    count = 0
+    for bound, bucket in zip(histogram.bucket_bounds, histogram.buckets):
+        count += bucket
+        lines.append(_sample(f"{name}_bucket", count, {**labels, "le": str(bound)}))
+    lines.append(_sample(f"{name}_bucket", histogram.count, {**labels, "le": "+Inf"}))
+    lines.append(_sample(f"{name}_sum", histogram.total, labels))
+    lines.append(_sample(f"{name}_count", histogram.count, labels))
@@ -0,0 +1,89 @@
+"""Game formulas and reward tables.
+
+They are used by the game and by the offline economy simulator
+(benchmarks/economy.py), so balance changes made here apply to both. The quest
+outcome tables are in data/quests.json
+"""
+import random
+from typing import Dict, NamedTuple, Tuple
+
+from .consts import CombatTactic
+
+Range = Tuple[int, int]  # inclusive (min, max) like random.randint()
+NO_REWARD: Range = (0, 0)
+
+
+class Reward(NamedTuple):
+    """Ranges of gold, experience and HP a player receives, negative values are lost."""
+
+    gold: Range = NO_REWARD
+    exp: Range = NO_REWARD
+    hp: Range = NO_REWARD
+
+    def roll(self) -> Tuple[int, int, int]:
+        """Return random (gold, exp, hp) values within the reward ranges."""
+        return _roll(self.gold), _roll(self.exp), _roll(self.hp)
+
+
+def _roll(value_range: Range) -> int:
+    low, high = value_range
+    return low if low == high else random.randint(low, high)
+
+
+THIEVE_EXP: Range = (1, 3)
+INTERFERE_GOLD: Range = (1, 2)
+INTERFERE_EXP: Range = (1, 3)
+
+
+def thieve_gold_range(level: int) -> Range:
+    """Gold stolen by a thief that was not stopped."""
+    min_gold = min(max(level, 10), 20)
+    return min_gold, min(min_gold * 3, 40)
+
+
+def interfere_gold_range(level: int) -> Range:
+    """Gold lost by a thief that was stopped, limited by the gold the thief has."""
+    min_gold = min(max(level, 5), 10)
+    return min_gold, min_gold * 2
+
+
+def interfere_hp_range(max_hp: int) -> Range:
+    """HP lost by a thief that was stopped."""
+    return max_hp // 4, max_hp // 2
+
+
+class BattleOutcome(NamedTuple):
+    victory: bool
+    # the experience received is the base experience divided by this, at least 1
+    exp_divisor: int
+    # the HP lost is the battle hit points divided by this, 0 means no damage
+    hp_divisor: int
+
+
+# the goblin can also do nothing, which plays like a parry
+GOBLIN_TACTICS = tuple(CombatTactic)
+# (player tactic, goblin tactic) -> outcome
+BATTLE_OUTCOMES: Dict[Tuple[CombatTactic, CombatTactic], BattleOutcome] = {
+    (CombatTactic.HIT, CombatTactic.HIT): BattleOutcome(False, 2, 2),
+    (CombatTactic.HIT, CombatTactic.FEINT): BattleOutcome(True, 1, 0),
+    (CombatTactic.HIT, CombatTactic.PARRY): BattleOutcome(False, 4, 1),
+    (CombatTactic.FEINT, CombatTactic.HIT): BattleOutcome(False, 4, 1),
+    (CombatTactic.FEINT, CombatTactic.FEINT): BattleOutcome(False, 2, 2),
+    (CombatTactic.FEINT, CombatTactic.PARRY): BattleOutcome(True, 1, 0),
+    (CombatTactic.PARRY, CombatTactic.HIT): BattleOutcome(True, 1, 0),
+    (CombatTactic.PARRY, CombatTactic.FEINT): BattleOutcome(False, 4, 1),
+    (CombatTactic.PARRY, CombatTactic.PARRY): BattleOutcome(False, 4, 0),
+    (CombatTactic.HIT, CombatTactic.NONE): BattleOutcome(False, 4, 1),
+    (CombatTactic.FEINT, CombatTactic.NONE): BattleOutcome(True, 1, 0),
+    (CombatTactic.PARRY, CombatTactic.NONE): BattleOutcome(False, 4, 0),
+}
+
+
+def battle_reward_range(level: int) -> Range:
+    """Range of the gold of a victory and of the base experience of a battle."""
+    return (level + 1) // 2, level + 1
+
+
+def battle_hit_points(max_hp: int) -> int:
+    """Hit points of the goblin attacks."""
+    return max_hp // 3
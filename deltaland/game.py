@@ -1,82 +1,79 @@
 """Game global state logic"""
+import hashlib
+import json
 import time
 from datetime import datetime, timedelta
+from typing import Callable, Dict
 
 from sqlalchemy.future import select
+from sqlalchemy.sql.expression import update
 
-from .consts import DATABASE_VERSION, WORLD_ID, StateEnum
-from .items import init_items
+from .backup import get_next_backup_timestamp
+from .consts import BATTLE_INTERVAL, DATABASE_VERSION, WORLD_ID, StateEnum
+from .items import BASE_ITEMS, init_items
 from .orm import Cooldown, Game, Player, async_session, fetchone
-from .skills import init_skills
+from .skills import BASE_SKILLS, init_skills
 from .util import human_time_duration
 
 
 async def init_game() -> None:
+    """Create the game and world rows if missing, and save the catalog if it changed."""
+    catalog_hash = get_catalog_hash()
+    # the game row, the world player and its events are checked with a single query
+    stmt = (
+        select(Game.catalog_hash, Player.id, Cooldown.id)
+        .select_from(Game)
+        .outerjoin(Player, Player.id == WORLD_ID)
+        .outerjoin(Cooldown, Cooldown.player_id == Player.id)
+    )
     async with async_session() as session:
         async with session.begin():
-            if not await fetchone(session, select(Game)):
+            rows = (await session.execute(stmt)).all()
+            if not rows:  # new database
                 session.add(Game(version=DATABASE_VERSION))
-
-            await init_items(session)
-            await init_skills(session)
-
-            world = await fetchone(session, select(Player).filter_by(id=WORLD_ID))
-            if not world:
-                world = Player(id=WORLD_ID, last_seen=0)
-                session.add(world)
-
-            if not await fetchone(
-                session,
-                select(Cooldown).filter_by(id=StateEnum.YEAR, player_id=world.id),
-            ):
-                session.add(
-                    Cooldown(
-                        id=StateEnum.YEAR,
-                        player_id=world.id,
-                        ends_at=get_next_year_timestamp(),
-                    )
-                )
-
-            if not await fetchone(
-                session,
-                select(Cooldown).filter_by(id=StateEnum.MONTH, player_id=world.id),
-            ):
-                session.add(
-                    Cooldown(
-                        id=StateEnum.MONTH,
-                        player_id=world.id,
-                        ends_at=get_next_month_timestamp(),
-                    )
-                )
-
-            if not await fetchone(
-                session,
-                select(Cooldown).filter_by(id=StateEnum.DAY, player_id=world.id),
-            ):
-                session.add(
-                    Cooldown(
-                        id=StateEnum.DAY,
-                        player_id=world.id,
-                        ends_at=get_next_day_timestamp(),
+            if not rows or rows[0][1] is None:
+                session.add(Player(id=WORLD_ID, last_seen=0))
+            world_events = {row[2] for row in rows}
+            for event_id, get_first_timestamp in _get_world_events().items():
+                if event_id not in world_events:
+                    session.add(
+                        Cooldown(
+                            id=event_id,
+                            player_id=WORLD_ID,
+                            ends_at=get_first_timestamp(),
+                        )
                     )
-                )
-
-            if not await fetchone(
-                session,
-                select(Cooldown).filter_by(id=StateEnum.BATTLE, player_id=world.id),
-            ):
-                last_battle = int(
-                    datetime.today()
-                    .replace(minute=0, second=0, microsecond=0)
-                    .timestamp()
-                )
-                session.add(
-                    Cooldown(
-                        id=StateEnum.BATTLE,
-                        player_id=world.id,
-                        ends_at=get_next_battle_timestamp(last_battle),
-                    )
-                )
+
+            if not rows or rows[0][0] != catalog_hash:
+                await init_items(session)
+                await init_skills(session)
+                await session.execute(update(Game).values(catalog_hash=catalog_hash))
+
+
+def get_catalog_hash() -> str:
+    """Get the hash of the base items and skills, they are saved only if it changes."""
+    catalog = json.dumps([BASE_ITEMS, BASE_SKILLS], sort_keys=True)
+    return hashlib.sha256(catalog.encode()).hexdigest()
+
+
+def _get_world_events() -> Dict[StateEnum, Callable[[], int]]:
+    """Get the world events and the functions returning their first timestamp."""
+    return {
+        StateEnum.YEAR: get_next_year_timestamp,
+        StateEnum.MONTH: get_next_month_timestamp,
+        StateEnum.DAY: get_next_day_timestamp,
+        StateEnum.ARCHIVE: get_next_day_timestamp,
+        StateEnum.BATTLE: _get_first_battle_timestamp,
+        StateEnum.BACKUP: get_next_backup_timestamp,
+        StateEnum.MAINTENANCE: get_next_day_timestamp,
+    }
+
+
+def _get_first_battle_timestamp() -> int:
+    last_battle = int(
+        datetime.today().replace(minute=0, second=0, microsecond=0).timestamp()
+    )
+    return get_next_battle_timestamp(last_battle)
 
 
 def get_next_year_timestamp() -> int:
@@ -104,7 +101,11 @@ def get_next_day_timestamp() -> int:
 
 
 def get_next_battle_timestamp(last_battle: int) -> int:
-    return int((datetime.fromtimestamp(last_battle) + timedelta(hours=8)).timestamp())
+    return int(
+        (
+            datetime.fromtimestamp(last_battle) + timedelta(seconds=BATTLE_INTERVAL)
+        ).timestamp()
+    )
 
 
 async def get_next_battle_cooldown(session) -> str:
@@ -8,20 +8,26 @@ from argparse import Namespace
 
 from deltabot_cli import AttrDict, Bot, BotCli, EventType, const, events
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
 
-from ..consts import RANKS_REQ_LEVEL, STARTING_LEVEL, StateEnum
+from .. import backup, dump, inbound, locktrace, maintenance, profiler, stats
+from ..consts import DUMP_PAGE_SIZE, RANKS_REQ_LEVEL, STARTING_LEVEL, StateEnum
 from ..cooldown import cooldown_loop
 from ..experience import required_exp
+from ..formulas import INTERFERE_EXP, INTERFERE_GOLD, interfere_hp_range
 from ..game import get_next_battle_cooldown, init_game
-from ..migrations import run_migrations
+from ..ledger import add, add_gold, lose_gold
+from ..migrations import run_background_backfills, run_migrations
 from ..orm import (
-    Cooldown,
+    PROFILE_STATUS,
+    PROFILE_THIEF,
     Player,
     SentinelRank,
     async_session,
+    enable_write_batching,
     fetchone,
     init_db_engine,
+    restore_player,
+    transaction,
 )
 from ..quests import get_quest, quests
 from ..util import (
@@ -32,6 +38,8 @@ from ..util import (
     render_stats,
     run_in_background,
 )
+from .admin import hooks as admin_hooks
+from .admin import init_admin
 from .battle import hooks as battle_hooks
 from .inventory import hooks as inventory_hooks
 from .ranking import hooks as ranking_hooks
@@ -40,19 +48,108 @@ from .skills import hooks as skills_hooks
 from .tavern import hooks as tavern_hooks
 
 cli = BotCli("deltaland")
+cli.add_generic_option(
+    "--admin",
+    action="append",
+    default=[],
+    metavar="ADDR",
+    help="address of a game administrator, can be used multiple times",
+)
+cli.add_generic_option(
+    "--stats",
+    action="store_true",
+    help="collect performance statistics, administrators can see them with /stats",
+)
+cli.add_generic_option(
+    "--stats-interval",
+    type=int,
+    default=600,
+    metavar="SECONDS",
+    help="if --stats is used, log a statistics summary every SECONDS, 0 to disable (default: %(default)s)",
+)
+cli.add_generic_option(
+    "--trace-lock",
+    action="store_true",
+    help="trace the game lock acquisitions, administrators can see them with /locktrace",
+)
+cli.add_generic_option(
+    "--write-batch-window",
+    type=float,
+    default=0,
+    metavar="MS",
+    help="commit together the database writes of the commands received within MS milliseconds, 0 to disable (default: %(default)s)",
+)
+cli.add_generic_option(
+    "--write-batch-size",
+    type=int,
+    default=50,
+    metavar="N",
+    help="if --write-batch-window is used, commit after N commands even if the window didn't end (default: %(default)s)",
+)
+cli.add_generic_option(
+    "--background-migrations",
+    action="store_true",
+    help="run the non-blocking data migrations in background after the bot starts instead of before",
+)
+cli.add_generic_option(
+    "--backup-interval",
+    type=int,
+    default=24,
+    metavar="HOURS",
+    help="back up the game database every HOURS in the backups folder of the configuration folder, 0 to disable (default: %(default)s)",
+)
+cli.add_generic_option(
+    "--metrics-port",
+    type=int,
+    default=0,
+    metavar="PORT",
+    help="serve Prometheus metrics via HTTP in the given port, implies --stats (default: disabled)",
+)
+cli.add_generic_option(
+    "--metrics-host",
+    default="127.0.0.1",
+    metavar="HOST",
+    help="address to bind the metrics server to (default: %(default)s)",
+)
 
 
 @cli.on_init
-async def on_init(bot: Bot, _args: Namespace) -> None:
-    bot.add_hooks(battle_hooks)
-    bot.add_hooks(inventory_hooks)
-    bot.add_hooks(ranking_hooks)
-    bot.add_hooks(shop_hooks)
-    bot.add_hooks(skills_hooks)
-    bot.add_hooks(tavern_hooks)
-    for quest in quests:
-        bot.add_hook(quest.command, events.NewMessage(command=quest.command_name))
-
+async def on_init(bot: Bot, args: Namespace) -> None:
+    init_admin(args.config_dir, args.admin)
+    quest_hooks = [
+        (quest.command, events.NewMessage(command=quest.command_name))
+        for quest in quests.values()
+    ]
+    hook_collections = [
+        admin_hooks,
+        battle_hooks,
+        inventory_hooks,
+        ranking_hooks,
+        shop_hooks,
+        skills_hooks,
+        tavern_hooks,
+        quest_hooks,
+    ]
+    for hooks in hook_collections:
+        bot.add_hooks(hooks)
+    for hooks in [cli._hooks, *hook_collections]:  # noqa
+        for hook, event in hooks:
+            profiler.register_hook(stats.get_hook_name(hook, event), hook)
+    profiler.register_hook("cooldown_loop", cooldown_loop)
+    if args.trace_lock:
+        locktrace.enable()
+    if args.write_batch_window > 0:
+        enable_write_batching(args.write_batch_window / 1000, args.write_batch_size)
+    if args.stats or args.metrics_port:
+        stats.enable()
+    _wrap_hooks(bot, [cli._hooks, *hook_collections])  # noqa
+
+    # not needed to start serving, don't wait for the RPC calls
+    run_in_background(_init_account(bot))
+
+
+async def _init_account(bot: Bot) -> None:
+    """Set the bot's profile the first time it is started."""
     if not await bot.account.get_config("displayname"):
         await bot.account.set_config("displayname", "Deltaland Bot")
         status = (
@@ -65,12 +162,107 @@ async def on_init(bot: Bot, _args: Namespace) -> None:
 
 @cli.on_start
 async def on_start(bot: Bot, args: Namespace) -> None:
-    path = os.path.join(args.config_dir, "game.db")
-    run_migrations(path)
+    path = _get_database_path(args)
+    run_migrations(path, background=args.background_migrations)
     await init_db_engine(bot, f"sqlite+aiosqlite:///{path}")
+    backup_dir = os.path.join(args.config_dir, "backups")
+    backup.init(path, backup_dir, args.backup_interval * 60 * 60)
+    maintenance.init(path)
     await init_game()
+    await inbound.init()
     logging.info("Listening for messages at: %s", await bot.account.get_config("addr"))
     run_in_background(cooldown_loop())
+    if args.background_migrations:
+        run_in_background(run_background_backfills())
+    profiler.init(args.config_dir)
+    if stats.is_enabled() and args.stats_interval > 0:
+        run_in_background(stats.log_loop(args.stats_interval))
+    if args.metrics_port:
+        from ..exporter import serve_metrics  # noqa
+
+        run_in_background(serve_metrics(args.metrics_host, args.metrics_port))
+
+
+def _get_database_path(args: Namespace) -> str:
+    return os.path.join(args.config_dir, "game.db")
+
+
+async def export_cmd(_bot: Bot, args: Namespace) -> None:
+    """export the game state to a folder of newline-delimited JSON or CSV files"""
+    active_since = None
+    if args.active_days is not None:
+        active_since = int(time.time()) - args.active_days * 60 * 60 * 24
+    counts = dump.export_state(
+        args.database or _get_database_path(args),
+        args.folder,
+        fmt=args.format,
+        min_id=args.min_id,
+        max_id=args.max_id,
+        active_since=active_since,
+    )
+    logging.info("Exported %s rows to %s", sum(counts.values()), args.folder)
+
+
+async def import_cmd(bot: Bot, args: Namespace) -> None:
+    """import the game state exported with the export subcommand, the bot must be stopped"""
+    path = _get_database_path(args)
+    run_migrations(path)
+    await init_db_engine(bot, f"sqlite+aiosqlite:///{path}")
+    await init_game()
+    counts = dump.import_state(path, args.folder, args.batch_size)
+    logging.info("Imported %s rows from %s", sum(counts.values()), args.folder)
+
+
+_export_parser = cli.add_subcommand(export_cmd, name="export")
+_export_parser.add_argument("folder", help="folder to save the files in")
+_export_parser.add_argument(
+    "--format",
+    choices=dump.FORMATS,
+    default="jsonl",
+    help="format of the files (default: %(default)s)",
+)
+_export_parser.add_argument(
+    "--database",
+    metavar="PATH",
+    help="database to export, for example a backup (default: the game database)",
+)
+_export_parser.add_argument(
+    "--min-id", type=int, metavar="ID", help="only export players with ID >= ID"
+)
+_export_parser.add_argument(
+    "--max-id", type=int, metavar="ID", help="only export players with ID <= ID"
+)
+_export_parser.add_argument(
+    "--active-days",
+    type=int,
+    metavar="DAYS",
+    help="only export players seen in the last DAYS days",
+)
+_import_parser = cli.add_subcommand(import_cmd, name="import")
+_import_parser.add_argument("folder", help="folder with the exported files")
+_import_parser.add_argument(
+    "--batch-size",
+    type=int,
+    default=DUMP_PAGE_SIZE,
+    metavar="N",
+    help="rows written per transaction (default: %(default)s)",
+)
+
+
+def _wrap_hooks(bot: Bot, hook_collections: list) -> None:
+    """Replace the registered hooks with versions ignoring redelivered messages,
+    and recording statistics if enabled.
+    """
+    for hooks in hook_collections:
+        for hook, event in list(hooks):
+            wrapper = hook
+            if stats.is_enabled():
+                wrapper = stats.instrument(stats.get_hook_name(hook, event), wrapper)
+            if isinstance(event, events.NewMessage):
+                wrapper = inbound.deduplicate(wrapper)
+            if wrapper is not hook:
+                bot.remove_hook(hook, event)
+                bot.add_hook(wrapper, event)
 
 
 @cli.on(events.RawEvent((EventType.INFO, EventType.WARNING, EventType.ERROR)))
@@ -103,9 +295,12 @@ async def help_cmd(event: AttrDict) -> None:
 async def start_cmd(event: AttrDict) -> None:
     """Start the game."""
     msg = event.message_snapshot
-    async with async_session() as session:
-        async with session.begin():
-            player = await fetchone(session, select(Player).filter_by(id=msg.sender.id))
+    async for attempt in transaction():
+        async with attempt as session:
+            stmt = select(Player).filter_by(id=msg.sender.id)
+            player = await fetchone(session, stmt)
+            if not player and await restore_player(session, msg.sender.id):
+                player = await fetchone(session, stmt)
             if player:
                 already_joined = True
             else:
@@ -147,8 +342,8 @@ async def start_cmd(event: AttrDict) -> None:
 @cli.on(events.NewMessage(command="/name"))
 async def name_cmd(event: AttrDict) -> None:
     """Set your name."""
-    async with async_session() as session:
-        async with session.begin():
+    async for attempt in transaction():
+        async with attempt as session:
             player = await Player.from_message(event.message_snapshot, session)
             if not player or not await player.validate_resting(session):
                 return
@@ -172,12 +367,9 @@ async def name_cmd(event: AttrDict) -> None:
 async def me_cmd(event: AttrDict) -> None:
     """Show your status."""
     async with async_session() as session:
-        options = [
-            selectinload(Player.battle_tactic),
-            selectinload(Player.sentinel),
-            selectinload(Player.thief),
-        ]
-        player = await Player.from_message(event.message_snapshot, session, options)
+        player = await Player.from_message(
+            event.message_snapshot, session, PROFILE_STATUS
+        )
         if not player:
             return
 
@@ -198,17 +390,13 @@ async def me_cmd(event: AttrDict) -> None:
         else:
             quest = get_quest(player.state)
             if quest:
-                stmt = select(Cooldown).filter_by(id=quest.id, player_id=player.id)
-                cooldown = await fetchone(session, stmt)
-                quest_cooldown = human_time_duration(cooldown.ends_at - now)
+                quest_cooldown = human_time_duration(player.state_ends_at - now)
                 state = f"{quest.status_msg}. Back in {quest_cooldown}"
             else:
                 state = f"UNKNOWN ({player.state})"
-        stmt = select(Cooldown).filter_by(id=StateEnum.REST, player_id=player.id)
-        cooldown = await fetchone(session, stmt)
-        if cooldown:
+        if player.stamina_regen_at is not None:
             stamina_cooldown = " ⏰"
-            seconds = cooldown.ends_at - now
+            seconds = player.stamina_regen_at - now
             if seconds < 60:
                 stamina_cooldown += "now"
             else:
@@ -282,7 +470,7 @@ async def quests_cmd(event: AttrDict) -> None:
             return
 
     text = ""
-    for quest in quests:
+    for quest in quests.values():
         if quest.required_level > player.level:
             continue
         duration = human_time_duration(quest.duration, rounded=False)
@@ -298,14 +486,11 @@ async def quests_cmd(event: AttrDict) -> None:
 @cli.on(events.NewMessage(command="/interfere"))
 async def interfere_cmd(event: AttrDict) -> None:
     """Stop a thief."""
-    async with async_session() as session:
-        async with session.begin():
-            options = [
-                selectinload(Player.thief).selectinload(Player.cooldowns),
-                selectinload(Player.cooldowns),
-                selectinload(Player.sentinel_rank),
-            ]
-            player = await Player.from_message(event.message_snapshot, session, options)
+    async for attempt in transaction():
+        async with attempt as session:
+            player = await Player.from_message(
+                event.message_snapshot, session, PROFILE_THIEF
+            )
             if not player:
                 return
 
@@ -313,12 +498,10 @@ async def interfere_cmd(event: AttrDict) -> None:
                 thief: Player = player.thief
 
                 player.stop_noticing()
-                if not player.sentinel_rank:
-                    player.sentinel_rank = SentinelRank(stopped=0)
-                player.sentinel_rank.stopped += 1
-                player_gold = random.randint(1, 2)
-                player.gold += player_gold
-                player_exp = random.randint(1, 3)
+                await add(session, SentinelRank.stopped, player.id, 1)
+                player_gold = random.randint(*INTERFERE_GOLD)
+                await add_gold(session, player.id, player_gold)
+                player_exp = random.randint(*INTERFERE_EXP)
                 if player.increase_exp(player_exp):  # level up
                     await player.notify_level_up()
                 text = (
@@ -330,10 +513,11 @@ async def interfere_cmd(event: AttrDict) -> None:
                 )
                 await player.send_message(text=text)
 
-                thief_gold = -min(calculate_interfere_gold(thief.level), thief.gold)
-                thief.gold += thief_gold
+                penalty = calculate_interfere_gold(thief.level)
+                thief_gold = -min(penalty, thief.gold)
+                await lose_gold(session, thief.id, penalty)
                 lost_hp = -thief.reduce_hp(
-                    random.randint(thief.max_hp // 4, thief.max_hp // 2)
+                    random.randint(*interfere_hp_range(thief.max_hp))
                 )
                 text = (
                     f"**{player.get_name()}** noticed you and called the town's guards."
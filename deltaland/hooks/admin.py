@@ -0,0 +1,99 @@
+"""Administration hooks"""
+import asyncio
+import os
+import time
+from typing import Iterable, Set
+
+from deltabot_cli import AttrDict, Contact, events
+
+from .. import locktrace, profiler, stats
+from ..util import run_in_background, send_message
+
+hooks = events.HookCollection()
+_admins: Set[str] = set()
+_config_dir = ""
+
+
+def init_admin(config_dir: str, addresses: Iterable[str]) -> None:
+    global _config_dir  # noqa
+    _config_dir = config_dir
+    _admins.clear()
+    _admins.update(addr.lower() for addr in addresses)
+
+
+async def is_admin(contact: Contact) -> bool:
+    if not _admins:
+        return False
+    return (await contact.get_snapshot()).address.lower() in _admins
+
+
+async def validate_admin(contact: Contact) -> bool:
+    if await is_admin(contact):
+        return True
+    await send_message(contact, text="❌ Only game administrators can do that")
+    return False
+
+
+@hooks.on(events.NewMessage(command="/stats"))
+async def stats_cmd(event: AttrDict) -> None:
+    """Show performance statistics."""
+    sender = event.message_snapshot.sender
+    if not await validate_admin(sender):
+        return
+
+    if stats.is_enabled():
+        text = stats.get_report()
+    else:
+        text = "Statistics are disabled, start the bot with --stats to enable them"
+    await send_message(sender, text=text)
+
+
+@hooks.on(events.NewMessage(command="/profile"))
+async def profile_cmd(event: AttrDict) -> None:
+    """Profile the bot for the given number of seconds."""
+    sender = event.message_snapshot.sender
+    if not await validate_admin(sender):
+        return
+
+    if profiler.is_running():
+        await send_message(sender, text="❌ A profiling session is already running")
+        return
+    try:
+        duration = int(event.payload or profiler.PROFILE_DURATION)
+    except ValueError:
+        await send_message(sender, text="❌ Usage: /profile [SECONDS]")
+        return
+    duration = max(1, min(duration, profiler.MAX_PROFILE_DURATION))
+    await send_message(sender, text=f"⏱️ Profiling for {duration} seconds...")
+    run_in_background(_profile(sender, duration))
+
+
+async def _profile(sender: Contact, duration: int) -> None:
+    try:
+        pstats_path, collapsed_path = await profiler.profile(duration)
+        text = f"✅ Profile saved:\n{pstats_path}\n{collapsed_path}"
+    except Exception as ex:
+        text = f"❌ Profiling failed: {ex}"
+    await send_message(sender, text=text)
+
+
+@hooks.on(events.NewMessage(command="/locktrace"))
+async def locktrace_cmd(event: AttrDict) -> None:
+    """Show the longest game lock holders and save the lock timeline to a file."""
+    sender = event.message_snapshot.sender
+    if not await validate_admin(sender):
+        return
+
+    if not locktrace.is_enabled():
+        await send_message(
+            sender,
+            text="Lock tracing is disabled, start the bot with --trace-lock to enable it",
+        )
+        return
+    filename = time.strftime("locktrace-%Y%m%d-%H%M%S.json", time.localtime())
+    path = os.path.join(_config_dir, filename)
+    timeline = locktrace.get_timeline()
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, locktrace.dump_timeline, path, timeline)
+    text = f"{locktrace.get_report()}\n\nTimeline with {len(timeline)} acquisitions saved to:\n{path}"
+    await send_message(sender, text=text)
@@ -1,9 +1,15 @@
 """Goblin Battle hooks"""
 from deltabot_cli import AttrDict, events
-from sqlalchemy.orm import selectinload
 
 from ..game import get_next_battle_cooldown
-from ..orm import BattleTactic, CombatTactic, Player, async_session
+from ..orm import (
+    PROFILE_COMBAT,
+    BattleTactic,
+    CombatTactic,
+    Player,
+    async_session,
+    transaction,
+)
 from ..util import get_image
 
 hooks = events.HookCollection()
@@ -12,8 +18,8 @@ hooks = events.HookCollection()
 @hooks.on(events.NewMessage(command="/battle"))
 async def battle_cmd(event: AttrDict) -> None:
     """Choose battle tactics."""
-    async with async_session() as session:
-        async with session.begin():
+    async for attempt in transaction():
+        async with attempt as session:
             player = await Player.from_message(event.message_snapshot, session)
             if not player and not await player.validate_resting(
                 session, ignore_battle=True
@@ -34,8 +40,8 @@ async def battle_cmd(event: AttrDict) -> None:
 @hooks.on(events.NewMessage(command="/hit"))
 async def hit_cmd(event: AttrDict) -> None:
     """Choose HIT as battle tactic."""
-    async with async_session() as session:
-        async with session.begin():
+    async for attempt in transaction():
+        async with attempt as session:
             player = await Player.from_message(event.message_snapshot, session)
             if not player and not await player.validate_resting(
                 session, ignore_battle=True
@@ -53,8 +59,8 @@ async def hit_cmd(event: AttrDict) -> None:
 @hooks.on(events.NewMessage(command="/feint"))
 async def feint_cmd(event: AttrDict) -> None:
     """Choose FEINT as battle tactic."""
-    async with async_session() as session:
-        async with session.begin():
+    async for attempt in transaction():
+        async with attempt as session:
             player = await Player.from_message(event.message_snapshot, session)
             if not player and not await player.validate_resting(
                 session, ignore_battle=True
@@ -72,8 +78,8 @@ async def feint_cmd(event: AttrDict) -> None:
 @hooks.on(events.NewMessage(command="/parry"))
 async def parry_cmd(event: AttrDict) -> None:
     """Choose PARRY as battle tactic."""
-    async with async_session() as session:
-        async with session.begin():
+    async for attempt in transaction():
+        async with attempt as session:
             player = await Player.from_message(event.message_snapshot, session)
             if not player and not await player.validate_resting(
                 session, ignore_battle=True
@@ -93,7 +99,7 @@ async def report_cmd(event: AttrDict) -> None:
     """Show your last results in the battlefield."""
     async with async_session() as session:
         player = await Player.from_message(
-            event.message_snapshot, session, [selectinload(Player.battle_report)]
+            event.message_snapshot, session, PROFILE_COMBAT
         )
         if not player:
             return
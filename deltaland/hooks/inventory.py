@@ -4,7 +4,7 @@ from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 
 from ..consts import EquipmentSlot
-from ..orm import Item, Player, async_session, fetchone
+from ..orm import PROFILE_INVENTORY, Item, Player, async_session, fetchone, transaction
 from ..util import render_stats
 
 hooks = events.HookCollection()
@@ -17,7 +17,7 @@ async def inv_cmd(event: AttrDict) -> None:
         player = await Player.from_message(
             event.message_snapshot,
             session,
-            [selectinload(Player.items).selectinload(Item.base)],
+            PROFILE_INVENTORY,
         )
         if not player:
             return
@@ -49,8 +49,8 @@ async def inv_cmd(event: AttrDict) -> None:
 @hooks.on(events.NewMessage(command="/on"))
 async def on_cmd(event: AttrDict) -> None:
     """Equip an item."""
-    async with async_session() as session:
-        async with session.begin():
+    async for attempt in transaction():
+        async with attempt as session:
             player = await Player.from_message(event.message_snapshot, session)
             if not player or not await player.validate_resting(session):
                 return
@@ -99,8 +99,8 @@ async def on_cmd(event: AttrDict) -> None:
 @hooks.on(events.NewMessage(command="/off"))
 async def off_cmd(event: AttrDict) -> None:
     """Unequip an item."""
-    async with async_session() as session:
-        async with session.begin():
+    async for attempt in transaction():
+        async with attempt as session:
             player = await Player.from_message(event.message_snapshot, session)
             if (
                 not player
@@ -1,10 +1,14 @@
 """Rankings / leaderboards hooks"""
 from deltabot_cli import AttrDict, events
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import joinedload
 
 from ..consts import RANKS_REQ_LEVEL
 from ..orm import (
+    PROFILE_BATTLE_RANK,
+    PROFILE_CAULDRON_RANK,
+    PROFILE_DICE_RANK,
+    PROFILE_SENTINEL_RANK,
     BattleRank,
     CauldronRank,
     DiceRank,
@@ -40,7 +44,7 @@ async def top1_cmd(event: AttrDict) -> None:
     """Most victories in the battlefield."""
     async with async_session() as session:
         player = await Player.from_message(
-            event.message_snapshot, session, [selectinload(Player.battle_rank)]
+            event.message_snapshot, session, PROFILE_BATTLE_RANK
         )
         if not player or not await player.validate_level(RANKS_REQ_LEVEL):
             return
@@ -49,7 +53,7 @@ async def top1_cmd(event: AttrDict) -> None:
         text = ""
         stmt = (
             select(BattleRank)
-            .options(selectinload(BattleRank.player))
+            .options(joinedload(BattleRank.player).load_only(Player.name))
             .order_by(BattleRank.victories.desc())
             .limit(15)
         )
@@ -109,7 +113,7 @@ async def top3_cmd(event: AttrDict) -> None:
     """Most gold received from the magic cauldron."""
     async with async_session() as session:
         player = await Player.from_message(
-            event.message_snapshot, session, [selectinload(Player.cauldron_rank)]
+            event.message_snapshot, session, PROFILE_CAULDRON_RANK
         )
         if not player or not await player.validate_level(RANKS_REQ_LEVEL):
             return
@@ -118,7 +122,7 @@ async def top3_cmd(event: AttrDict) -> None:
         text = ""
         stmt = (
             select(CauldronRank)
-            .options(selectinload(CauldronRank.player))
+            .options(joinedload(CauldronRank.player).load_only(Player.name))
             .order_by(CauldronRank.gold.desc())
             .limit(15)
         )
@@ -145,7 +149,7 @@ async def top4_cmd(event: AttrDict) -> None:
     """Most wins in dice this month."""
     async with async_session() as session:
         player = await Player.from_message(
-            event.message_snapshot, session, [selectinload(Player.dice_rank)]
+            event.message_snapshot, session, PROFILE_DICE_RANK
         )
         if not player or not await player.validate_level(RANKS_REQ_LEVEL):
             return
@@ -154,7 +158,7 @@ async def top4_cmd(event: AttrDict) -> None:
         text = ""
         stmt = (
             select(DiceRank)
-            .options(selectinload(DiceRank.player))
+            .options(joinedload(DiceRank.player).load_only(Player.name))
             .filter(DiceRank.gold > 0)
             .order_by(DiceRank.gold.desc())
             .limit(15)
@@ -182,7 +186,7 @@ async def top5_cmd(event: AttrDict) -> None:
     """Most thieves stopped."""
     async with async_session() as session:
         player = await Player.from_message(
-            event.message_snapshot, session, [selectinload(Player.sentinel_rank)]
+            event.message_snapshot, session, PROFILE_SENTINEL_RANK
         )
         if not player or not await player.validate_level(RANKS_REQ_LEVEL):
             return
@@ -191,7 +195,7 @@ async def top5_cmd(event: AttrDict) -> None:
         text = ""
         stmt = (
             select(SentinelRank)
-            .options(selectinload(SentinelRank.player))
+            .options(joinedload(SentinelRank.player).load_only(Player.name))
             .order_by(SentinelRank.stopped.desc())
             .limit(15)
         )
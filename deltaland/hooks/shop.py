@@ -4,7 +4,7 @@ from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 
 from ..consts import RESET_NAME_COST, EquipmentSlot, Tier
-from ..orm import BaseItem, Item, Player, async_session, fetchone
+from ..orm import BaseItem, Item, Player, async_session, fetchone, transaction
 from ..util import get_image
 
 hooks = events.HookCollection()
@@ -34,8 +34,8 @@ async def shop_cmd(event: AttrDict) -> None:
 @hooks.on(events.NewMessage(command="/buy"))
 async def buy_cmd(event: AttrDict) -> None:
     """Buy an item."""
-    async with async_session() as session:
-        async with session.begin():
+    async for attempt in transaction():
+        async with attempt as session:
             player = await Player.from_message(event.message_snapshot, session)
             if (
                 not player
@@ -75,8 +75,8 @@ async def buy_cmd(event: AttrDict) -> None:
 @hooks.on(events.NewMessage(command="/sell"))
 async def sell_cmd(event: AttrDict) -> None:
     """Sell an item in the shop."""
-    async with async_session() as session:
-        async with session.begin():
+    async for attempt in transaction():
+        async with attempt as session:
             player = await Player.from_message(event.message_snapshot, session)
             if not player or not await player.validate_resting(session):
                 return
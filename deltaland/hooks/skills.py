@@ -3,7 +3,15 @@ from deltabot_cli import AttrDict, events
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 
-from ..orm import BaseSkill, Player, Skill, async_session, fetchone
+from ..orm import (
+    PROFILE_SKILLS,
+    BaseSkill,
+    Player,
+    Skill,
+    async_session,
+    fetchone,
+    transaction,
+)
 
 hooks = events.HookCollection()
 
@@ -13,7 +21,7 @@ async def levelup_cmd(event: AttrDict) -> None:
     """Improve skills."""
     async with async_session() as session:
         player = await Player.from_message(
-            event.message_snapshot, session, [selectinload(Player.skills)]
+            event.message_snapshot, session, PROFILE_SKILLS
         )
         if not player:
             return
@@ -46,7 +54,7 @@ async def skills_cmd(event: AttrDict) -> None:
         player = await Player.from_message(
             event.message_snapshot,
             session,
-            [selectinload(Player.skills).selectinload(Skill.base)],
+            PROFILE_SKILLS,
         )
         if not player:
             return
@@ -61,8 +69,8 @@ async def skills_cmd(event: AttrDict) -> None:
 @hooks.on(events.NewMessage(command="/learn"))
 async def learn_cmd(event: AttrDict) -> None:
     """Level up an skill."""
-    async with async_session() as session:
-        async with session.begin():
+    async for attempt in transaction():
+        async with attempt as session:
             player = await Player.from_message(event.message_snapshot, session)
             if not player or not await player.validate_sp(1):
                 return
@@ -1,11 +1,11 @@
 """Tavern hooks"""
 from deltabot_cli import AttrDict, events
-from sqlalchemy.orm import selectinload
 
 from ..consts import DICE_FEE
 from ..dice import play_dice
 from ..game import get_next_day_cooldown
-from ..orm import CauldronCoin, Player, async_session
+from ..ledger import spend_gold
+from ..orm import PROFILE_CAULDRON, CauldronCoin, Player, async_session, transaction
 from ..util import get_image
 
 hooks = events.HookCollection()
@@ -41,15 +41,10 @@ async def tavern_cmd(event: AttrDict) -> None:
 @hooks.on(events.NewMessage(command="/dice"))
 async def dice_cmd(event: AttrDict) -> None:
     """Play dice in the tavern."""
-    async with async_session() as session:
-        async with session.begin():
-            options = [selectinload(Player.dice_rank), selectinload(Player.cooldowns)]
-            player = await Player.from_message(event.message_snapshot, session, options)
-            if (
-                not player
-                or not await player.validate_resting(session)
-                or not await player.validate_gold(DICE_FEE)
-            ):
+    async for attempt in transaction():
+        async with attempt as session:
+            player = await Player.from_message(event.message_snapshot, session)
+            if not player or not await player.validate_resting(session):
                 return
             await play_dice(player, session)
 
@@ -57,10 +52,10 @@ async def dice_cmd(event: AttrDict) -> None:
 @hooks.on(events.NewMessage(command="/cauldron"))
 async def cauldron_cmd(event: AttrDict) -> None:
     """Toss a coin in the magic cauldron."""
-    async with async_session() as session:
-        async with session.begin():
+    async for attempt in transaction():
+        async with attempt as session:
             player = await Player.from_message(
-                event.message_snapshot, session, [selectinload(Player.cauldron_coin)]
+                event.message_snapshot, session, PROFILE_CAULDRON
             )
             if not player or not await player.validate_resting(session):
                 return
@@ -70,11 +65,12 @@ async def cauldron_cmd(event: AttrDict) -> None:
                 await player.send_message(
                     text=f"You already tossed a coin, come again later. (⏰{cooldown})"
                 )
-            elif await player.validate_gold(1):
-                player.gold -= 1
+            elif await spend_gold(session, player.id, 1):
                 player.cauldron_coin = CauldronCoin()
                 text = (
                     "You tossed a coin into the cauldron, it disappeared in the pitch black"
                     f" inside of the cauldron without making a sound.\n\n(⏰ Gift in {cooldown})"
                 )
                 await player.send_message(text=text)
+            else:
+                await player.notify_not_enough_gold()
@@ -0,0 +1,75 @@
+"""De-duplication of incoming messages.
+
+Core can deliver the same message again, for example if the bot restarts before
+the message is marked as seen. The IDs of the recent messages are kept in a bounded
+in-memory set, and the ID of each message is saved in the same transaction as the
+changes made while handling it (see orm.transaction()), so a /buy or /sell is never
+charged twice, even across restarts. Each bot hook handles different messages,
+so a message is handled by a single hook.
+"""
+import functools
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from sqlalchemy.future import select
+from sqlalchemy.sql.expression import delete
+
+from . import stats
+from .consts import INBOUND_CACHE_SIZE, INBOUND_TTL
+from .orm import InboundMessage, async_session
+from .util import inbound_message_id
+
+_recent: "OrderedDict[int, None]" = OrderedDict()
+
+
+async def init() -> None:
+    """Load the IDs of the most recent handled messages from the database."""
+    stmt = (
+        select(InboundMessage.id)
+        .order_by(InboundMessage.received_at.desc())
+        .limit(INBOUND_CACHE_SIZE)
+    )
+    async with async_session() as session:
+        ids = (await session.execute(stmt)).scalars().all()
+    _recent.clear()
+    for msg_id in reversed(ids):
+        _recent[msg_id] = None
+
+
+def is_duplicate(msg_id: int) -> bool:
+    """Return True if the message was already handled, remember it otherwise."""
+    if msg_id in _recent:
+        return True
+    _recent[msg_id] = None
+    if len(_recent) > INBOUND_CACHE_SIZE:
+        _recent.popitem(last=False)
+    return False
+
+
+def deduplicate(hook: Callable) -> Callable:
+    """Wrap a new message hook to ignore the messages already handled."""
+
+    @functools.wraps(hook)
+    async def wrapper(event, *args, **kwargs):
+        msg_id = event.message_snapshot.id
+        if is_duplicate(msg_id):
+            stats.totals.duplicates += 1
+            logging.info("Ignoring message already handled: %s", msg_id)
+            return None
+        token = inbound_message_id.set(msg_id)
+        try:
+            return await hook(event, *args, **kwargs)
+        finally:
+            inbound_message_id.reset(token)
+
+    return wrapper
+
+
+async def delete_expired(session) -> None:
+    """Delete the saved IDs of the messages handled more than INBOUND_TTL ago."""
+    expired = int(time.time()) - INBOUND_TTL
+    await session.execute(
+        delete(InboundMessage).where(InboundMessage.received_at < expired)
+    )
@@ -0,0 +1,77 @@
+"""Atomic updates of player counters.
+
+Counters are changed with a single UPDATE or upsert statement without loading the rows,
+so the result is correct even if other sessions change the same counters.
+"""
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm.attributes import InstrumentedAttribute, set_committed_value
+from sqlalchemy.sql.expression import update
+
+from .orm import BattleRank, CauldronRank, DiceRank, Player, SentinelRank
+
+_ranks = (BattleRank, CauldronRank, DiceRank, SentinelRank)
+
+
+async def add_gold(session, player_id: int, delta: int) -> None:
+    """Add the given amount of gold to the player, delta can be negative."""
+    await add(session, Player.gold, player_id, delta)
+
+
+async def spend_gold(session, player_id: int, amount: int) -> bool:
+    """Take the given amount of gold from the player if they have enough.
+
+    Return False, without changing the gold, if the player doesn't have enough.
+    """
+    stmt = (
+        update(Player)
+        .where(Player.id == player_id, Player.gold >= amount)
+        .values(gold=Player.gold - amount)
+        .execution_options(synchronize_session="evaluate")
+    )
+    return (await session.execute(stmt)).rowcount == 1
+
+
+async def lose_gold(session, player_id: int, amount: int) -> None:
+    """Take up to the given amount of gold from the player, gold doesn't go below 0."""
+    stmt = (
+        update(Player)
+        .where(Player.id == player_id)
+        .values(gold=func.max(Player.gold - amount, 0))
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(stmt)
+    # MAX() can't be evaluated by the session, update the loaded player by hand
+    player = session.identity_map.get(session.identity_key(Player, player_id))
+    if player is not None and "gold" in player.__dict__:
+        set_committed_value(player, "gold", max(player.gold - amount, 0))
+
+
+async def add(
+    session, column: InstrumentedAttribute, player_id: int, delta: int
+) -> None:
+    """Add delta to the given column of a player or rank.
+
+    Rank rows are created if they don't exist. Player objects already loaded in the
+    session are updated too, but rank objects are not, avoid loading the ranks you
+    change with this function.
+    """
+    model = column.class_
+    if model is Player:
+        stmt = (
+            update(Player)
+            .where(Player.id == player_id)
+            .values({column: column + delta})
+            .execution_options(synchronize_session="evaluate")
+        )
+    elif model in _ranks:
+        stmt = (
+            insert(model)
+            .values({"id": player_id, column.key: delta})
+            .on_conflict_do_update(
+                index_elements=[model.id], set_={column.key: column + delta}
+            )
+        )
+    else:
+        raise ValueError(f"Unsupported counter: {column}")
+    await session.execute(stmt)
@@ -0,0 +1,111 @@
+"""Tracing of the game lock acquisitions"""
+import heapq
+import itertools
+import json
+import sys
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, List, Optional, Tuple
+
+from .profiler import find_hook
+
+TOP_SIZE = 20
+TIMELINE_SIZE = 100000
+
+_enabled = False
+_current: ContextVar[Optional["Acquisition"]] = ContextVar("acquisition", default=None)
+_counter = itertools.count()
+_timeline: Deque["Acquisition"] = deque(maxlen=TIMELINE_SIZE)
+_top: List[Tuple[float, int, "Acquisition"]] = []  # min-heap of the longest holds
+
+
+class Acquisition:
+    def __init__(self, site: str) -> None:
+        self.site = site
+        self.requested_at = time.time()
+        self.wait = 0.0
+        self.hold = 0.0
+
+
+def enable() -> None:
+    global _enabled  # noqa
+    _enabled = True
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def start() -> Acquisition:
+    """Start tracing a lock acquisition requested by the caller."""
+    acquisition = Acquisition(find_hook(sys._getframe(1)) or "unknown")  # noqa
+    _current.set(acquisition)
+    return acquisition
+
+
+def set_site(site: str) -> None:
+    """Set a more specific call site for the lock currently held, if tracing."""
+    acquisition = _current.get()
+    if acquisition:
+        acquisition.site = site
+
+
+def finish(acquisition: Acquisition, wait: float, hold: float) -> None:
+    acquisition.wait = wait
+    acquisition.hold = hold
+    _timeline.append(acquisition)
+    entry = (hold, next(_counter), acquisition)
+    if len(_top) < TOP_SIZE:
+        heapq.heappush(_top, entry)
+    elif hold > _top[0][0]:
+        heapq.heapreplace(_top, entry)
+
+
+def get_top() -> List[Acquisition]:
+    """Get the acquisitions that held the lock for the longest time, longest first."""
+    return [entry[2] for entry in sorted(_top, reverse=True)]
+
+
+def get_report() -> str:
+    lines = [f"**🔒 Longest lock holders** ({len(_timeline)} traced acquisitions)", ""]
+    for acquisition in get_top():
+        date = time.strftime("%H:%M:%S", time.localtime(acquisition.requested_at))
+        lines.append(
+            f"{acquisition.site}: hold {acquisition.hold * 1000:.0f}ms,"
+            f" wait {acquisition.wait * 1000:.0f}ms ({date})"
+        )
+    return "\n".join(lines)
+
+
+def get_timeline() -> List[Acquisition]:
+    """Get the most recent traced acquisitions, oldest first."""
+    return list(_timeline)
+
+
+def dump_timeline(path: str, timeline: List[Acquisition]) -> None:
+    """Save the given acquisitions in Chrome's Trace Event Format.
+
+    The file can be opened with chrome://tracing or https://ui.perfetto.dev
+    """
+    with open(path, "w", encoding="utf-8") as file:
+        file.write('{"traceEvents": [\n')
+        for i, acquisition in enumerate(timeline):
+            start = acquisition.requested_at * 1e6
+            wait_end = start + acquisition.wait * 1e6
+            common = {"name": acquisition.site, "pid": 1, "tid": 1}
+            events = [
+                # waits overlap each other so they are async events
+                {**common, "cat": "wait", "ph": "b", "id": i, "ts": start},
+                {**common, "cat": "wait", "ph": "e", "id": i, "ts": wait_end},
+                {
+                    **common,
+                    "cat": "hold",
+                    "ph": "X",
+                    "ts": wait_end,
+                    "dur": acquisition.hold * 1e6,
+                },
+            ]
+            separator = ",\n" if i < len(timeline) - 1 else "\n"
+            file.write(",\n".join(json.dumps(event) for event in events) + separator)
+        file.write("]}\n")
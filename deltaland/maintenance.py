@@ -0,0 +1,170 @@
+"""Scheduled database maintenance.
+
+The game database has a lot of churn: battle reports and tactics are deleted and
+created every battle, players move to and from the archive tables and the ranks
+are wiped every month. Once a day a world event (see cooldown.py) runs the
+maintenance in background, in short steps holding the game lock with a pause
+between them so the players' commands keep running:
+
+- rank rows left at zero are deleted, the rankings show them as missing rows.
+- the query planner statistics are refreshed with ANALYZE, one table per step,
+  sampling at most MAINTENANCE_ANALYSIS_LIMIT rows per index.
+- the free pages are returned to the file system with an incremental vacuum,
+  MAINTENANCE_VACUUM_PAGES pages per step.
+"""
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Any, Callable, List, NamedTuple
+
+from sqlalchemy.sql.expression import delete
+
+from .consts import (
+    MAINTENANCE_ANALYSIS_LIMIT,
+    MAINTENANCE_STEP_PAUSE,
+    MAINTENANCE_VACUUM_PAGES,
+)
+from .orm import (
+    BattleRank,
+    CauldronRank,
+    DiceRank,
+    SentinelRank,
+    async_session,
+    game_lock,
+)
+from .util import run_in_background
+
+_RANK_COLUMNS = (
+    BattleRank.victories,
+    CauldronRank.gold,
+    DiceRank.gold,
+    SentinelRank.stopped,
+)
+_AUTO_VACUUM_INCREMENTAL = 2
+
+_db_path = ""
+_running = False
+
+
+class _FileStats(NamedTuple):
+    page_size: int
+    pages: int
+    free_pages: int
+
+    @property
+    def size(self) -> int:
+        return self.page_size * self.pages
+
+
+def init(db_path: str) -> None:
+    """Set the path of the database to maintain."""
+    global _db_path  # noqa
+    _db_path = db_path
+
+
+def start_maintenance() -> None:
+    """Run the database maintenance in background."""
+    run_in_background(run_maintenance())
+
+
+async def run_maintenance() -> None:
+    global _running  # noqa
+    if _running:
+        logging.warning("Maintenance skipped, the previous one is still running")
+        return
+    _running = True
+    try:
+        await _run_maintenance()
+    except Exception as ex:
+        logging.exception(ex)
+    finally:
+        _running = False
+
+
+async def _run_maintenance() -> None:
+    start = time.perf_counter()
+    database = sqlite3.connect(_db_path, isolation_level=None, check_same_thread=False)
+    try:
+        database.execute(f"PRAGMA analysis_limit={MAINTENANCE_ANALYSIS_LIMIT}")
+        before = await _run_step(_get_file_stats, database)
+        ranks = await _compact_ranks()
+        await asyncio.sleep(MAINTENANCE_STEP_PAUSE)
+        tables = await _run_step(_get_tables, database)
+        for table in tables:
+            await _run_step(database.execute, f'ANALYZE "{table}"')
+        freed = 0
+        if await _run_step(_get_auto_vacuum, database) == _AUTO_VACUUM_INCREMENTAL:
+            while True:
+                pages = await _run_step(_vacuum, database)
+                freed += pages
+                if pages < MAINTENANCE_VACUUM_PAGES:
+                    break
+        else:
+            logging.warning("Incremental vacuum is disabled in the database")
+        after = await _run_step(_get_file_stats, database)
+    finally:
+        database.close()
+    logging.info(
+        "Database maintenance done in %.1fs: %s empty rank rows deleted,"
+        " %s tables analyzed, %s pages freed, size %.1fMB -> %.1fMB,"
+        " free pages %s -> %s",
+        time.perf_counter() - start,
+        ranks,
+        len(tables),
+        freed,
+        before.size / 1024 / 1024,
+        after.size / 1024 / 1024,
+        before.free_pages,
+        after.free_pages,
+    )
+
+
+async def _run_step(func: Callable, *args) -> Any:
+    """Run a step in a worker thread holding the game lock, then let the game run."""
+    loop = asyncio.get_event_loop()
+    async with game_lock():
+        result = await loop.run_in_executor(None, func, *args)
+    await asyncio.sleep(MAINTENANCE_STEP_PAUSE)
+    return result
+
+
+async def _compact_ranks() -> int:
+    """Delete the rank rows left at zero, return the number of deleted rows."""
+    deleted = 0
+    async with async_session() as session:
+        async with session.begin():
+            for column in _RANK_COLUMNS:
+                stmt = delete(column.class_).where(column == 0)
+                deleted += (await session.execute(stmt)).rowcount
+    return deleted
+
+
+def _get_file_stats(database: sqlite3.Connection) -> _FileStats:
+    return _FileStats(
+        page_size=database.execute("PRAGMA page_size").fetchone()[0],
+        pages=database.execute("PRAGMA page_count").fetchone()[0],
+        free_pages=database.execute("PRAGMA freelist_count").fetchone()[0],
+    )
+
+
+def _get_tables(database: sqlite3.Connection) -> List[str]:
+    query = (
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+    )
+    return [row[0] for row in database.execute(query)]
+
+
+def _get_auto_vacuum(database: sqlite3.Connection) -> int:
+    return database.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+
+def _vacuum(database: sqlite3.Connection) -> int:
+    """Free up to MAINTENANCE_VACUUM_PAGES pages, return the number of pages freed."""
+    pages = min(_get_file_stats(database).free_pages, MAINTENANCE_VACUUM_PAGES)
+    database.execute("BEGIN")
+    with database:  # commit, or rollback on error
+        # the sqlite3 module runs a single step of the statement, that frees one page
+        for _ in range(pages):
+            database.execute("PRAGMA incremental_vacuum")
+    return pages
@@ -1,13 +1,79 @@
-"""Database migrations"""
+"""Database migrations
+
+Each migration has a synchronous schema step, the migrateN() functions, and
+optionally data migrations (backfills) that update existing rows in chunks of
+MIGRATION_CHUNK_SIZE rows, each chunk in its own transaction. The progress of the
+backfills is saved in the migration_backfill table, so an interrupted backfill
+continues where it stopped the next time the bot starts.
+
+Blocking backfills are completed before the next migration and before the bot
+starts. Non-blocking backfills can be run in background while the bot is serving,
+see run_background_backfills(), they must be safe to run concurrently with the
+game, for example only filling NULL values.
+"""
+import asyncio
 import logging
 import os
 import sqlite3
 import time
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import text
+
+from .consts import (
+    DATABASE_VERSION,
+    MIGRATION_CHUNK_PAUSE,
+    MIGRATION_CHUNK_SIZE,
+    MIGRATION_LOG_INTERVAL,
+    STARTING_INV_SIZE,
+    WORLD_ID,
+    StateEnum,
+)
+from .orm import async_session
+
+
+class Backfill(NamedTuple):
+    """Data migration updating the rows of a table in chunks."""
+
+    name: str
+    table: str
+    values: str  # SET clause of the UPDATE statement
+    where: str = "1"
+    blocking: bool = True
+
+    def get_query(self) -> str:
+        return (
+            f"UPDATE {self.table} SET {self.values}"
+            f" WHERE rowid > :start AND rowid <= :end AND ({self.where})"
+        )
+
+
+class _Progress(NamedTuple):
+    last_rowid: int
+    max_rowid: int
+
+
+# database version -> backfills registered when the schema step of the version is run
+BACKFILLS: Dict[int, List[Backfill]] = {
+    7: [
+        Backfill(
+            "v7_player_stats",
+            "player",
+            "hp=40, max_hp=40, skill_points=level-1,"
+            " max_attack=attack, max_defense=defense",
+        ),
+        Backfill("v7_item_attack", "item", "max_attack=5", "base_id=1"),
+        Backfill("v7_item_defense", "item", "max_defense=3, defense=2", "base_id=2"),
+    ],
+}
 
-from .consts import DATABASE_VERSION, STARTING_INV_SIZE
 
+def run_migrations(dbpath: str, background: bool = False) -> None:
+    """Migrate the database to the current version.
 
-def run_migrations(dbpath: str) -> None:
+    If background is True, the non-blocking backfills are left pending to be run
+    with run_background_backfills() after the bot starts.
+    """
     if not os.path.exists(dbpath):
         logging.debug("Database doesn't exists, skipping migrations")
         return
@@ -15,6 +81,11 @@ def run_migrations(dbpath: str) -> None:
     database = sqlite3.connect(dbpath)
     database.row_factory = sqlite3.Row
     try:
+        database.execute(
+            "CREATE TABLE IF NOT EXISTS migration_backfill (name TEXT PRIMARY KEY,"
+            " last_rowid INTEGER NOT NULL, max_rowid INTEGER NOT NULL)"
+        )
+        _run_pending_backfills(database, blocking_only=True)
         version = database.execute("SELECT * FROM game").fetchone()["version"]
         logging.debug("Current database version: v%s", version)
         for i in range(version + 1, DATABASE_VERSION + 1):
@@ -24,10 +95,149 @@ def run_migrations(dbpath: str) -> None:
             with database:
                 database.execute("UPDATE game SET version=?", (i,))
                 migration(database)
+                for backfill in BACKFILLS.get(i, []):
+                    _register_backfill(database, backfill)
+            _run_pending_backfills(database, blocking_only=True)
+        if not background:
+            _run_pending_backfills(database, blocking_only=False)
     finally:
         database.close()
 
 
+def _register_backfill(database: sqlite3.Connection, backfill: Backfill) -> None:
+    if not _table_exists(database, backfill.table):
+        return
+    query = f"SELECT min(rowid), max(rowid) FROM {backfill.table}"
+    min_rowid, max_rowid = database.execute(query).fetchone()
+    if max_rowid is not None:
+        database.execute(
+            "INSERT INTO migration_backfill VALUES (?, ?, ?)",
+            (backfill.name, min_rowid - 1, max_rowid),
+        )
+
+
+def _get_backfill(name: str) -> Optional[Backfill]:
+    for backfills in BACKFILLS.values():
+        for backfill in backfills:
+            if backfill.name == name:
+                return backfill
+    return None
+
+
+def _run_pending_backfills(database: sqlite3.Connection, blocking_only: bool) -> None:
+    rows = database.execute("SELECT * FROM migration_backfill").fetchall()
+    for row in rows:
+        backfill = _get_backfill(row["name"])
+        if not backfill:
+            logging.warning("Unknown data migration: %s", row["name"])
+        elif backfill.blocking or not blocking_only:
+            progress = _Progress(row["last_rowid"], row["max_rowid"])
+            _run_backfill(database, backfill, progress)
+
+
+def _run_backfill(
+    database: sqlite3.Connection, backfill: Backfill, progress: _Progress
+) -> None:
+    logger = _ProgressLogger(backfill, progress)
+    query = backfill.get_query()
+    start = progress.last_rowid
+    while start < progress.max_rowid:
+        end = min(start + MIGRATION_CHUNK_SIZE, progress.max_rowid)
+        with database:
+            database.execute(query, {"start": start, "end": end})
+            database.execute(
+                "UPDATE migration_backfill SET last_rowid=? WHERE name=?",
+                (end, backfill.name),
+            )
+        start = end
+        logger.log(end)
+    with database:
+        database.execute(
+            "DELETE FROM migration_backfill WHERE name=?", (backfill.name,)
+        )
+    logger.done()
+
+
+async def run_background_backfills() -> None:
+    """Run the pending non-blocking backfills while the bot is serving.
+
+    Each chunk is run in its own game session, pausing between chunks to let the
+    players' commands run.
+    """
+    async with async_session() as session:
+        query = "SELECT name FROM sqlite_master WHERE type='table' AND name=:name"
+        if not (
+            await session.execute(text(query), {"name": "migration_backfill"})
+        ).first():
+            return  # new database, created after run_migrations(), nothing to backfill
+        rows = (await session.execute(text("SELECT * FROM migration_backfill"))).all()
+    for row in rows:
+        backfill = _get_backfill(row.name)
+        if backfill and not backfill.blocking:
+            try:
+                await _run_background_backfill(
+                    backfill, _Progress(row.last_rowid, row.max_rowid)
+                )
+            except Exception as ex:  # it will continue in the next start
+                logging.exception(ex)
+
+
+async def _run_background_backfill(backfill: Backfill, progress: _Progress) -> None:
+    logger = _ProgressLogger(backfill, progress)
+    query = text(backfill.get_query())
+    start = progress.last_rowid
+    while start < progress.max_rowid:
+        end = min(start + MIGRATION_CHUNK_SIZE, progress.max_rowid)
+        async with async_session() as session:
+            async with session.begin():
+                await session.execute(query, {"start": start, "end": end})
+                await session.execute(
+                    text(
+                        "UPDATE migration_backfill SET last_rowid=:end WHERE name=:name"
+                    ),
+                    {"end": end, "name": backfill.name},
+                )
+        start = end
+        logger.log(end)
+        await asyncio.sleep(MIGRATION_CHUNK_PAUSE)
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                text("DELETE FROM migration_backfill WHERE name=:name"),
+                {"name": backfill.name},
+            )
+    logger.done()
+
+
+class _ProgressLogger:
+    def __init__(self, backfill: Backfill, progress: _Progress) -> None:
+        self.name = backfill.name
+        self.max_rowid = progress.max_rowid
+        self.started_at = self.logged_at = time.monotonic()
+        logging.info(
+            "Running data migration %s from row %s of %s",
+            self.name,
+            progress.last_rowid,
+            self.max_rowid,
+        )
+
+    def log(self, rowid: int) -> None:
+        now = time.monotonic()
+        if now - self.logged_at >= MIGRATION_LOG_INTERVAL:
+            self.logged_at = now
+            logging.info(
+                "Data migration %s: %s/%s rows (%.0f%%)",
+                self.name,
+                rowid,
+                self.max_rowid,
+                rowid / self.max_rowid * 100,
+            )
+
+    def done(self) -> None:
+        elapsed = time.monotonic() - self.started_at
+        logging.info("Data migration %s done in %.1fs", self.name, elapsed)
+
+
 def migrate5(database: sqlite3.Connection) -> None:
     database.execute(
         f"ALTER TABLE player ADD COLUMN inv_size INTEGER DEFAULT {STARTING_INV_SIZE}"
@@ -41,25 +251,66 @@ def migrate6(database: sqlite3.Connection) -> None:
 
 
 def migrate7(database: sqlite3.Connection) -> None:
-    database.execute("UPDATE player SET hp=40, max_hp=40")
-
-    # add skill_points
+    # the existing rows are updated by the v7 backfills
     database.execute("ALTER TABLE player ADD COLUMN skill_points INTEGER")
-    database.execute("UPDATE player SET skill_points=player.level-1")
-
-    # add shop_price column to BaseItem
     database.execute("ALTER TABLE baseitem ADD COLUMN shop_price INTEGER")
-
-    # add max_attack/max_defense
     database.execute("ALTER TABLE player ADD COLUMN max_attack INTEGER")
     database.execute("ALTER TABLE player ADD COLUMN max_defense INTEGER")
-    database.execute(
-        "UPDATE player SET max_attack=player.attack, max_defense=player.defense"
-    )
     database.execute("ALTER TABLE baseitem ADD COLUMN max_attack INTEGER")
     database.execute("ALTER TABLE baseitem ADD COLUMN max_defense INTEGER")
     database.execute("ALTER TABLE item ADD COLUMN max_attack INTEGER")
     database.execute("ALTER TABLE item ADD COLUMN max_defense INTEGER")
-    database.execute("UPDATE item SET max_attack=5 WHERE base_id=1")
-    database.execute("UPDATE item SET max_defense=3 WHERE base_id=2")
-    database.execute("UPDATE item SET defense=2 WHERE base_id=2")
+
+
+def migrate8(database: sqlite3.Connection) -> None:
+    # move player timers from the cooldown table to the player table
+    for prefix in ("", "archived_"):
+        tables = {"player": f"{prefix}player", "cooldown": f"{prefix}cooldown"}
+        if not _table_exists(database, tables["cooldown"]):
+            continue
+        for column in ("stamina_regen_at", "hp_regen_at", "state_ends_at"):
+            database.execute(
+                f"ALTER TABLE {tables['player']} ADD COLUMN {column} INTEGER"
+            )
+        query = "UPDATE {player} SET {column}=(SELECT ends_at FROM {cooldown}"
+        query += " WHERE {cooldown}.player_id={player}.id AND {cooldown}.id={state})"
+        database.execute(
+            query.format(column="stamina_regen_at", state=int(StateEnum.REST), **tables)
+        )
+        database.execute(
+            query.format(column="hp_regen_at", state=int(StateEnum.HEALING), **tables)
+        )
+        database.execute(
+            query.format(
+                column="state_ends_at", state=f"{tables['player']}.state", **tables
+            )
+            + f" WHERE state!={int(StateEnum.REST)}"
+        )
+    database.execute(f"DELETE FROM cooldown WHERE player_id!={WORLD_ID}")
+    database.execute("DROP TABLE IF EXISTS archived_cooldown")
+    for column in ("state", "stamina_regen_at", "hp_regen_at", "state_ends_at"):
+        database.execute(f"CREATE INDEX ix_player_{column} ON player ({column})")
+
+
+def migrate9(database: sqlite3.Connection) -> None:
+    for table in ("player", "archived_player"):
+        if _table_exists(database, table):
+            database.execute(
+                f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1"
+            )
+
+
+def migrate10(database: sqlite3.Connection) -> None:
+    database.execute("ALTER TABLE game ADD COLUMN catalog_hash VARCHAR(64)")
+
+
+def migrate11(database: sqlite3.Connection) -> None:
+    # enable the incremental vacuum of the maintenance, VACUUM can't run in a transaction
+    database.commit()
+    database.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    database.execute("VACUUM")
+
+
+def _table_exists(database: sqlite3.Connection, name: str) -> bool:
+    query = "SELECT name FROM sqlite_master WHERE type='table' AND name=?"
+    return database.execute(query, (name,)).fetchone() is not None
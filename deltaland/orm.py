@@ -1,18 +1,47 @@
 """database"""
 # pylama:ignore=R0904,C0103
 import asyncio
+import logging
+import random
 import time
 from contextlib import asynccontextmanager
-from typing import TYPE_CHECKING, Any, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
 from deltabot_cli import AttrDict, Bot
-from sqlalchemy import Column, ForeignKey, Integer, String, func
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Integer,
+    String,
+    Table,
+    bindparam,
+    event,
+    func,
+    insert,
+    update,
+)
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.future import select
-from sqlalchemy.orm import backref, relationship, sessionmaker
+from sqlalchemy.orm import (
+    Session,
+    backref,
+    configure_mappers,
+    joinedload,
+    load_only,
+    raiseload,
+    relationship,
+    selectinload,
+    sessionmaker,
+)
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.orm.session import ORMExecuteState
+from sqlalchemy.sql.expression import delete
 from sqlalchemy.sql.selectable import Select
 
+from . import locktrace, stats
 from .consts import (
     LIFEREGEN_COOLDOWN,
     MAX_HP,
@@ -25,23 +54,38 @@ from .consts import (
     STARTING_INV_SIZE,
     STARTING_LEVEL,
     THIEVE_NOTICED_COOLDOWN,
+    TRANSACTION_RETRIES,
+    TRANSACTION_RETRY_DELAY,
     WORLD_ID,
     CombatTactic,
     EquipmentSlot,
     ItemType,
+    MessageLane,
     StateEnum,
     Tier,
     equipable_items,
 )
 from .experience import required_exp
-from .util import get_image, render_stats, send_message
+from .util import (
+    deferred_messages,
+    get_image,
+    inbound_message_id,
+    render_stats,
+    run_in_background,
+    send_deferred,
+    send_message,
+)
 
 if TYPE_CHECKING:
     from .quests import Quest
 
 _session = None
+_engine = None
 _bot: Bot
 _lock: asyncio.Lock
+_batch_window = 0.0
+_batch_size = 0
+_batch: Optional["_WriteBatch"] = None
 
 
 class Base:
@@ -56,6 +100,8 @@ Base = declarative_base(cls=Base)  # noqa
 class Game(Base):
     id = Column(Integer, primary_key=True)
     version = Column(Integer)
+    # hash of the base items and skills saved in the database, see init_game()
+    catalog_hash = Column(String(64))
 
     def __init__(self, **kwargs):
         kwargs.setdefault("id", 0)
@@ -80,10 +126,15 @@ class Player(Base):
     stamina = Column(Integer)
     max_stamina = Column(Integer)
     gold = Column(Integer)
-    state = Column(Integer)
+    state = Column(Integer, index=True)
     thief_id = Column(Integer, ForeignKey("player.id"))
     inv_size = Column(Integer)
     last_seen = Column(Integer)
+    # timers processed by the cooldown loop, NULL if not running
+    stamina_regen_at = Column(Integer, index=True)
+    hp_regen_at = Column(Integer, index=True)
+    state_ends_at = Column(Integer, index=True)
+    version = Column(Integer, nullable=False)
     thief = relationship(
         "Player",
         uselist=False,
@@ -133,12 +184,11 @@ class Player(Base):
         cascade="all, delete, delete-orphan",
     )
     items = relationship("Item", backref="player", cascade="all, delete, delete-orphan")
-    cooldowns = relationship(
-        "Cooldown", backref="player", cascade="all, delete, delete-orphan"
-    )
     skills = relationship(
         "Skill", backref="player", cascade="all, delete, delete-orphan"
     )
+    # detect concurrent changes to the same player, see transaction()
+    __mapper_args__ = {"version_id_col": version}
 
     def __init__(self, **kwargs):
         kwargs.setdefault("level", STARTING_LEVEL)
@@ -180,76 +230,40 @@ class Player(Base):
             max_exp = required_exp(self.level + 1)
             self.exp = exp
         if leveled_up:
-            index = -1
-            for i, cooldwn in enumerate(self.cooldowns):
-                if cooldwn.id == StateEnum.REST:
-                    index = i
-                    break
-            if index >= 0:
-                self.cooldowns.pop(index)
+            self.stamina_regen_at = None
             if self.stamina < self.max_stamina:
                 self.stamina = self.max_stamina
         return leveled_up
 
     def reduce_stamina(self, stamina: int) -> None:
         self.stamina -= stamina
-        restoring = False
-        for cooldwn in self.cooldowns:
-            if cooldwn.id == StateEnum.REST:
-                restoring = True
-                break
-        if self.stamina < self.max_stamina and not restoring:
-            self.cooldowns.append(
-                Cooldown(  # noqa
-                    id=StateEnum.REST, ends_at=time.time() + STAMINA_COOLDOWN
-                )
-            )
+        if self.stamina < self.max_stamina and self.stamina_regen_at is None:
+            self.stamina_regen_at = time.time() + STAMINA_COOLDOWN
 
     def reduce_hp(self, hit_points: int) -> int:
         """Returns the effective amount of hp reduced"""
         hit_points = min(self.hp - 1, hit_points)
         self.hp -= hit_points
-        restoring = False
-        for cooldwn in self.cooldowns:
-            if cooldwn.id == StateEnum.HEALING:
-                restoring = True
-                break
-        if self.hp < self.max_hp and not restoring:
-            self.cooldowns.append(
-                Cooldown(  # noqa
-                    id=StateEnum.HEALING, ends_at=time.time() + LIFEREGEN_COOLDOWN
-                )
-            )
+        if self.hp < self.max_hp and self.hp_regen_at is None:
+            self.hp_regen_at = time.time() + LIFEREGEN_COOLDOWN
         return hit_points
 
     def start_quest(self, quest: "Quest") -> None:
         self.state = quest.id
-        end = time.time() + quest.duration
-        self.cooldowns.append(Cooldown(id=quest.id, ends_at=end))  # noqa
+        self.state_ends_at = time.time() + quest.duration
         self.reduce_stamina(quest.stamina_cost)
 
     def start_noticing(self, thief: "Player") -> None:
         self.state = StateEnum.NOTICED_THIEF
         thief.state = StateEnum.NOTICED_SENTINEL
         self.thief = thief
-        self.cooldowns.append(
-            Cooldown(  # noqa
-                id=StateEnum.NOTICED_THIEF,
-                ends_at=time.time() + THIEVE_NOTICED_COOLDOWN,
-            )
-        )
+        self.state_ends_at = time.time() + THIEVE_NOTICED_COOLDOWN
 
     def stop_noticing(self) -> None:
         thief = self.thief
         self.thief = None
         thief.state = self.state = StateEnum.REST
-        index = -1
-        for i, cooldwn in enumerate(self.cooldowns):
-            if cooldwn.id == StateEnum.NOTICED_THIEF:
-                index = i
-                break
-        assert index >= 0
-        self.cooldowns.pop(index)
+        self.state_ends_at = None
 
     @staticmethod
     def get_all() -> Select:
@@ -257,25 +271,33 @@ class Player(Base):
 
     @staticmethod
     def get_all_active() -> Select:
-        one_month_ago = int(time.time()) - 60 * 60 * 24 * 30
-        return select(Player).filter(Player.id > 0, Player.last_seen > one_month_ago)
+        return select(Player).filter(Player.id > 0, Player.last_seen > _active_since())
 
     @staticmethod
     def count() -> Select:
         return select(func.count()).select_from(Player).filter(Player.id > 0)
 
+    @staticmethod
+    def count_active() -> Select:
+        return Player.count().filter(Player.last_seen > _active_since())
+
     @staticmethod
     async def from_message(
         msg: AttrDict, session: sessionmaker, options=None
     ) -> Optional["Player"]:
         """Get the player corresponding to a message.
 
+        options are the loader options of the relationships to load, usually one
+        of the PROFILE_* loading profiles.
+
         An error message is sent if the user have not joined the game yet
         """
         stmt = select(Player).filter_by(id=msg.sender.id)
         for option in options or []:
             stmt = stmt.options(option)
         player = await fetchone(session, stmt)
+        if not player and await restore_player(session, msg.sender.id):
+            player = await fetchone(session, stmt)
         if player:
             player.last_seen = int(time.time())
             return player
@@ -296,10 +318,13 @@ class Player(Base):
     async def validate_gold(self, required_gold: int) -> bool:
         if self.gold >= required_gold:
             return True
+        await self.notify_not_enough_gold()
+        return False
+
+    async def notify_not_enough_gold(self) -> None:
         await self.send_message(
             text="You don't even have enough gold for a pint of grog.\nWhy don't you get a job?"
         )
-        return False
 
     async def validate_sp(self, required_sp: int) -> bool:
         if self.skill_points >= required_sp:
@@ -452,6 +477,11 @@ class Player(Base):
         )
 
 
+def _active_since() -> int:
+    """Players seen after the returned timestamp are considered active"""
+    return int(time.time()) - 60 * 60 * 24 * 30
+
+
 class BaseItem(Base):
     id = Column(Integer, primary_key=True)
     type = Column(Integer, nullable=False)
@@ -528,10 +558,18 @@ class Item(Base):
 
 
 class Cooldown(Base):
+    """Scheduled world events, player timers are columns of Player."""
+
     id = Column(Integer, primary_key=True)
     player_id = Column(Integer, ForeignKey("player.id"), primary_key=True)
     ends_at = Column(Integer, nullable=False)
-    player: Player
+
+
+class InboundMessage(Base):
+    """Incoming messages already handled, see inbound.py"""
+
+    id = Column(Integer, primary_key=True)
+    received_at = Column(Integer, nullable=False, index=True)
 
 
 class BattleTactic(Base):
@@ -606,25 +644,454 @@ class Skill(Base):
     player: Player
 
 
+# Loading profiles: the relationships each kind of command needs, to be passed to
+# Player.from_message(). One-to-one relationships are joined in the same query,
+# collections are loaded with a second query.
+configure_mappers()  # create the backrefs used below
+PROFILE_STATUS = (
+    joinedload(Player.battle_tactic),
+    joinedload(Player.thief),
+    joinedload(Player.sentinel),
+)
+PROFILE_COMBAT = (joinedload(Player.battle_report),)
+PROFILE_THIEF = (joinedload(Player.thief),)
+PROFILE_INVENTORY = (selectinload(Player.items).joinedload(Item.base),)
+PROFILE_SKILLS = (selectinload(Player.skills).joinedload(Skill.base),)
+PROFILE_CAULDRON = (joinedload(Player.cauldron_coin),)
+# the rankings only show the player's name and check the level, the version is
+# loaded so updating last_seen doesn't need to query it
+_RANKED_PLAYER = load_only(Player.name, Player.level, Player.version)
+PROFILE_BATTLE_RANK = (_RANKED_PLAYER, joinedload(Player.battle_rank))
+PROFILE_CAULDRON_RANK = (_RANKED_PLAYER, joinedload(Player.cauldron_rank))
+PROFILE_DICE_RANK = (_RANKED_PLAYER, joinedload(Player.dice_rank))
+PROFILE_SENTINEL_RANK = (_RANKED_PLAYER, joinedload(Player.sentinel_rank))
+
+
+def enable_strict_loading() -> None:
+    """Make lazy loads that would query the database fail, used in tests.
+
+    Commands must load everything they use in advance, see the PROFILE_* constants.
+    """
+    if not event.contains(Session, "do_orm_execute", _raise_on_lazy_load):
+        event.listen(Session, "do_orm_execute", _raise_on_lazy_load)
+
+
+def disable_strict_loading() -> None:
+    """Undo enable_strict_loading()."""
+    if event.contains(Session, "do_orm_execute", _raise_on_lazy_load):
+        event.remove(Session, "do_orm_execute", _raise_on_lazy_load)
+
+
+def _raise_on_lazy_load(state: ORMExecuteState) -> None:
+    if state.is_select and not state.is_relationship_load:
+        state.statement = state.statement.options(raiseload("*", sql_only=True))
+
+
+def _archive_table(table: Table) -> Table:
+    """Create a table with the same columns as the given one to hold archived rows."""
+    return Table(
+        f"archived_{table.name}",
+        Base.metadata,
+        *(
+            Column(col.name, col.type, primary_key=col.primary_key)
+            for col in table.columns
+        ),
+    )
+
+
+# tables holding player data and the column referencing the player,
+# the player table goes first so it is restored before its dependent rows
+_player_tables = [
+    (Player.__table__, Player.__table__.c.id),
+    (Item.__table__, Item.__table__.c.player_id),
+    (Skill.__table__, Skill.__table__.c.player_id),
+    (BattleTactic.__table__, BattleTactic.__table__.c.id),
+    (BattleReport.__table__, BattleReport.__table__.c.id),
+    (BattleRank.__table__, BattleRank.__table__.c.id),
+    (DiceRank.__table__, DiceRank.__table__.c.id),
+    (CauldronRank.__table__, CauldronRank.__table__.c.id),
+    (CauldronCoin.__table__, CauldronCoin.__table__.c.id),
+    (SentinelRank.__table__, SentinelRank.__table__.c.id),
+]
+_archive_tables: Dict[str, Table] = {
+    table.name: _archive_table(table) for table, _ in _player_tables
+}
+
+
+async def _move_rows(
+    session: sessionmaker, source: Table, target: Table, column: str, ids: List[int]
+) -> None:
+    """Move the rows with the given ids in the given column from source to target."""
+    if source.name == "item" or target.name == "item":
+        # item IDs are reused by SQLite after deletion, let the restored items get new IDs
+        columns = [col.name for col in source.columns if col.name != "id"]
+    else:
+        columns = [col.name for col in source.columns]
+    stmt = select(*(source.c[name] for name in columns)).where(
+        source.c[column].in_(ids)
+    )
+    await session.execute(insert(target).from_select(columns, stmt))
+    await session.execute(delete(source).where(source.c[column].in_(ids)))
+
+
+async def archive_players(
+    session: sessionmaker, inactive_since: int, limit: int
+) -> int:
+    """Move players not seen since the given timestamp to the archive tables.
+
+    Only resting players are archived. Return the number of archived players.
+    """
+    stmt = (
+        select(Player.id)
+        .filter(
+            Player.id > 0,
+            Player.state == StateEnum.REST,
+            Player.last_seen < inactive_since,
+        )
+        .limit(limit)
+    )
+    ids = (await session.execute(stmt)).scalars().all()
+    if ids:
+        for table, column in reversed(_player_tables):
+            await _move_rows(
+                session, table, _archive_tables[table.name], column.name, ids
+            )
+    return len(ids)
+
+
+async def restore_player(session: sessionmaker, player_id: int) -> bool:
+    """Move an archived player back to the live tables.
+
+    Return True if the player was archived, False otherwise.
+    """
+    archived_player = _archive_tables[Player.__table__.name]
+    stmt = select(archived_player.c.id).where(archived_player.c.id == player_id)
+    if not await fetchone(session, stmt):
+        return False
+    for table, column in _player_tables:
+        await _move_rows(
+            session, _archive_tables[table.name], table, column.name, [player_id]
+        )
+    session.info["restored"] = True
+    return True
+
+
+# columns changed by the quests and the player timers, written by update_players()
+_PROGRESS_COLUMNS = (
+    "level",
+    "exp",
+    "skill_points",
+    "hp",
+    "hp_regen_at",
+    "stamina",
+    "stamina_regen_at",
+    "state",
+    "state_ends_at",
+)
+
+
+async def update_players(
+    session: sessionmaker, players: List[Player], gold: Dict[int, int]
+) -> None:
+    """Write the progress and timers of the given players in a single executemany UPDATE.
+
+    gold maps player IDs to the amount of gold to add, it is added atomically like
+    ledger.add_gold() does. The players are marked as saved so the session doesn't
+    flush them again, other changes to them are flushed as usual. Raises
+    StaleDataError if other session changed any of the players.
+    """
+    if not players:
+        return
+    table = Player.__table__
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam("b_id"))
+        .where(table.c.version == bindparam("b_version"))
+        .values(gold=table.c.gold + bindparam("b_gold"))
+    )
+    saved = []
+    params = []
+    for player in players:
+        values = {key: getattr(player, key) for key in _PROGRESS_COLUMNS}
+        values["version"] = player.version + 1
+        saved.append((player, values))
+        params.append(
+            dict(
+                values,
+                b_id=player.id,
+                b_version=player.version,
+                b_gold=gold.get(player.id, 0),
+            )
+        )
+    # autoflush would write the players one by one before the UPDATE
+    with session.no_autoflush:
+        result = await session.execute(stmt, params)
+    if result.rowcount != len(params):
+        raise StaleDataError(
+            f"UPDATE statement on table 'player' expected to update {len(params)}"
+            f" row(s); {result.rowcount} were matched."
+        )
+    for player, values in saved:
+        for key, value in values.items():
+            set_committed_value(player, key, value)
+        set_committed_value(player, "gold", player.gold + gold.get(player.id, 0))
+
+
+class _BatchSession(AsyncSession):
+    """Session shared by a write batch, the transactions begun by its users are savepoints."""
+
+    def begin(self, **_kwargs):
+        return self.begin_nested()
+
+
+class _WriteBatch:
+    """Transaction shared by the sessions opened within the write batching window."""
+
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+        self.size = 0
+        self.started_at = time.perf_counter()
+        self.committed = asyncio.get_event_loop().create_future()
+
+
 @asynccontextmanager
 async def async_session():
     """Get session"""
-    async with _lock:
+    if _batch_window:
+        async with _batched_session() as session:
+            yield session
+        return
+
+    async with _locked():
         async with _session() as session:
             yield session
+            await _commit_restored(session)
+
+
+@asynccontextmanager
+async def game_lock():
+    """Hold the game lock without opening a session, no database writes are made meanwhile.
+
+    The pending write batch, if any, is committed first.
+    """
+    async with _locked():
+        if _batch:
+            await _commit_batch(_batch)
+        yield
+
+
+@asynccontextmanager
+async def _locked():
+    """Hold the game lock, tracing it if statistics or lock tracing are enabled."""
+    if not stats.is_enabled() and not locktrace.is_enabled():
+        async with _lock:
+            yield
+        return
+
+    acquisition = locktrace.start() if locktrace.is_enabled() else None
+    start = time.perf_counter()
+    async with _lock:
+        acquired = time.perf_counter()
+        try:
+            yield
+        finally:
+            wait, hold = acquired - start, time.perf_counter() - acquired
+            if stats.is_enabled():
+                stats.record_lock(wait, hold)
+            if acquisition:
+                locktrace.finish(acquisition, wait, hold)
+
+
+@asynccontextmanager
+async def _batched_session():
+    """Get a session in a savepoint of the current write batch.
+
+    The messages sent while using the session are delayed until the batch is
+    committed, if the session fails its changes are rolled back and its messages
+    are dropped.
+    """
+    messages: List[Tuple[Any, dict, MessageLane]] = []
+    token = deferred_messages.set(messages)
+    try:
+        async with _locked():
+            batch = _batch or _start_batch()
+            try:
+                async with batch.session.begin_nested():
+                    yield batch.session
+            finally:
+                # don't leak objects to the next sessions, they must query fresh rows
+                batch.session.expunge_all()
+            batch.size += 1
+            if batch.size >= _batch_size:
+                await _commit_batch(batch)
+        await asyncio.shield(batch.committed)
+    finally:
+        deferred_messages.reset(token)
+    await send_deferred(messages)
+
+
+def _start_batch() -> _WriteBatch:
+    global _batch  # noqa
+    batch = _batch = _WriteBatch(_session())
+    asyncio.get_event_loop().call_later(
+        _batch_window, lambda: run_in_background(_commit_when_due(batch))
+    )
+    return batch
+
+
+async def _commit_when_due(batch: _WriteBatch) -> None:
+    async with _lock:
+        if _batch is batch:
+            await _commit_batch(batch)
+
+
+async def _commit_batch(batch: _WriteBatch) -> None:
+    """Commit the given batch, must be called holding the game lock."""
+    global _batch  # noqa
+    _batch = None
+    start = time.perf_counter()
+    try:
+        await batch.session.commit()
+    except Exception as ex:  # all the sessions of the batch fail
+        batch.committed.set_exception(ex)
+        if not batch.size:
+            batch.committed.exception()  # nobody is waiting, avoid asyncio warning
+    else:
+        batch.committed.set_result(None)
+    finally:
+        await batch.session.close()
+    if stats.is_enabled():
+        stats.record_write_batch(batch.size, time.perf_counter() - start)
+
+
+def enable_write_batching(window: float, max_size: int) -> None:
+    """Commit together the sessions opened within window seconds, up to max_size.
+
+    Must be called before init_db_engine()
+    """
+    global _batch_window, _batch_size  # noqa
+    _batch_window = window
+    _batch_size = max_size
+
+
+def _enable_savepoints(engine: Engine) -> None:
+    """Let SQLAlchemy control the transactions, pysqlite breaks SAVEPOINT otherwise."""
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, _connection_record) -> None:
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _on_begin(conn) -> None:
+        conn.exec_driver_sql("BEGIN")
+
+
+def transaction(retries: int = TRANSACTION_RETRIES) -> "_Transaction":
+    """Run a block of code in a transaction, re-running it on concurrent changes.
+
+    If another session changed the same players, the transaction is rolled back
+    and the block is run again after a random delay, up to the given number of
+    retries. Messages sent in the block are delayed until the transaction is
+    committed. Usage::
+
+        async for attempt in transaction():
+            async with attempt as session:
+                ...
+    """
+    return _Transaction(retries)
+
+
+class _Transaction:
+    def __init__(self, retries: int) -> None:
+        self.retries = retries
+        self.attempts = 0
+        self.done = False
+
+    def __aiter__(self) -> "_Transaction":
+        return self
+
+    async def __anext__(self):
+        if self.done:
+            raise StopAsyncIteration
+        if self.attempts:
+            delay = TRANSACTION_RETRY_DELAY * 2 ** (self.attempts - 1)
+            await asyncio.sleep(random.uniform(0, delay))  # jitter spreads the retries
+        self.attempts += 1
+        return _run_attempt(self)
+
+
+@asynccontextmanager
+async def _run_attempt(txn: _Transaction):
+    messages: List[Tuple[Any, dict, MessageLane]] = []
+    token = deferred_messages.set(messages)
+    try:
+        async with async_session() as session:
+            async with session.begin():
+                yield session
+                await _save_inbound_message(session)
+    except StaleDataError as ex:
+        stats.totals.conflicts += 1
+        if txn.attempts > txn.retries:
+            raise
+        logging.debug("Transaction conflict, retrying: %s", ex)
+        return
+    finally:
+        deferred_messages.reset(token)
+    txn.done = True
+    stats.totals.transactions += 1
+    await send_deferred(messages)
+
+
+async def _save_inbound_message(session: AsyncSession) -> None:
+    """Save the ID of the message being handled together with the changes it made."""
+    msg_id = inbound_message_id.get()
+    if msg_id is not None:
+        stmt = insert(InboundMessage).prefix_with("OR IGNORE")
+        await session.execute(stmt.values(id=msg_id, received_at=int(time.time())))
+
+
+async def _commit_restored(session: AsyncSession) -> None:
+    """Commit players restored from the archive by read-only sessions."""
+    if session.info.get("restored") and session.in_transaction():
+        await session.commit()
+
+
+def _create_missing_tables(conn) -> None:
+    """Like Base.metadata.create_all() but checking all the tables with a single query."""
+    query = "SELECT name FROM sqlite_master WHERE type='table'"
+    existing = set(conn.exec_driver_sql(query).scalars())
+    if not existing:  # new database, must be set before creating tables
+        conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+    missing = [
+        table for table in Base.metadata.sorted_tables if table.name not in existing
+    ]
+    if missing:
+        Base.metadata.create_all(conn, tables=missing, checkfirst=False)
 
 
 async def init_db_engine(bot: Bot, path: str, debug: bool = False) -> None:
     """Initialize engine."""
-    global _session, _bot, _lock  # noqa
+    global _session, _engine, _bot, _lock  # noqa
     engine = create_async_engine(path, echo=debug)
+    if _batch_window:
+        _enable_savepoints(engine.sync_engine)
+    if stats.is_enabled():
+        stats.watch_engine(engine.sync_engine)
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)  # noqa
+        await conn.run_sync(_create_missing_tables)
 
-    _session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    session_class = _BatchSession if _batch_window else AsyncSession
+    _session = sessionmaker(engine, expire_on_commit=False, class_=session_class)
+    _engine = engine
     _bot = bot
     _lock = asyncio.Lock()
 
 
 async def fetchone(session: sessionmaker, stmt: Select) -> Any:
     return (await session.execute(stmt.limit(1))).scalars().first()
+
+
+async def fetchone_unlocked(stmt: Select) -> Any:
+    """Run a read-only query in its own connection without taking the game lock."""
+    async with _engine.connect() as conn:
+        return (await conn.execute(stmt.limit(1))).scalars().first()
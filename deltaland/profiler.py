@@ -0,0 +1,180 @@
+"""On-demand profiling of the running bot"""
+import asyncio
+import cProfile
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Callable, Dict, Optional, Tuple
+
+from .util import run_in_background
+
+PROFILE_DURATION = 30
+MAX_PROFILE_DURATION = 60 * 5
+SAMPLING_INTERVAL = 0.005
+
+_hooks: Dict[CodeType, str] = {}
+# bound methods share the code object, they are told apart by their instance
+_methods: Dict[Tuple[CodeType, int], str] = {}
+_output_dir = ""
+_running = False
+
+
+def init(output_dir: str) -> None:
+    """Set the folder where profiles are saved and start profiling on SIGUSR1."""
+    global _output_dir  # noqa
+    _output_dir = output_dir
+    if not hasattr(signal, "SIGUSR1"):
+        return
+
+    def _on_signal() -> None:
+        if _running:
+            logging.warning("A profiling session is already running")
+        else:
+            run_in_background(_profile_and_log(PROFILE_DURATION))
+
+    try:
+        asyncio.get_event_loop().add_signal_handler(signal.SIGUSR1, _on_signal)
+    except (NotImplementedError, RuntimeError) as ex:
+        logging.debug("Profiling signal handler not installed: %s", ex)
+
+
+def register_hook(name: str, func: Callable) -> None:
+    """Register a hook so that samples taken while it runs are tagged with its name."""
+    instance = getattr(func, "__self__", None)
+    if instance is None:
+        _hooks[func.__code__] = name
+    else:
+        _methods[(func.__func__.__code__, id(instance))] = name  # type: ignore
+        _hooks[func.__func__.__code__] = ""  # type: ignore
+
+
+def _get_hook(frame: FrameType) -> Optional[str]:
+    """Get the name of the hook executing in the given frame."""
+    name = _hooks.get(frame.f_code)
+    if name == "":
+        return _methods.get((frame.f_code, id(frame.f_locals.get("self"))))
+    return name
+
+
+def find_hook(frame: Optional[FrameType]) -> Optional[str]:
+    """Get the name of the outermost registered hook in the given call stack."""
+    hook = None
+    while frame:
+        hook = _get_hook(frame) or hook
+        frame = frame.f_back
+    return hook
+
+
+def is_running() -> bool:
+    return _running
+
+
+class _Sampler(threading.Thread):
+    """Thread sampling the call stack of another thread at regular intervals."""
+
+    def __init__(
+        self, loop: asyncio.AbstractEventLoop, thread_id: int, interval: float
+    ) -> None:
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.loop = loop
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)  # noqa
+            if frame:
+                task = asyncio.current_task(self.loop)
+                self.stacks[_collapse_stack(frame, task)] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+def _collapse_stack(frame: Optional[FrameType], task: Optional[asyncio.Task]) -> str:
+    names = []
+    hook = None
+    while frame:
+        code = frame.f_code
+        names.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        )
+        hook = _get_hook(frame) or hook  # the outermost hook wins
+        frame = frame.f_back
+    if not hook and task:
+        # code running in a different call stack on behalf of the task, ex. greenlets
+        hook = _get_task_hook(task) or "other"
+    names.append(f"[{hook or 'idle'}]")
+    return ";".join(reversed(names))
+
+
+def _get_task_hook(task: asyncio.Task) -> Optional[str]:
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None)
+        hook = frame and _get_hook(frame)
+        if hook:
+            return hook
+        coro = getattr(coro, "cr_await", None)
+    return None
+
+
+async def profile(
+    duration: int = PROFILE_DURATION, interval: float = SAMPLING_INTERVAL
+) -> Tuple[str, str]:
+    """Profile the running event loop for the given number of seconds.
+
+    Return the paths of the resulting pstats and collapsed-stack files.
+    """
+    global _running  # noqa
+    if _running:
+        raise RuntimeError("A profiling session is already running")
+    _running = True
+    try:
+        duration = max(1, min(duration, MAX_PROFILE_DURATION))
+        profiler = cProfile.Profile()
+        sampler = _Sampler(asyncio.get_event_loop(), threading.get_ident(), interval)
+        sampler.start()
+        profiler.enable()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            profiler.disable()
+            sampler.stop()
+
+        prefix = os.path.join(
+            _output_dir, time.strftime("profile-%Y%m%d-%H%M%S", time.localtime())
+        )
+        pstats_path = f"{prefix}.pstats"
+        collapsed_path = f"{prefix}.collapsed"
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, profiler.dump_stats, pstats_path)
+        await loop.run_in_executor(
+            None, _write_collapsed, collapsed_path, sampler.stacks
+        )
+        return pstats_path, collapsed_path
+    finally:
+        _running = False
+
+
+def _write_collapsed(path: str, stacks: Counter) -> None:
+    with open(path, "w", encoding="utf-8") as file:
+        for stack, count in stacks.most_common():
+            file.write(f"{stack} {count}\n")
+
+
+async def _profile_and_log(duration: int) -> None:
+    logging.info("Profiling the bot for %ss", duration)
+    try:
+        pstats_path, collapsed_path = await profile(duration)
+        logging.info("Profile saved to: %s, %s", pstats_path, collapsed_path)
+    except Exception as ex:
+        logging.exception(ex)
@@ -1,17 +1,47 @@
 """Game quests"""
 # pylama:ignore=C0103
+import json
+import os
 import random
-from dataclasses import dataclass
-from typing import List, Optional
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple, Type
 
 from deltabot_cli import AttrDict
 from sqlalchemy import func
-from sqlalchemy.orm import selectinload
 
-from .consts import Quality, StateEnum
-from .orm import Player, async_session, fetchone
+from .consts import StateEnum
+from .formulas import THIEVE_EXP, Reward
+from .ledger import add_gold
+from .orm import Player, fetchone, transaction, update_players
 from .util import calculate_thieve_gold, human_time_duration
 
+QUESTS_PATH = os.path.join(os.path.dirname(__file__), "data", "quests.json")
+
+
+class AliasTable:
+    """Sample weighted random indexes in constant time with Vose's alias method."""
+
+    def __init__(self, weights: Sequence[float]) -> None:
+        count = len(weights)
+        total = sum(weights)
+        if not count or total <= 0:
+            raise ValueError("At least one positive weight is required")
+        scaled = [weight * count / total for weight in weights]
+        self.prob = [1.0] * count
+        self.alias = list(range(count))
+        small = [i for i, value in enumerate(scaled) if value < 1]
+        large = [i for i, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+
+    def sample(self) -> int:
+        index = random.randrange(len(self.prob))
+        return index if random.random() < self.prob[index] else self.alias[index]
+
 
 class QuestResult:
     def __init__(
@@ -40,11 +70,9 @@ class Quest:
 
     async def command(self, event: AttrDict) -> None:
         """Command to start the quest"""
-        async with async_session() as session:
-            async with session.begin():
-                player = await Player.from_message(
-                    event.message_snapshot, session, [selectinload(Player.cooldowns)]
-                )
+        async for attempt in transaction():
+            async with attempt as session:
+                player = await Player.from_message(event.message_snapshot, session)
                 if (
                     not player
                     or not await player.validate_level(self.required_level)
@@ -62,26 +90,33 @@ class Quest:
 
     async def end(self, player: "Player", session) -> None:  # noqa
         """End the quest."""
-        result = self.get_result(player)
-
-        text = f"{result.description}\n\n"
-        if result.exp:
-            text += f"🔥Exp: {result.exp:+}\n"
-            if player.increase_exp(result.exp):  # level up
-                await player.notify_level_up()
-        if result.gold:
-            text += f"💰Gold: {result.gold:+}\n"
-            player.gold += result.gold
-        if result.hp:
-            if result.hp < 0:
-                result.hp = -player.reduce_hp(-result.hp)
-            else:
-                player.hp = min(player.hp + result.hp, player.max_hp)
+        await self.end_all([player], session)
+
+    async def end_all(self, players: List["Player"], session) -> None:  # noqa
+        """End the quest of the given players, saving them with a single update."""
+        gold: Dict[int, int] = {}
+        for player in players:
+            result = self.get_result(player)
+
+            text = f"{result.description}\n\n"
+            if result.exp:
+                text += f"🔥Exp: {result.exp:+}\n"
+                if player.increase_exp(result.exp):  # level up
+                    await player.notify_level_up()
+            if result.gold:
+                text += f"💰Gold: {result.gold:+}\n"
+                gold[player.id] = result.gold
             if result.hp:
-                text += f"❤️HP: {result.hp:+}\n"
+                if result.hp < 0:
+                    result.hp = -player.reduce_hp(-result.hp)
+                else:
+                    player.hp = min(player.hp + result.hp, player.max_hp)
+                if result.hp:
+                    text += f"❤️HP: {result.hp:+}\n"
 
-        player.state = StateEnum.REST
-        await player.send_message(text=text)
+            player.state = StateEnum.REST
+            await player.send_message(text=text)
+        await update_players(session, players, gold)
 
     def get_result(self, player: "Player") -> QuestResult:  # noqa
         """End the quest."""
@@ -89,24 +124,17 @@ class Quest:
 
 
 class ThieveQuest(Quest):
-    def __init__(self) -> None:
-        super().__init__(
-            id=2,
-            command_name="/thieve",
-            name="🗡️Thieve",
-            description="Thieving is a dangerous activity. Someone can notice you and beat you up. But if you go unnoticed, you will acquire a lot of loot.",
-            status_msg="🗡️ Thieving in the town",
-            parting_msg='This is not a fair world so you decide to take "what you deserve" with your own hands',
-            stamina_cost=2,
-            duration=60 * 2,
-            required_level=3,
-        )
+    """Quest where other players can notice and stop the thief."""
+
+    async def end_all(self, players: List["Player"], session) -> None:
+        # each thief looks for a sentinel among the players still resting
+        for player in players:
+            await self.end(player, session)
 
     async def end(self, player: "Player", session) -> None:
         thief = player
         stmt = (
             Player.get_all_active()
-            .options(selectinload(Player.cooldowns))
             .filter_by(state=StateEnum.REST)
             .order_by(func.random())
         )
@@ -125,8 +153,8 @@ class ThieveQuest(Quest):
         else:
             thief.state = StateEnum.REST
             gold = calculate_thieve_gold(thief.level)
-            thief.gold += gold
-            exp = random.randint(1, 3)
+            await add_gold(session, thief.id, gold)
+            exp = random.randint(*THIEVE_EXP)
             if thief.increase_exp(exp):  # level up
                 await thief.notify_level_up()
             text = (
@@ -137,108 +165,83 @@ class ThieveQuest(Quest):
             await thief.send_message(text=text)
 
 
-class TownQuest(Quest):
-    def __init__(self) -> None:
-        super().__init__(
-            id=1,
-            command_name="/wander",
-            name="👣Wander around the town",
-            description="You decide to wander around the town in the hope that something interesting will happen",
-            status_msg="👣 Wandering around the town",
-            parting_msg="You start to wander around the town",
-            stamina_cost=1,
-            duration=60 * 3,
-            required_level=0,
-        )
+class QuestOutcome:
+    def __init__(self, description: str, reward: Reward) -> None:
+        self.description = description
+        self.reward = reward
+
+
+@dataclass(eq=False)
+class OutcomeQuest(Quest):
+    """Quest resolved by picking a random outcome of its outcome table."""
+
+    outcomes: List[QuestOutcome] = field(default_factory=list)
+    weights: List[float] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        self._table = AliasTable(self.weights)
 
     def get_result(self, player: "Player") -> QuestResult:  # noqa
-        quality = random.choices(
-            (Quality.BAD, Quality.NORMAL, Quality.GOOD), weights=(10, 80, 10)
-        )[0]
-        if quality == Quality.NORMAL:
-            return self.get_normal_result()
-        if quality == Quality.GOOD:
-            return self.get_good_result()
-        return self.get_bad_result()
-
-    def get_bad_result(self) -> QuestResult:
-        descriptions = [
-            "You helped a blacksmith with the chores. One of your fingers got hurt with a hammer",  # must be first item
-            "You stepped on a pile of poop, lucky day :/",
-            "You came back empty handed and bored",
-            "A wagon passed near you and splashed water from a puddle, your clothes are wet and stinky",
-            "You wandered around for a while but nothing interesting happened",
-            'As you were strolling in the town you accidentally stepped on a puddle of dirty and stinky "water"',
-        ]
-        desc = random.choice(descriptions)
-        if desc == descriptions[0]:  # hurt
-            return QuestResult(
-                description=desc,
-                gold=random.randint(1, 2),
-                exp=random.randint(1, 2),
-                hp=-random.randint(5, 10),
-            )
-        return QuestResult(description=desc)
-
-    def get_normal_result(self) -> QuestResult:
-        descriptions = [
-            "You were walking around when you noticed a gold coin on the floor!",  # must be first item
-            "You helped some kids to find their pet, they were a bit confused when you asked for your bounty",
-            "You helped a peasant with the crops. It was hard work but you feel pleased about helping people... and charging for it.",
-            "A merchant asked for your help to transport some of his cargo to the main plaza, you helped him and received a reward",
-            "In a dark alley you saw a thief threatening an old man, you helped him and shared the loot",
-            'You saw some rats in an alley, you killed them and sold their pelt as "rabbit pelt" to a local merchant',
-            "You ran some errands for a butcher, he paid you with a piece of bacon, you sold it to a fat guy for some gold",
-            "You helped a peasant to fix his wagon loaded with fruit that had a broken wheel. He gave you some fruits, you sold them in the local market",
-            "You helped a magician to gather some rats for his experiments",
-            "As you were strolling you collided with a stranger who turned out to be a thief running from the guards, you received a reward for (accidentally) stopping the thief",
-            "As you were strolling you came across a nobleman who asked you to run some errands",
-            "In an alley someone tried to rob you, but you rob him instead",
-            "You helped an artisan with his work",
-            "An old retired knight asked you to run some errands",
-            "A knight paid you to bathe and feed his horse",
-            "You helped transporting weapons to the armory",
-            "You worked as a helper in the inn's kitchen",
-            "You found a job cleaning the royal stables",
-            "As you wandered around, you saw a nobleman in a horse-drawn carriage, one of the carriage's wheels was broken. You helped repair the carriage and received some gold coins",
-            "A peddler weighed down with basic supplies asked for your help to transport the supplies to the market",
+        outcome = self.outcomes[self._table.sample()]
+        gold, exp, hp = outcome.reward.roll()
+        return QuestResult(outcome.description, gold=gold, exp=exp, hp=hp)
+
+    def get_outcomes(self) -> List[Tuple[float, Reward]]:
+        """Get the probability of each outcome reward, used by the simulator."""
+        total = sum(self.weights)
+        return [
+            (weight / total, outcome.reward)
+            for weight, outcome in zip(self.weights, self.outcomes)
         ]
-        desc = random.choice(descriptions)
-        if desc == descriptions[0]:  # one coin
-            return QuestResult(description=desc, gold=1, exp=random.randint(1, 2))
-        return QuestResult(
-            description=desc,
-            gold=random.randint(1, 2),
-            exp=random.randint(1, 2),
-        )
 
-    def get_good_result(self) -> QuestResult:
-        descriptions = [
-            "You gave a hand cleaning the inn. They allowed you to take a snap in one of their comfortable beds",  # must be first item
-            "As you were walking in the crowded market you saw some gold coins falling from the pocket of a beautiful lady, you politely picked the coins and disappeared in the crowd",
-            'A man wearing elegant clothes asked you to deliver a golden small box to a distant village to someone called "Thaernd Orarani", you accepted the quest, after pretending to part away you sold the loot to a local merchant',
-            'A magician asked for your assistance to organize his "library", a room full of old spell books laying all over the floor. After finishing, you politely refused to receive any payment and went away... to sell a grimoire you found in your pocket',
-            "Wandering around you accidentally kicked an old pot near other trash, the pot broke and inside you found some gold coins! Later you came back the same way and saw a beggar screaming over the pieces of a broken pot, weird",
-            "You came across a magician asking for help to brew a potion. You helped him to brew the potion, then he drunk it and became a talking frog, you sold the frog to a local pet shop",
-        ]
-        desc = random.choice(descriptions)
-        if desc == descriptions[0]:  # heal
-            return QuestResult(
-                description=desc,
-                gold=random.randint(2, 3),
-                exp=random.randint(2, 3),
-                hp=random.randint(5, 10),
+
+# quest types of the data files
+quest_types: Dict[str, Type[Quest]] = {
+    "outcomes": OutcomeQuest,
+    "thieve": ThieveQuest,
+}
+
+
+def _parse_quest(data: dict) -> Quest:
+    data = dict(data)
+    quest_type = quest_types[data.pop("type")]
+    data["command_name"] = data.pop("command")
+    if quest_type is OutcomeQuest:
+        outcomes, weights = [], []
+        for group in data.pop("outcomes"):
+            reward = Reward(
+                gold=tuple(group.get("gold", (0, 0))),  # type: ignore
+                exp=tuple(group.get("exp", (0, 0))),  # type: ignore
+                hp=tuple(group.get("hp", (0, 0))),  # type: ignore
             )
-        return QuestResult(
-            description=desc,
-            gold=random.randint(3, 4),
-            exp=random.randint(2, 3),
-        )
+            for description in group["descriptions"]:
+                outcomes.append(QuestOutcome(description, reward))
+                weights.append(group["weight"])
+        data.update(outcomes=outcomes, weights=weights)
+    return quest_type(**data)
+
+
+def load_quests(path: str = QUESTS_PATH) -> Dict[int, Quest]:
+    """Load the quests of the given JSON file, keyed by quest id.
+
+    Each entry of an outcome table has a weight, a list of descriptions and the
+    gold/exp/hp reward ranges, the weight applies to each of the descriptions.
+    """
+    with open(path, encoding="utf-8") as file:
+        data = json.load(file)
+    registry: Dict[int, Quest] = {}
+    for entry in data["quests"]:
+        quest = _parse_quest(entry)
+        if quest.id <= 0:
+            raise ValueError(f"Invalid quest id {quest.id}, ids must be positive")
+        if quest.id in registry:
+            raise ValueError(f"Duplicated quest id: {quest.id}")
+        registry[quest.id] = quest
+    return registry
 
 
 def get_quest(quest_id: int) -> Optional[Quest]:
-    index = quest_id - 1
-    return quests[index] if 0 <= index < len(quests) else None
+    return quests.get(quest_id)
 
 
-quests: List[Quest] = [TownQuest(), ThieveQuest()]
+quests = load_quests()
@@ -0,0 +1,359 @@
+"""Performance statistics"""
+# pylama:ignore=W0603
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Deque, Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .consts import SCHEDULER_ALERT_INTERVAL, SCHEDULER_LAG_ALERT, SCHEDULER_PASS_ALERT
+
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+WINDOW_SIZE = 1000
+
+_enabled = False
+_current: ContextVar[Optional["Sample"]] = ContextVar("sample", default=None)
+
+
+class Histogram:
+    """Histogram with fixed buckets plus a rolling window of the most recent samples."""
+
+    def __init__(
+        self, buckets: Sequence[float] = TIME_BUCKETS, window: int = WINDOW_SIZE
+    ) -> None:
+        self.bucket_bounds: Tuple[float, ...] = tuple(buckets)
+        self.buckets = [0] * (len(self.bucket_bounds) + 1)  # last one is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(self.bucket_bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.recent.append(value)
+
+    def percentile(self, percent: float) -> float:
+        """Nearest-rank percentile of the recent samples."""
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        index = round(percent / 100 * len(values)) - 1
+        return values[max(0, min(len(values) - 1, index))]
+
+    def mean(self) -> float:
+        """Mean of the recent samples."""
+        return sum(self.recent) / len(self.recent) if self.recent else 0.0
+
+
+class Sample:
+    """Resources used by a single hook execution."""
+
+    def __init__(self) -> None:
+        self.lock_wait = 0.0
+        self.queries = 0
+        self.messages = 0
+
+
+class HookStats:
+    def __init__(self) -> None:
+        self.wall_time = Histogram()
+        self.lock_wait = Histogram()
+        self.queries = Histogram(COUNT_BUCKETS)
+        self.messages = Histogram(COUNT_BUCKETS)
+        self.errors = 0
+
+    def record(self, elapsed: float, sample: Sample) -> None:
+        self.wall_time.observe(elapsed)
+        self.lock_wait.observe(sample.lock_wait)
+        self.queries.observe(sample.queries)
+        self.messages.observe(sample.messages)
+
+
+class Counters:
+    def __init__(self) -> None:
+        self.queries = 0
+        self.messages = 0
+        self.sessions = 0
+        self.outbox = 0  # messages being sent right now
+        self.transactions = 0  # committed by orm.transaction()
+        self.conflicts = 0  # concurrent changes detected by orm.transaction()
+        self.duplicates = 0  # incoming messages ignored by inbound.py
+
+
+class SchedulerBatch:
+    """Cooldowns of the same kind processed in a single scheduler pass."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.max_lag = 0.0
+        self.elapsed = 0.0
+
+    def add(self, lag: float, elapsed: float) -> None:
+        self.count += 1
+        self.max_lag = max(self.max_lag, lag)
+        self.elapsed += elapsed
+
+
+class SchedulerStats:
+    def __init__(self) -> None:
+        self.lag = Histogram()
+        self.batch_size = Histogram(COUNT_BUCKETS)
+        self.processing_time = Histogram()
+        self.processed = 0
+        self.last_lag = 0.0
+
+
+class WorldEvent:
+    def __init__(
+        self, kind: str, scheduled_at: float, elapsed: float, players: int
+    ) -> None:
+        self.kind = kind
+        self.scheduled_at = scheduled_at
+        self.elapsed = elapsed
+        self.players = players
+
+    def __str__(self) -> str:
+        date = datetime.fromtimestamp(self.scheduled_at).strftime("%Y-%m-%d %H:%M")
+        return f"{self.kind} at {date} took {self.elapsed:.1f}s for {self.players:,} players"
+
+
+hooks: Dict[str, HookStats] = {}
+lock_wait = Histogram()
+lock_hold = Histogram()
+totals = Counters()
+scheduler: Dict[str, SchedulerStats] = {}
+scheduler_pass = Histogram()
+world_events: Deque[WorldEvent] = deque(maxlen=20)
+write_batch = Histogram(COUNT_BUCKETS)  # sessions committed together
+write_batch_commit = Histogram()
+gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+_last_alerts: Dict[str, float] = {}
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def register_gauge(name: str, description: str, func: Callable[[], float]) -> None:
+    """Register a function returning the current value of a metric to export."""
+    gauges[name] = (description, func)
+
+
+def get_hook_name(hook: Callable, event_filter) -> str:
+    return getattr(event_filter, "command", None) or hook.__name__
+
+
+def instrument(name: str, hook: Callable) -> Callable:
+    """Wrap an async hook to record its statistics under the given name."""
+
+    @functools.wraps(hook)
+    async def wrapper(*args, **kwargs):
+        sample = Sample()
+        token = _current.set(sample)
+        start = time.perf_counter()
+        hook_stats = hooks.get(name)
+        if not hook_stats:
+            hook_stats = hooks[name] = HookStats()
+        try:
+            return await hook(*args, **kwargs)
+        except Exception:
+            hook_stats.errors += 1
+            raise
+        finally:
+            _current.reset(token)
+            hook_stats.record(time.perf_counter() - start, sample)
+
+    return wrapper
+
+
+def watch_engine(engine: Engine) -> None:
+    """Count the SQL statements executed by the given engine."""
+    event.listen(engine, "before_cursor_execute", _on_query)
+
+
+def _on_query(*_args) -> None:
+    totals.queries += 1
+    sample = _current.get()
+    if sample:
+        sample.queries += 1
+
+
+def record_message() -> None:
+    if not _enabled:
+        return
+    totals.messages += 1
+    sample = _current.get()
+    if sample:
+        sample.messages += 1
+
+
+def record_lock(wait: float, hold: float) -> None:
+    totals.sessions += 1
+    lock_wait.observe(wait)
+    lock_hold.observe(hold)
+    sample = _current.get()
+    if sample:
+        sample.lock_wait += wait
+
+
+def record_scheduler_pass(batches: Dict[str, SchedulerBatch], elapsed: float) -> None:
+    """Record the cooldowns processed in a scheduler pass, log alerts if lagging."""
+    scheduler_pass.observe(elapsed)
+    if elapsed > SCHEDULER_PASS_ALERT:
+        _alert(
+            "pass",
+            "Scheduler pass took %.1fs for %s cooldowns",
+            elapsed,
+            sum(batch.count for batch in batches.values()),
+        )
+    for kind, batch in batches.items():
+        kind_stats = scheduler.get(kind)
+        if not kind_stats:
+            kind_stats = scheduler[kind] = SchedulerStats()
+        kind_stats.lag.observe(batch.max_lag)
+        kind_stats.batch_size.observe(batch.count)
+        kind_stats.processing_time.observe(batch.elapsed)
+        kind_stats.processed += batch.count
+        kind_stats.last_lag = batch.max_lag
+        if batch.max_lag > SCHEDULER_LAG_ALERT:
+            _alert(
+                kind,
+                "Scheduler is lagging: %s %r cooldowns processed up to %.0fs late",
+                batch.count,
+                kind,
+                batch.max_lag,
+            )
+
+
+def record_world_event(
+    kind: str, scheduled_at: float, elapsed: float, players: int
+) -> None:
+    world_event = WorldEvent(kind, scheduled_at, elapsed, players)
+    world_events.append(world_event)
+    logging.info("World event: %s", world_event)
+
+
+def record_write_batch(size: int, elapsed: float) -> None:
+    write_batch.observe(size)
+    write_batch_commit.observe(elapsed)
+
+
+def get_conflict_rate() -> float:
+    """Get the fraction of transaction attempts that failed due to concurrent changes."""
+    attempts = totals.transactions + totals.conflicts
+    return totals.conflicts / attempts if attempts else 0.0
+
+
+def _alert(key: str, msg: str, *args) -> None:
+    """Log a warning, at most once every SCHEDULER_ALERT_INTERVAL seconds per key."""
+    now = time.monotonic()
+    last_alert = _last_alerts.get(key)
+    if last_alert is None or now - last_alert >= SCHEDULER_ALERT_INTERVAL:
+        _last_alerts[key] = now
+        logging.warning(msg, *args)
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.0f}"
+
+
+def get_report() -> str:
+    """Return a human readable report of the recent statistics."""
+    lines = [
+        "**📈 Statistics**",
+        "",
+        f"Sessions: {totals.sessions}  Queries: {totals.queries}  Messages: {totals.messages}",
+        f"Transactions: {totals.transactions}  Conflicts: {totals.conflicts} ({get_conflict_rate():.1%})"
+        f"  Duplicates: {totals.duplicates}",
+        f"🔒 Lock wait p50/p95/p99: {_ms(lock_wait.percentile(50))}/{_ms(lock_wait.percentile(95))}/{_ms(lock_wait.percentile(99))}ms",
+        f"🔒 Lock hold p50/p95/p99: {_ms(lock_hold.percentile(50))}/{_ms(lock_hold.percentile(95))}/{_ms(lock_hold.percentile(99))}ms",
+        "",
+        "command: count | p50/p95/p99 ms | lock wait p95 ms | queries | msgs",
+    ]
+    for name, hook_stats in sorted(
+        hooks.items(), key=lambda item: item[1].wall_time.count, reverse=True
+    ):
+        wall = hook_stats.wall_time
+        errors = f" ⚠️{hook_stats.errors}" if hook_stats.errors else ""
+        lines.append(
+            f"{name}: {wall.count}{errors}"
+            f" | {_ms(wall.percentile(50))}/{_ms(wall.percentile(95))}/{_ms(wall.percentile(99))}"
+            f" | {_ms(hook_stats.lock_wait.percentile(95))}"
+            f" | {hook_stats.queries.mean():.1f}"
+            f" | {hook_stats.messages.mean():.1f}"
+        )
+    if write_batch.count:
+        lines += [
+            "",
+            f"💾 Write batches: {write_batch.count}"
+            f"  sessions p50/p95: {write_batch.percentile(50):.0f}/{write_batch.percentile(95):.0f}"
+            f"  commit p95: {_ms(write_batch_commit.percentile(95))}ms",
+        ]
+    if scheduler:
+        lines += [
+            "",
+            f"**⏰ Scheduler** (pass p95: {_ms(scheduler_pass.percentile(95))}ms)",
+            "kind: processed | last lag s | lag p95 s | batch p95 | time p95 ms",
+        ]
+        for kind, kind_stats in sorted(scheduler.items()):
+            lines.append(
+                f"{kind}: {kind_stats.processed}"
+                f" | {kind_stats.last_lag:.0f}"
+                f" | {kind_stats.lag.percentile(95):.0f}"
+                f" | {kind_stats.batch_size.percentile(95):.0f}"
+                f" | {_ms(kind_stats.processing_time.percentile(95))}"
+            )
+    if world_events:
+        lines += ["", "**🌍 World events**"]
+        lines.extend(str(world_event) for world_event in world_events)
+    return "\n".join(lines)
+
+
+async def log_loop(interval: int) -> None:
+    """Periodically log a summary of the statistics."""
+    last_count, last_queries, last_messages = 0, 0, 0
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            count = sum(hook_stats.wall_time.count for hook_stats in hooks.values())
+            slowest = max(
+                hooks.items(),
+                key=lambda item: item[1].wall_time.percentile(95),
+                default=None,
+            )
+            slowest_text = (
+                f"{slowest[0]} {_ms(slowest[1].wall_time.percentile(95))}ms"
+                if slowest
+                else "-"
+            )
+            logging.info(
+                "Stats: %s hooks, %s queries, %s messages in the last %ss;"
+                " lock wait p95: %sms; slowest hook p95: %s",
+                count - last_count,
+                totals.queries - last_queries,
+                totals.messages - last_messages,
+                interval,
+                _ms(lock_wait.percentile(95)),
+                slowest_text,
+            )
+            last_count, last_queries, last_messages = (
+                count,
+                totals.queries,
+                totals.messages,
+            )
+        except Exception as ex:
+            logging.exception(ex)
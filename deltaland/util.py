@@ -4,11 +4,17 @@ import logging
 import os
 import random
 import string
-from typing import Coroutine, Union
+from contextvars import ContextVar
+from typing import Any, Coroutine, Dict, List, Optional, Set, Tuple, Union
 
 from deltabot_cli import Account, Contact
 from deltachat_rpc_client.rpc import JsonRpcError
 
+from . import stats
+from .consts import MessageLane
+from .delivery import current_lane, scheduler
+from .formulas import interfere_gold_range, thieve_gold_range
+
 _scope = __name__.split(".", maxsplit=1)[0]
 _images_dir = os.path.join(os.path.dirname(__file__), "images")
 _TIME_DURATION_UNITS = (
@@ -19,6 +25,14 @@ _TIME_DURATION_UNITS = (
     ("sec", 1),
 )
 _background_tasks = set()
+# if set, messages are appended here instead of being sent, see orm.async_session()
+deferred_messages: ContextVar[
+    Optional[List[Tuple[Any, dict, MessageLane]]]
+] = ContextVar("deferred_messages", default=None)
+# ID of the incoming message being handled, see inbound.py
+inbound_message_id: ContextVar[Optional[int]] = ContextVar(
+    "inbound_message_id", default=None
+)
 
 
 def run_in_background(coro: Coroutine) -> None:
@@ -40,14 +54,85 @@ def is_valid_name(name: str) -> bool:
 
 
 async def send_message(
-    contact: Union[int, Contact], account: Account = None, **kwargs
+    contact: Union[int, Contact],
+    account: Account = None,
+    lane: Optional[MessageLane] = None,
+    **kwargs,
 ) -> None:
+    """Send a message through the given delivery lane, by default the lane of the task."""
     if isinstance(contact, int):
         contact = account.get_contact_by_id(contact)
-    try:
-        await (await contact.create_chat()).send_message(**kwargs)
-    except JsonRpcError as err:
-        logging.exception(err)
+    if lane is None:
+        lane = current_lane.get()
+    deferred = deferred_messages.get()
+    if deferred is not None:
+        deferred.append((contact, kwargs, lane))
+        return
+    async with scheduler.slot(lane):
+        stats.record_message()
+        stats.totals.outbox += 1
+        try:
+            await (await contact.create_chat()).send_message(**kwargs)
+        except JsonRpcError as err:
+            logging.exception(err)
+        finally:
+            stats.totals.outbox -= 1
+
+
+def coalesce_messages(
+    messages: List[Tuple[Any, dict, MessageLane]]
+) -> List[Tuple[Any, dict, MessageLane]]:
+    """Merge the messages to the same contact into as few messages as possible.
+
+    The texts are joined in order. A message can only have one attachment, so an
+    attachment different from the one of the message being merged starts a new
+    message, repeated attachments are dropped. Messages with other options, like
+    quoted_msg, are not merged. Merged messages use the most urgent of their lanes.
+    """
+    merged: List[list] = []
+    current: Dict[int, list] = {}  # contact ID -> last message being merged
+    files: Dict[int, Set[str]] = {}  # contact ID -> attachments already added
+    for contact, kwargs, lane in messages:
+        if set(kwargs) - {"text", "file"}:
+            merged.append([contact, kwargs, lane])
+            continue
+        text, file = kwargs.get("text"), kwargs.get("file")
+        contact_files = files.setdefault(contact.id, set())
+        if file in contact_files:
+            file = None
+        if not text and not file:
+            continue
+        entry = current.get(contact.id)
+        if entry is None or (file and entry[1].get("file")):
+            entry = current[contact.id] = [contact, {}, lane]
+            merged.append(entry)
+        msg = entry[1]
+        entry[2] = min(entry[2], lane)
+        if file:
+            msg["file"] = file
+            contact_files.add(file)
+        if text:
+            msg["text"] = (
+                f"{msg['text'].rstrip()}\n\n{text}" if msg.get("text") else text
+            )
+    return [(contact, kwargs, lane) for contact, kwargs, lane in merged]
+
+
+async def send_deferred(messages: List[Tuple[Any, dict, MessageLane]]) -> None:
+    """Send the messages deferred by a transaction, merged per contact.
+
+    The messages of different contacts are sent concurrently, limited by the
+    delivery lanes, the messages to the same contact are sent in order.
+    """
+    by_contact: Dict[int, list] = {}
+    for contact, kwargs, lane in coalesce_messages(messages):
+        by_contact.setdefault(contact.id, []).append((contact, kwargs, lane))
+    await asyncio.gather(*(_send_all(queue) for queue in by_contact.values()))
+
+
+async def _send_all(messages: List[Tuple[Any, dict, MessageLane]]) -> None:
+    for contact, kwargs, lane in messages:
+        await send_message(contact, lane=lane, **kwargs)
 
 
 def human_time_duration(seconds: int, rounded: bool = True) -> str:
@@ -83,10 +168,8 @@ def render_stats(atk: int, max_atk: int, def_: int, max_def: int) -> str:
 
 
 def calculate_thieve_gold(level: int) -> int:
-    min_gold = min(max(level, 10), 20)
-    return random.randint(min_gold, min(min_gold * 3, 40))
+    return random.randint(*thieve_gold_range(level))
 
 
 def calculate_interfere_gold(level: int) -> int:
-    min_gold = min(max(level, 5), 10)
-    return random.randint(min_gold, min_gold * 2)
+    return random.randint(*interfere_gold_range(level))
@@ -1,14 +1,53 @@
+import asyncio
+import sqlite3
+import time
 from argparse import Namespace
 from unittest.mock import MagicMock
 
 import pytest
-from deltabot_cli import EventType, const
+from deltabot_cli import AttrDict, EventType, const
+from sqlalchemy import delete, event, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.future import select
 
+from benchmarks.fakebot import join_players, start_game
+from deltaland import backup, dump, inbound, maintenance
+from deltaland.consts import (
+    LANE_CONCURRENCY,
+    LANE_WEIGHTS,
+    WORLD_ID,
+    MessageLane,
+    StateEnum,
+)
+from deltaland.cooldown import _check_cooldowns
+from deltaland.delivery import DeliveryScheduler
 from deltaland.hooks import cli
+from deltaland.ledger import lose_gold, spend_gold
+from deltaland.orm import (
+    Cooldown,
+    DiceRank,
+    Player,
+    async_session,
+    disable_strict_loading,
+    enable_strict_loading,
+)
+from deltaland.util import coalesce_messages
 
 
 async def init_cli(bot, config_dir):
-    args = Namespace(config_dir=config_dir)
+    args = Namespace(
+        config_dir=config_dir,
+        admin=[],
+        stats=False,
+        stats_interval=0,
+        trace_lock=False,
+        write_batch_window=0,
+        write_batch_size=50,
+        background_migrations=False,
+        backup_interval=0,
+        metrics_port=0,
+        metrics_host="127.0.0.1",
+    )
     bot.add_hooks(cli._hooks)
     await cli._on_init(bot, args)
     await cli._on_start(bot, args)
@@ -46,3 +85,285 @@ async def test_filter(acfactory, tmp_path) -> None:
     msg = await get_next_message(user)
     assert NOT_JOINED not in msg.text.lower()
     assert "🏅level" not in msg.text.lower()
+
+
+@pytest.mark.asyncio
+async def test_loading_profiles(tmp_path) -> None:
+    """Commands must not lazy load relationships, see the PROFILE_* constants."""
+    enable_strict_loading()
+    try:
+        bot = await start_game(str(tmp_path))
+        player_id = (await join_players(bot, 1, level=5))[0]
+        commands = ["/me", "/inv", "/skills", "/level_up", "/battle", "/hit", "/report"]
+        commands += ["/tavern", "/cauldron", "/interfere", "/top", "/top1", "/top3"]
+        commands += ["/top4", "/top5"]
+        for command in commands:
+            assert await bot.send_text(player_id, command)
+    finally:
+        disable_strict_loading()
+
+
+@pytest.mark.asyncio
+async def test_guarded_debits(tmp_path) -> None:
+    """Gold is never taken below zero."""
+    bot = await start_game(str(tmp_path))
+    player_id = (await join_players(bot, 1))[0]
+    async with async_session() as session:
+        async with session.begin():
+            player = await session.get(Player, player_id)
+            player.gold = 3
+    async with async_session() as session:
+        async with session.begin():
+            player = await session.get(Player, player_id)
+            assert not await spend_gold(session, player_id, 5)
+            assert player.gold == 3
+            assert await spend_gold(session, player_id, 2)
+            assert player.gold == 1
+            await lose_gold(session, player_id, 5)
+            assert player.gold == 0
+    async with async_session() as session:
+        assert (await session.get(Player, player_id)).gold == 0
+
+    replies = await bot.send_text(player_id, "/dice")
+    assert "enough gold" in replies[0].text
+    async with async_session() as session:
+        player = await session.get(Player, player_id)
+        assert player.gold == 0
+        assert player.state == StateEnum.REST
+
+
+@pytest.mark.asyncio
+async def test_batched_quest_completions(tmp_path) -> None:
+    """Simultaneous quest completions are saved with a single UPDATE."""
+    bot = await start_game(str(tmp_path))
+    player_ids = await join_players(bot, 20)
+    for player_id in player_ids:
+        await bot.send_text(player_id, "/wander")
+    async with async_session() as session:
+        async with session.begin():
+            stmt = update(Player).values(state_ends_at=int(time.time()) - 1)
+            await session.execute(stmt.where(Player.id.in_(player_ids)))
+    bot.account.outbox.clear()
+
+    statements = []
+
+    def listener(_conn, _cursor, statement, *_args) -> None:
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", listener)
+    try:
+        await _check_cooldowns()
+    finally:
+        event.remove(Engine, "before_cursor_execute", listener)
+    assert len([stmt for stmt in statements if stmt.startswith("UPDATE")]) == 1
+    assert len(bot.account.outbox) == len(player_ids)
+
+    async with async_session() as session:
+        stmt = select(Player).where(Player.id.in_(player_ids))
+        for player in (await session.execute(stmt)).scalars():
+            assert player.state == StateEnum.REST
+            assert player.state_ends_at is None
+
+
+def test_coalesce_messages() -> None:
+    alice, bob = MagicMock(id=1), MagicMock(id=2)
+    broadcast, personal = MessageLane.BROADCAST, MessageLane.PERSONAL
+    messages = [
+        (alice, {"text": "report", "file": "goblin.webp"}, broadcast),
+        (bob, {"text": "hello"}, broadcast),
+        (alice, {"text": "stamina restored"}, personal),
+        (alice, {"text": "again", "file": "goblin.webp"}, broadcast),
+        (alice, {"text": "level up", "file": "level-up.webp"}, broadcast),
+        (bob, {"text": "reply", "quoted_msg": 10}, MessageLane.INTERACTIVE),
+    ]
+    text = "report\n\nstamina restored\n\nagain"
+    assert coalesce_messages(messages) == [
+        (alice, {"file": "goblin.webp", "text": text}, personal),
+        (bob, {"text": "hello"}, broadcast),
+        (alice, {"file": "level-up.webp", "text": "level up"}, broadcast),
+        (bob, {"text": "reply", "quoted_msg": 10}, MessageLane.INTERACTIVE),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_delivery_lanes() -> None:
+    """Waiting interactive messages are admitted before the broadcast ones."""
+    weights = {lane: 1 for lane in MessageLane}
+    weights[MessageLane.INTERACTIVE] = 3
+    limits = {lane: 1 for lane in MessageLane}
+    limits[MessageLane.INTERACTIVE] = 2
+    scheduler = DeliveryScheduler(2, weights, limits)
+    sent = []
+
+    async def send(lane: MessageLane, name: str) -> None:
+        async with scheduler.slot(lane):
+            await asyncio.sleep(0)
+            sent.append(name)
+
+    tasks = [send(MessageLane.BROADCAST, f"b{i}") for i in range(4)]
+    tasks += [send(MessageLane.INTERACTIVE, f"i{i}") for i in range(3)]
+    await asyncio.gather(*tasks)
+    # one broadcast at a time, the interactive lane gets 3 of each 4 free slots
+    assert sent == ["b0", "i0", "i1", "i2", "b1", "b2", "b3"]
+    assert scheduler.sending == 0
+    assert all(scheduler.queued(lane) == 0 for lane in MessageLane)
+
+
+@pytest.mark.asyncio
+async def test_delivery_cancelled_waiter() -> None:
+    """A cancelled message doesn't take the free slot from the next one."""
+    lane = MessageLane.BROADCAST
+    scheduler = DeliveryScheduler(1, LANE_WEIGHTS, LANE_CONCURRENCY)
+    sent = []
+
+    async def send(name: str) -> None:
+        async with scheduler.slot(lane):
+            sent.append(name)
+
+    async with scheduler.slot(lane):
+        cancelled = asyncio.ensure_future(send("cancelled"))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(send("waiting"))
+        await asyncio.sleep(0)
+        assert scheduler.queued(lane) == 2
+        cancelled.cancel()
+    await waiting
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    assert sent == ["waiting"]
+    assert scheduler.sending == 0
+    assert scheduler.queued(lane) == 0
+
+
+@pytest.mark.asyncio
+async def test_duplicated_messages(tmp_path) -> None:
+    """A redelivered message is ignored, even after a restart."""
+    bot = await start_game(str(tmp_path))
+    player_id = (await join_players(bot, 1))[0]
+    async with async_session() as session:
+        async with session.begin():
+            stmt = update(Player).where(Player.id == player_id).values(gold=1000)
+            await session.execute(stmt)
+
+    event = AttrDict(
+        command="/buy",
+        payload="001",
+        message_snapshot=AttrDict(
+            id=1000, text="/buy_001", sender=bot.account.get_contact_by_id(player_id)
+        ),
+    )
+    buy_cmd = bot.get_commands()["/buy"]
+    await buy_cmd(event)
+    await buy_cmd(event)
+    await inbound.init()  # simulate a restart, the handled IDs are loaded again
+    await buy_cmd(event)
+
+    async with async_session() as session:
+        stmt = select(Player.gold).where(Player.id == player_id)
+        bought = 1000 - (await session.execute(stmt)).scalar()
+    assert bought > 0
+    assert len(bot.account.outbox) == 1
+    assert bot.account.outbox[0].text.startswith("✅")
+
+    inbound._recent.clear()  # a message not in memory is handled
+    event.message_snapshot.id = 1001
+    await buy_cmd(event)
+    assert len(bot.account.outbox) == 2
+
+
+@pytest.mark.asyncio
+async def test_backup(tmp_path, monkeypatch) -> None:
+    """The backup world event saves a verified copy and keeps the most recent ones."""
+    monkeypatch.setattr(backup, "BACKUP_KEEP", 2)
+    monkeypatch.setattr(backup, "BACKUP_STEP_PAGES", 1)
+    bot = await start_game(str(tmp_path), backup_interval=1)
+    await join_players(bot, 50)
+    backup_dir = tmp_path / "backups"
+    backup_dir.mkdir()
+    for name in ("game-20000101-000000.db", "game-20000102-000000.db"):
+        (backup_dir / name).write_bytes(b"")
+
+    async with async_session() as session:
+        async with session.begin():
+            stmt = (
+                update(Cooldown)
+                .where(Cooldown.id == StateEnum.BACKUP, Cooldown.player_id == WORLD_ID)
+                .values(ends_at=0)
+            )
+            await session.execute(stmt)
+    await _check_cooldowns()
+    for _ in range(100):  # the backup runs in background
+        backups = sorted(path.name for path in backup_dir.iterdir())
+        if "game-20000101-000000.db" not in backups:
+            break
+        await asyncio.sleep(0.05)
+
+    assert len(backups) == 2
+    assert backups[0] == "game-20000102-000000.db"
+    database = sqlite3.connect(backup_dir / backups[1])
+    try:
+        count = database.execute("SELECT COUNT(*) FROM player").fetchone()[0]
+    finally:
+        database.close()
+    assert count == 51  # the players and the world
+
+
+@pytest.mark.asyncio
+async def test_maintenance(tmp_path, monkeypatch) -> None:
+    """The maintenance deletes empty ranks, analyzes the tables and frees pages."""
+    monkeypatch.setattr(maintenance, "MAINTENANCE_STEP_PAUSE", 0)
+    monkeypatch.setattr(maintenance, "MAINTENANCE_VACUUM_PAGES", 10)
+    bot = await start_game(str(tmp_path))
+    player_ids = await join_players(bot, 1000)
+    async with async_session() as session:
+        async with session.begin():
+            session.add(DiceRank(id=player_ids[0], gold=0))
+            session.add(DiceRank(id=player_ids[1], gold=-10))
+            await session.execute(delete(Player).where(Player.id > player_ids[1]))
+
+    await maintenance.run_maintenance()
+
+    async with async_session() as session:
+        ranks = (await session.execute(select(DiceRank.id))).scalars().all()
+    assert ranks == [player_ids[1]]
+    database = sqlite3.connect(tmp_path / "game.db")
+    try:
+        assert database.execute("PRAGMA freelist_count").fetchone()[0] == 0
+        assert database.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0]
+    finally:
+        database.close()
+
+
+@pytest.mark.parametrize("fmt", dump.FORMATS)
+@pytest.mark.asyncio
+async def test_export_import(tmp_path, fmt, monkeypatch) -> None:
+    """The exported players are imported back in a new database."""
+    monkeypatch.setattr(dump, "DUMP_PAGE_SIZE", 7)
+    bot = await start_game(str(tmp_path / "production"))
+    player_ids = await join_players(bot, 30)
+    async with async_session() as session:
+        async with session.begin():
+            session.add(Player(id=1000, name="Inactive", last_seen=0))
+            session.add(DiceRank(id=player_ids[0], gold=-10))
+            stmt = update(Player).where(Player.id == player_ids[1]).values(name="Ana")
+            await session.execute(stmt)
+    db_path = str(tmp_path / "production" / "game.db")
+    folder = str(tmp_path / "export")
+    counts = dump.export_state(
+        db_path, folder, fmt=fmt, active_since=int(time.time()) - 60
+    )
+    assert counts["player"] == 30
+    assert counts["dicerank"] == 1
+
+    staging = tmp_path / "staging"
+    staging.mkdir()
+    await start_game(str(staging))
+    dump.import_state(str(staging / "game.db"), folder, batch_size=4)
+    async with async_session() as session:
+        stmt = select(Player.id, Player.name).where(Player.id > WORLD_ID)
+        players = dict((await session.execute(stmt)).all())
+        rank = (await session.execute(select(DiceRank))).scalars().one()
+    assert sorted(players) == player_ids
+    assert players[player_ids[1]] == "Ana"
+    assert players[player_ids[2]] is None
+    assert (rank.id, rank.gold) == (player_ids[0], -10)
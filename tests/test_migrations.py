@@ -0,0 +1,76 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from benchmarks.fakebot import start_game
+from deltaland import migrations
+from deltaland.consts import DATABASE_VERSION
+
+
+def _create_db(path: str, rows: int) -> None:
+    database = sqlite3.connect(path)
+    database.execute(
+        "CREATE TABLE game (id INTEGER PRIMARY KEY, version INTEGER, catalog_hash TEXT)"
+    )
+    database.execute("INSERT INTO game VALUES (0, ?, NULL)", (DATABASE_VERSION,))
+    database.execute("CREATE TABLE test (id INTEGER PRIMARY KEY, value INTEGER)")
+    database.executemany(
+        "INSERT INTO test VALUES (?, NULL)", [(i,) for i in range(1, rows + 1)]
+    )
+    database.commit()
+    database.close()
+
+
+def test_resume_backfill(tmp_path, monkeypatch) -> None:
+    path = str(tmp_path / "game.db")
+    _create_db(path, 250)
+    backfill = migrations.Backfill("test", "test", "value=1")
+    monkeypatch.setitem(migrations.BACKFILLS, DATABASE_VERSION + 1, [backfill])
+    monkeypatch.setattr(migrations, "MIGRATION_CHUNK_SIZE", 100)
+
+    # the backfill was interrupted after the first 150 rows
+    database = sqlite3.connect(path)
+    migrations.run_migrations(path)  # create the progress table
+    database.execute("INSERT INTO migration_backfill VALUES ('test', 150, 250)")
+    database.commit()
+    migrations.run_migrations(path)
+
+    query = "SELECT count(*) FROM test WHERE value IS NOT NULL"
+    assert database.execute(query).fetchone()[0] == 100
+    assert not database.execute("SELECT * FROM migration_backfill").fetchall()
+    database.close()
+
+
+@pytest.mark.asyncio
+async def test_background_backfill(tmp_path, monkeypatch) -> None:
+    path = str(tmp_path / "game.db")
+    _create_db(path, 250)
+    backfill = migrations.Backfill("test", "test", "value=1", blocking=False)
+    monkeypatch.setitem(migrations.BACKFILLS, DATABASE_VERSION + 1, [backfill])
+    monkeypatch.setattr(migrations, "MIGRATION_CHUNK_SIZE", 100)
+    monkeypatch.setattr(migrations, "MIGRATION_CHUNK_PAUSE", 0)
+    database = sqlite3.connect(path)
+    migrations.run_migrations(path)
+    database.execute("INSERT INTO migration_backfill VALUES ('test', 0, 250)")
+    database.commit()
+
+    # the non-blocking backfill is not run before the bot starts
+    await start_game(str(tmp_path), background_migrations=True)
+    query = "SELECT count(*) FROM test WHERE value IS NOT NULL"
+    assert database.execute(query).fetchone()[0] == 0
+
+    # and is run in background after the bot started
+    for _ in range(100):
+        if not database.execute("SELECT * FROM migration_backfill").fetchall():
+            break
+        await asyncio.sleep(0.01)
+    assert database.execute(query).fetchone()[0] == 250
+    database.close()
+
+
+@pytest.mark.asyncio
+async def test_background_backfill_new_database(tmp_path) -> None:
+    """A new configuration folder has no pending backfills."""
+    await start_game(str(tmp_path), background_migrations=True)
+    await migrations.run_background_backfills()
@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from deltaland.quests import AliasTable, OutcomeQuest, load_quests, quests
+
+
+def test_alias_table() -> None:
+    weights = [1, 2, 3, 4]
+    table = AliasTable(weights)
+    # probability of each index = (own column share + aliased shares) / columns
+    chances = [0.0] * len(weights)
+    for index, (prob, alias) in enumerate(zip(table.prob, table.alias)):
+        chances[index] += prob / len(weights)
+        chances[alias] += (1 - prob) / len(weights)
+    assert chances == pytest.approx([weight / sum(weights) for weight in weights])
+    with pytest.raises(ValueError):
+        AliasTable([])
+
+
+def test_load_quests(tmp_path) -> None:
+    assert all(quest_id == quest.id for quest_id, quest in quests.items())
+    outcome_quests = [q for q in quests.values() if isinstance(q, OutcomeQuest)]
+    for quest in outcome_quests:
+        assert sum(chance for chance, _ in quest.get_outcomes()) == pytest.approx(1)
+
+    quest = {
+        "id": 1,
+        "type": "outcomes",
+        "command": "/test",
+        "name": "Test",
+        "description": "Test quest",
+        "status_msg": "Testing",
+        "parting_msg": "You start testing",
+        "duration": 60,
+        "stamina_cost": 1,
+        "required_level": 0,
+        "outcomes": [{"weight": 1, "gold": [1, 2], "descriptions": ["a", "b"]}],
+    }
+    path = tmp_path / "quests.json"
+    path.write_text(json.dumps({"quests": [quest]}))
+    loaded = load_quests(str(path))[1]
+    assert len(loaded.outcomes) == 2
+    assert loaded.get_result(None).gold in (1, 2)
+
+    path.write_text(json.dumps({"quests": [quest, quest]}))
+    with pytest.raises(ValueError):
+        load_quests(str(path))
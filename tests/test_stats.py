@@ -0,0 +1,25 @@
+from deltaland.stats import COUNT_BUCKETS, Histogram
+
+
+def test_histogram() -> None:
+    hist = Histogram(window=10)
+    assert hist.percentile(50) == 0.0
+    for i in range(1, 21):
+        hist.observe(i / 1000)
+    assert hist.count == 20
+    assert round(hist.total, 3) == 0.21
+    # only the 10 most recent samples are used for percentiles
+    assert hist.percentile(0) == 0.011
+    assert hist.percentile(50) == 0.015
+    assert hist.percentile(100) == 0.02
+    assert sum(hist.buckets) == 20
+
+
+def test_histogram_buckets() -> None:
+    hist = Histogram(COUNT_BUCKETS)
+    for value in (0, 1, 3, 1000):
+        hist.observe(value)
+    assert hist.buckets[0] == 1  # <= 0
+    assert hist.buckets[1] == 1  # <= 1
+    assert hist.buckets[3] == 1  # <= 5
+    assert hist.buckets[-1] == 1  # +Inf